@@ -0,0 +1,139 @@
+"""Embedding backends, configured by alias in ``settings.EMBEDDING_BACKENDS``.
+
+Like ``CACHES``/``STORAGES``, each alias names a ``BACKEND`` class path and
+its ``OPTIONS``. ``settings.EMBEDDING_BACKEND`` is the alias used to index
+chunks and to embed search queries (the two must match: vectors from
+different backends are not comparable). Other aliases can be passed
+explicitly, e.g. the local backend for a cheap first-pass similarity.
+
+``model_name`` identifies the vector space: it keys ``EmbeddingCache`` and
+the query-embedding cache.
+"""
+import functools
+import hashlib
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_client = None
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        import google.generativeai as genai
+        genai.configure(
+            api_key=settings.GEMINI_API_KEY,
+            transport="rest",
+        )
+        _client = genai
+    return _client
+
+
+class EmbeddingBackend(ABC):
+    """Turns texts into ``dimensions``-long vectors."""
+
+    model_name: str
+    dimensions: int
+
+    @abstractmethod
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Vectors for texts to be indexed (chunks)."""
+
+    @abstractmethod
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Vectors for search queries."""
+
+
+class GeminiBackend(EmbeddingBackend):
+    """Gemini embeddings API (``retrieval_document``/``retrieval_query`` tasks)."""
+
+    def __init__(self, model: str = "", dimensions: int = 0, timeout: int = 60):
+        self.model_name = model or settings.GEMINI_EMBEDDING_MODEL
+        self.dimensions = dimensions or settings.EMBEDDING_DIMENSIONS
+        self.timeout = timeout
+
+    def _embed(self, texts: list[str], task_type: str) -> list[list[float]]:
+        result = _get_client().embed_content(
+            model=f"models/{self.model_name}",
+            content=texts,
+            task_type=task_type,
+            request_options={"timeout": self.timeout, "retry": None},
+        )
+        return result["embedding"]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts, "retrieval_document")
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts, "retrieval_query")
+
+
+class HashingBackend(EmbeddingBackend):
+    """Deterministic, offline feature hashing of words and character n-grams.
+
+    Each feature is hashed (BLAKE2b, stable across processes) to a bucket
+    and a sign; counts are log-scaled and the vector L2-normalized, so
+    cosine similarity reflects shared vocabulary. Accents and case are
+    folded. No semantics: meant for offline load tests of the indexing
+    pipeline and cheap pre-filtering, not as a substitute for Gemini.
+    """
+
+    def __init__(self, dimensions: int = 0, ngram: int = 3):
+        self.dimensions = dimensions or settings.EMBEDDING_DIMENSIONS
+        self.ngram = ngram
+        self.model_name = f"hashing-{ngram}gram-{self.dimensions}"
+
+    def _features(self, text: str) -> list[str]:
+        folded = unicodedata.normalize("NFKD", text.casefold())
+        words = re.findall(r"\w+", "".join(c for c in folded if not unicodedata.combining(c)))
+        features = [f"w:{w}" for w in words]
+        for word in words:
+            padded = f" {word} "
+            features.extend(padded[i : i + self.ngram] for i in range(len(padded) - self.ngram + 1))
+        return features
+
+    def _vector(self, text: str) -> list[float]:
+        features = self._features(text)
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        if not features:
+            return vector.tolist()
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), "little") for f in features],
+            dtype=np.uint64,
+        )
+        buckets = (hashes % np.uint64(self.dimensions)).astype(np.int64)
+        signs = np.where(hashes >> np.uint64(63), -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, buckets, signs)
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+
+@functools.cache
+def _load(alias: str) -> EmbeddingBackend:
+    try:
+        config = settings.EMBEDDING_BACKENDS[alias]
+    except KeyError:
+        raise ValueError(f"Unknown embedding backend {alias!r}") from None
+    return import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+
+
+def get_backend(alias: str | None = None) -> EmbeddingBackend:
+    """The backend for ``alias`` (default ``settings.EMBEDDING_BACKEND``), one instance per process."""
+    return _load(alias or settings.EMBEDDING_BACKEND)
+
+
+def reset():
+    """Drop loaded backends (after changing ``EMBEDDING_BACKENDS``, e.g. in tests)."""
+    _load.cache_clear()
@@ -1,89 +1,445 @@
-"""Embedding generation and vector search using Gemini + pgvector."""
+"""Embedding generation (see ``apps.ai_engine.backends``) and vector search with pgvector."""
+import functools
+import hashlib
 import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 from django.conf import settings
-from pgvector.django import CosineDistance
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import FloatField, Func, IntegerField, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+from pgvector.django import BitField, CosineDistance
+from pgvector.psycopg.bit import register_bit_info
+from pgvector.psycopg.vector import register_vector_info
+from psycopg.types import TypeInfo
 
 from apps.opportunities.models import DocumentChunk
 
+from . import quantization, retriever
+from .backends import EmbeddingBackend, get_backend
+from .models import EmbeddingCache
+
 logger = logging.getLogger(__name__)
 
-_client = None
+EMBED_BATCH_SIZE = 100  # texts per embed_content request
 
+# Worker-local LRU in front of the Redis query-embedding cache; float32
+# arrays (12 KB per 3072-dim vector, a list of floats takes ~100 KB)
+_query_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_query_lock = threading.Lock()
 
-def _get_client():
-    global _client
-    if _client is None:
-        import google.generativeai as genai
-        genai.configure(
-            api_key=settings.GEMINI_API_KEY,
-            transport="rest",
-        )
-        _client = genai
-    return _client
-
-
-def generate_embedding(text: str) -> list[float]:
-    """Generate embedding vector for a text string."""
-    client = _get_client()
-    result = client.embed_content(
-        model=f"models/{settings.GEMINI_EMBEDDING_MODEL}",
-        content=text,
-        task_type="retrieval_document",
-        request_options={"timeout": 30, "retry": None},
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def generate_embedding(text: str, backend: str | None = None) -> list[float]:
+    """Generate embedding vector for a text string (cached by text hash)."""
+    embedder = get_backend(backend)
+    text_hash = _text_hash(text)
+    cached = EmbeddingCache.objects.filter(
+        text_hash=text_hash, model_name=embedder.model_name, embedding__isnull=False,
+    ).first()
+    if cached is not None:
+        return cached.embedding.tolist()
+
+    embedding = embedder.embed_documents([text])[0]
+    EmbeddingCache.objects.bulk_create(
+        [EmbeddingCache(text_hash=text_hash, model_name=embedder.model_name, embedding=embedding)],
+        ignore_conflicts=True,
     )
-    return result["embedding"]
+    return embedding
+
+
+def _embed_batch(texts: list[str], embedder: EmbeddingBackend) -> list[list[float]]:
+    return embedder.embed_documents(texts)
+
+
+def index_prefix_sql(column: str) -> str:
+    """SQL for the indexed prefix of a vector column (see ``DocumentChunk.embedding_index``).
+
+    Goes through ``real[]`` because ``subvector()`` needs pgvector 0.7.
+    """
+    return f"(({column})::real[])[1:{int(settings.EMBEDDING_INDEX_DIMENSIONS)}]::vector"
+
+
+def _temp_table(cursor, name: str, columns: str):
+    # ON COMMIT DROP; inside an outer transaction the table outlives the batch
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {name} ({columns}) ON COMMIT DROP")
+    cursor.execute(f"TRUNCATE {name}")
+
+
+def _register_types(raw_cursor):
+    """Binary dumpers for ``vector`` and ``bit`` on a psycopg cursor (for COPY)."""
+    register_vector_info(raw_cursor, TypeInfo.fetch(raw_cursor.connection, "vector"))
+    register_bit_info(raw_cursor, TypeInfo.fetch(raw_cursor.connection, "bit"))
+
+
+def _needs_float(column: str) -> bool:
+    """Whether the chunk column written needs the float vector from the cache."""
+    return column == "embedding_next" or settings.EMBEDDING_STORAGE != "int8"
+
 
+def _quantize_cache_rows(hashes: list[str], model_name: str):
+    """Fill the int8/bit columns of cache rows that only have the float vector."""
+    stale = list(EmbeddingCache.objects.filter(
+        model_name=model_name, text_hash__in=hashes, embedding_int8__isnull=True, embedding__isnull=False,
+    ))
+    for row in stale:
+        row.embedding_int8 = quantization.int8_bytes(row.embedding)
+        row.embedding_bits = quantization.to_bits(row.embedding).to_text()
+    EmbeddingCache.objects.bulk_update(stale, ["embedding_int8", "embedding_bits"])
 
-def embed_chunks(chunks: list[DocumentChunk]) -> int:
-    """Generate and save embeddings for a list of chunks."""
-    client = _get_client()
-    texts = [c.content for c in chunks]
 
-    batch_size = 100
-    embedded_count = 0
+def _write_embeddings(
+    chunks: list[DocumentChunk], hashes: list[str], vectors: dict[str, list[float]], model_name: str,
+    column: str = "embedding",
+):
+    """Add new vectors to ``EmbeddingCache`` and set every chunk's embedding from it.
 
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i : i + batch_size]
-        batch_chunks = chunks[i : i + batch_size]
+    New vectors go in with a binary COPY (3072 floats per row as text, and
+    parsing them back, is what made per-row saves slow); chunks are then
+    updated with one UPDATE ... FROM joined on the text hash, so cached
+    vectors never leave the database. The chunk gets the float vector and
+    its HNSW prefix, or only the quantized forms when ``EMBEDDING_STORAGE``
+    is ``"int8"`` (see ``apps.ai_engine.quantization``). With ``column``
+    ``"embedding_next"`` only that column is set (model migration).
 
-        result = client.embed_content(
-            model=f"models/{settings.GEMINI_EMBEDDING_MODEL}",
-            content=batch_texts,
-            task_type="retrieval_document",
-            request_options={"timeout": 60, "retry": None},
+    The cache stores the same forms as the chunks: in int8 mode new rows
+    have no float vector. Rows cached in the other mode are completed (see
+    ``embed_chunks`` and ``_quantize_cache_rows``).
+    """
+    needs_float = _needs_float(column)
+    dimensions = EmbeddingCache._meta.get_field("embedding").dimensions
+    with transaction.atomic(), connection.cursor() as cursor:
+        raw = cursor.cursor
+        if vectors:
+            _register_types(raw)
+            _temp_table(
+                cursor, "_new_embeddings",
+                f"text_hash text PRIMARY KEY, embedding vector({dimensions}), "
+                f"embedding_int8 bytea, embedding_bits bit({dimensions})",
+            )
+            with raw.copy(
+                "COPY _new_embeddings (text_hash, embedding, embedding_int8, embedding_bits) "
+                "FROM STDIN WITH (FORMAT BINARY)"
+            ) as copy:
+                copy.set_types(["text", "vector", "bytea", "bit"])
+                for text_hash, emb in vectors.items():
+                    emb = np.asarray(emb, dtype=np.float32)
+                    if needs_float:
+                        copy.write_row((text_hash, emb, None, None))
+                    else:
+                        copy.write_row((text_hash, None, quantization.int8_bytes(emb), quantization.to_bits(emb)))
+            # A row cached without the float vector was sent again (see
+            # ``embed_chunks``): complete it
+            cursor.execute(
+                f"INSERT INTO {EmbeddingCache._meta.db_table} AS e "
+                "(text_hash, model_name, embedding, embedding_int8, embedding_bits, created_at) "
+                "SELECT text_hash, %s, embedding, embedding_int8, embedding_bits, %s FROM _new_embeddings "
+                "ON CONFLICT (text_hash, model_name) DO UPDATE SET embedding = EXCLUDED.embedding "
+                "WHERE e.embedding IS NULL AND EXCLUDED.embedding IS NOT NULL",
+                [model_name, timezone.now()],
+            )
+
+        if column == "embedding_next":
+            assignments = "embedding_next = e.embedding"
+        elif settings.EMBEDDING_STORAGE == "int8":
+            _quantize_cache_rows(hashes, model_name)
+            assignments = (
+                "embedding = NULL, embedding_index = NULL, "
+                "embedding_int8 = e.embedding_int8, embedding_bits = e.embedding_bits"
+            )
+        else:
+            assignments = (
+                f"embedding = e.embedding, embedding_index = {index_prefix_sql('e.embedding')}, "
+                "embedding_int8 = NULL, embedding_bits = NULL"
+            )
+
+        _temp_table(cursor, "_chunk_text_hashes", "id uuid PRIMARY KEY, text_hash text")
+        with raw.copy("COPY _chunk_text_hashes (id, text_hash) FROM STDIN") as copy:
+            for chunk, text_hash in zip(chunks, hashes):
+                copy.write_row((chunk.pk, text_hash))
+        cursor.execute(
+            f"UPDATE {DocumentChunk._meta.db_table} AS c "
+            f"SET {assignments}, updated_at = %s "
+            "FROM _chunk_text_hashes AS h "
+            f"JOIN {EmbeddingCache._meta.db_table} AS e ON e.text_hash = h.text_hash AND e.model_name = %s "
+            "WHERE c.id = h.id",
+            [timezone.now(), model_name],
         )
 
-        for chunk, emb in zip(batch_chunks, result["embedding"]):
-            chunk.embedding = emb
-            chunk.save(update_fields=["embedding", "updated_at"])
-            embedded_count += 1
 
-    logger.info("Embedded %d chunks", embedded_count)
+def embed_chunks(chunks: list[DocumentChunk], backend: str | None = None, column: str = "embedding") -> int:
+    """Generate and save embeddings for a list of chunks.
+
+    Chunks must carry ``content`` (see ``DocumentChunk.objects.with_content()``);
+    empty ones are skipped. Texts already in ``EmbeddingCache`` (or repeated
+    within the list) are not sent to the API. Each batch is written in one
+    transaction (see ``_write_embeddings``) while the request for the next
+    batch is already in flight.
+
+    While ``EMBEDDING_NEXT_BACKEND`` is set (a model migration, see the
+    ``reindex_documents`` command), vectors written to ``embedding`` are
+    also written to ``embedding_next`` with that backend.
+    """
+    embedder = get_backend(backend)
+    model_name = embedder.model_name
+    if embedder.dimensions != settings.EMBEDDING_DIMENSIONS:
+        raise ValueError(
+            f"Embedding backend {model_name} has {embedder.dimensions} dimensions, "
+            f"the chunk columns {settings.EMBEDDING_DIMENSIONS}"
+        )
+    chunks = [c for c in chunks if c.content.strip()]
+    batches = [chunks[i : i + EMBED_BATCH_SIZE] for i in range(0, len(chunks), EMBED_BATCH_SIZE)]
+    if not batches:
+        return 0
+    requested: set[str] = set()  # hashes sent to the API by earlier batches
+
+    # Rows cached in int8 mode have no float vector to copy
+    hits = EmbeddingCache.objects.filter(model_name=model_name)
+    if _needs_float(column):
+        hits = hits.filter(embedding__isnull=False)
+
+    def plan(batch):
+        hashes = [_text_hash(c.content) for c in batch]
+        cached = set(hits.filter(text_hash__in=hashes).values_list("text_hash", flat=True))
+        misses = {}
+        for text_hash, chunk in zip(hashes, batch):
+            if text_hash not in cached and text_hash not in requested:
+                misses.setdefault(text_hash, chunk.content)
+        requested.update(misses)
+        return hashes, misses
+
+    def fetch(misses):
+        if not misses:
+            return {}
+        return dict(zip(misses, _embed_batch(list(misses.values()), embedder)))
+
+    embedded_count = api_count = 0
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed") as pool:
+        hashes, misses = plan(batches[0])
+        pending = pool.submit(fetch, misses)
+        for i, batch_chunks in enumerate(batches):
+            vectors = pending.result()
+            if i + 1 < len(batches):
+                next_hashes, next_misses = plan(batches[i + 1])
+                pending = pool.submit(fetch, next_misses)
+
+            _write_embeddings(batch_chunks, hashes, vectors, model_name, column)
+            embedded_count += len(batch_chunks)
+            api_count += len(vectors)
+            if i + 1 < len(batches):
+                hashes = next_hashes
+
+    logger.info(
+        "Embedded %d chunks, %d sent to the API (cache hit rate %.0f%%)",
+        embedded_count, api_count, 100 * (1 - api_count / embedded_count),
+    )
+    if column == "embedding" and settings.EMBEDDING_NEXT_BACKEND:
+        embed_chunks(chunks, settings.EMBEDDING_NEXT_BACKEND, column="embedding_next")
     return embedded_count
 
 
+def _normalize_query(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _query_cache_key(query: str, model_name: str) -> str:
+    return f"qemb:{model_name}:{_text_hash(query)}"
+
+
+def _remember_query(key: str, embedding: np.ndarray):
+    with _query_lock:
+        _query_embeddings[key] = embedding
+        _query_embeddings.move_to_end(key)
+        while len(_query_embeddings) > settings.QUERY_EMBEDDING_CACHE_SIZE:
+            _query_embeddings.popitem(last=False)
+
+
+def _embed_queries(queries: list[str], backend: str | None = None) -> list[list[float]]:
+    """``retrieval_query`` embeddings, cached by normalized text and model.
+
+    Looked up in the worker's LRU, then in Redis (float32 bytes, shared by
+    all workers); only the misses go to the backend, in one request.
+    """
+    embedder = get_backend(backend)
+    normalized = [_normalize_query(q) for q in queries]
+    keys = [_query_cache_key(q, embedder.model_name) for q in normalized]
+    found = {}
+    with _query_lock:
+        for key in keys:
+            if key in _query_embeddings:
+                _query_embeddings.move_to_end(key)
+                found[key] = _query_embeddings[key]
+
+    remote = cache.get_many([key for key in keys if key not in found])
+    for key, raw in remote.items():
+        found[key] = np.frombuffer(raw, dtype=np.float32)
+        _remember_query(key, found[key])
+
+    missing = list(dict.fromkeys(q for q, key in zip(normalized, keys) if key not in found))
+    if missing:
+        fresh = {
+            _query_cache_key(q, embedder.model_name): np.asarray(emb, dtype=np.float32)
+            for q, emb in zip(missing, embedder.embed_queries(missing))
+        }
+        cache.set_many(
+            {key: emb.tobytes() for key, emb in fresh.items()},
+            timeout=settings.QUERY_EMBEDDING_CACHE_TTL,
+        )
+        for key, emb in fresh.items():
+            _remember_query(key, emb)
+        found.update(fresh)
+    logger.debug("Query embeddings: %d/%d cached", len(queries) - len(missing), len(queries))
+    return [found[key].tolist() for key in keys]
+
+
+def fetch_ranked(ranked: list[tuple], attr: str = "distance") -> list[DocumentChunk]:
+    """Load ``(chunk_id, score)`` pairs as chunks with content, in that order, score set on ``attr``.
+
+    Chunks deleted since they were ranked (a concurrent reindex) are left out.
+    """
+    chunks = (
+        DocumentChunk.objects.filter(pk__in=[pk for pk, _ in ranked])
+        .select_related("document").with_content().in_bulk()
+    )
+    results = []
+    for pk, score in ranked:
+        chunk = chunks.get(pk)
+        if chunk is None:
+            continue
+        setattr(chunk, attr, score)
+        results.append(chunk)
+    return results
+
+
+def opportunity_vector_rankings(
+    opportunity_id: str, queries: list[str], limit: int, backend: str | None = None,
+) -> list[list[tuple]]:
+    """Per query, the opportunity's ``limit`` closest chunks as ``(chunk_id, distance)``.
+
+    All queries are embedded in one request and scored with one matrix
+    product against the worker's cached vectors (see ``apps.ai_engine.retriever``).
+    """
+    vectors = retriever.get_vectors(opportunity_id)
+    if not vectors.chunk_ids or not queries:
+        return []
+    return vectors.search(_embed_queries(queries, backend), limit)
+
+
+def search_opportunity_chunks(
+    opportunity_id: str, queries: list[str], top_k: int = 10, backend: str | None = None,
+) -> list[DocumentChunk]:
+    """Chunks of one opportunity closest to any of the queries, best first.
+
+    A chunk matched by several queries keeps its best distance.
+    """
+    best: dict = {}
+    for matches in opportunity_vector_rankings(opportunity_id, queries, top_k, backend):
+        for pk, distance in matches:
+            if distance < best.get(pk, float("inf")):
+                best[pk] = distance
+    return fetch_ranked(sorted(best.items(), key=lambda item: item[1])[:top_k])
+
+
 def search_similar_chunks(
     query: str,
     opportunity_id: str | None = None,
     top_k: int = 10,
+    backend: str | None = None,
 ) -> list[DocumentChunk]:
-    """Find the most relevant chunks for a query using cosine similarity."""
-    client = _get_client()
-    result = client.embed_content(
-        model=f"models/{settings.GEMINI_EMBEDDING_MODEL}",
-        content=query,
-        task_type="retrieval_query",
-        request_options={"timeout": 30, "retry": None},
-    )
-    query_embedding = result["embedding"]
+    """Find the most relevant chunks for a query using cosine similarity.
 
-    qs = DocumentChunk.objects.filter(embedding__isnull=False)
+    Within one opportunity the search is exact, in memory
+    (``search_opportunity_chunks``). Corpus-wide, the HNSW index on
+    ``embedding_index`` yields ``VECTOR_SEARCH_CANDIDATES`` candidates,
+    which are re-ranked with the full vector. With int8 storage see
+    ``_search_quantized``.
+    """
     if opportunity_id:
-        qs = qs.filter(document__opportunity_id=opportunity_id)
+        return search_opportunity_chunks(opportunity_id, [query], top_k, backend)
+
+    query_embedding = _embed_queries([query], backend)[0]
+    if settings.EMBEDDING_STORAGE == "int8":
+        return _search_quantized(query_embedding, top_k)
+
+    limit = max(settings.VECTOR_SEARCH_CANDIDATES, top_k)
+    candidates = (
+        DocumentChunk.objects.filter(embedding_index__isnull=False)
+        .order_by(CosineDistance("embedding_index", query_embedding[: settings.EMBEDDING_INDEX_DIMENSIONS]))
+        .values("pk")[:limit]
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        # HNSW returns at most ef_search rows
+        cursor.execute(f"SET LOCAL hnsw.ef_search = {int(max(settings.HNSW_EF_SEARCH, limit))}")
+        results = list(
+            DocumentChunk.objects.filter(pk__in=candidates).with_content()
+            .annotate(distance=CosineDistance("embedding", query_embedding))
+            .order_by("distance")[:top_k]
+        )
+    return results
+
+
+class _HammingDistance(Func):
+    """``bit_count(a # b)``: works on any pgvector version (``<~>`` needs 0.7)."""
+
+    template = "bit_count(%(expressions)s)"
+    arg_joiner = " # "
+    output_field = IntegerField()
+
+
+class _HammingOperator(Func):
+    """``a <~> b``: the operator the HNSW index on ``embedding_bits`` serves (pgvector 0.7)."""
+
+    template = "%(expressions)s"
+    arg_joiner = " <~> "
+    output_field = FloatField()
+
+
+@functools.cache
+def _pgvector_version() -> tuple[int, ...]:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cursor.fetchone()
+    return tuple(int(part) for part in row[0].split(".")) if row else ()
+
+
+def _hamming_distance(query_bits) -> Func:
+    """Ordering by Hamming distance, through the HNSW index when pgvector has it."""
+    if _pgvector_version() >= (0, 7):
+        return _HammingOperator("embedding_bits", query_bits)
+    return _HammingDistance("embedding_bits", query_bits)
+
+
+def _search_quantized(query_embedding: list[float], top_k: int) -> list[DocumentChunk]:
+    """Hamming distance on the sign bits for candidates, int8 cosine to rank them.
+
+    With pgvector 0.7 the candidates come from the HNSW index on
+    ``embedding_bits`` (migration 0021); older versions scan every row. The
+    ranking is int8, not float: recall and latency are in ARCHITECTURE.md
+    (``scripts/bench_quantization.py``).
+    """
+    query_bits = Cast(Value(quantization.to_bits(query_embedding).to_text()), BitField(length=len(query_embedding)))
+    candidates = DocumentChunk.objects.filter(embedding_bits__isnull=False)
+    limit = max(settings.QUANTIZED_SEARCH_CANDIDATES, top_k)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # HNSW returns at most ef_search rows
+        cursor.execute(f"SET LOCAL hnsw.ef_search = {int(max(settings.HNSW_EF_SEARCH, limit))}")
+        rows = list(
+            candidates.order_by(_hamming_distance(query_bits))
+            .values_list("pk", "embedding_int8")[:limit]
+        )
+    if not rows:
+        return []
 
-    results = (
-        qs.annotate(distance=CosineDistance("embedding", query_embedding))
-        .order_by("distance")[:top_k]
+    distances = quantization.cosine_distances(
+        query_embedding, quantization.from_int8_bytes(row[1] for row in rows)
     )
-    return list(results)
+    return fetch_ranked([(rows[i][0], float(distances[i])) for i in np.argsort(distances)[:top_k]])
@@ -0,0 +1,117 @@
+"""Gemini generation with a persistent response cache.
+
+Re-running an analysis or a match whose inputs have not changed sends the
+exact same prompt again. Responses are stored in ``LLMResponseCache`` under
+the SHA-256 of everything that determines them: system prompt, user prompt,
+model, ``PROMPT_VERSION`` and generation config. Bumping ``PROMPT_VERSION``
+or changing the model therefore never serves stale answers.
+
+Entries older than ``LLM_CACHE_TTL`` are ignored and deleted by ``prune``
+(daily beat task), which also keeps at most ``LLM_CACHE_MAX_ENTRIES``,
+dropping the least recently used. ``bypass_cache=True`` skips the lookup
+and stores the fresh response in place of the old one.
+"""
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import prompts
+from .models import LLMResponseCache
+
+logger = logging.getLogger(__name__)
+
+GENERATION_CONFIG = {"temperature": 0.1, "max_output_tokens": 16000}
+JSON_INSTRUCTION = "\n\nIMPORTANTE: Responda APENAS com JSON válido, sem markdown ou texto adicional."
+
+
+@dataclass
+class Generation:
+    text: str
+    tokens: int  # consumed by this call: 0 on a cache hit
+    cached: bool = False
+
+
+def fingerprint(system: str, user: str, model_name: str, prompt_version: str,
+                generation_config: dict) -> str:
+    payload = json.dumps(
+        [system, user, model_name, prompt_version, generation_config],
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def parse_json(text: str) -> dict | None:
+    """The JSON object in a response, markdown code fences stripped; None if invalid."""
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        lines = cleaned.split("\n")
+        lines = [line for line in lines if not line.strip().startswith("```")]
+        cleaned = "\n".join(lines)
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        return None
+
+
+def generate(model, system: str, user: str, *, json_response: bool = True,
+             bypass_cache: bool = False, request_options: dict | None = None) -> Generation:
+    """Response of ``model`` (a ``GenerativeModel`` built with ``GENERATION_CONFIG``), cached."""
+    if json_response:
+        user += JSON_INSTRUCTION
+    key = fingerprint(system, user, settings.GEMINI_MODEL, prompts.PROMPT_VERSION, GENERATION_CONFIG)
+    now = timezone.now()
+
+    if settings.LLM_CACHE_ENABLED and not bypass_cache:
+        entry = (
+            LLMResponseCache.objects.filter(
+                fingerprint=key, created_at__gte=now - timedelta(seconds=settings.LLM_CACHE_TTL),
+            )
+            .only("response")
+            .first()
+        )
+        if entry is not None:
+            LLMResponseCache.objects.filter(pk=entry.pk).update(hits=F("hits") + 1, used_at=now)
+            return Generation(entry.response, 0, cached=True)
+
+    kwargs = {"request_options": request_options} if request_options else {}
+    resp = model.generate_content(f"{system}\n\n---\n\n{user}", **kwargs)
+    text = resp.text
+    tokens = 0
+    if resp.usage_metadata:
+        tokens = (resp.usage_metadata.prompt_token_count or 0) + (resp.usage_metadata.candidates_token_count or 0)
+
+    # An unparseable answer is worth retrying, not replaying
+    if settings.LLM_CACHE_ENABLED and (not json_response or parse_json(text) is not None):
+        LLMResponseCache.objects.update_or_create(
+            fingerprint=key,
+            defaults={
+                "model_name": settings.GEMINI_MODEL,
+                "prompt_version": prompts.PROMPT_VERSION,
+                "response": text,
+                "tokens_used": tokens,
+                "created_at": now,
+                "used_at": now,
+            },
+        )
+    return Generation(text, tokens)
+
+
+def prune() -> int:
+    """Delete expired entries and the least recently used beyond ``LLM_CACHE_MAX_ENTRIES``."""
+    cutoff = timezone.now() - timedelta(seconds=settings.LLM_CACHE_TTL)
+    deleted, _ = LLMResponseCache.objects.filter(created_at__lt=cutoff).delete()
+    excess = list(
+        LLMResponseCache.objects.order_by("-used_at")
+        .values_list("pk", flat=True)[settings.LLM_CACHE_MAX_ENTRIES:]
+    )
+    if excess:
+        deleted += LLMResponseCache.objects.filter(pk__in=excess).delete()[0]
+    if deleted:
+        logger.info("LLM cache: pruned %d responses", deleted)
+    return deleted
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:10
+
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('core', '0001_pgvector_extension'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text_hash', models.CharField(max_length=64, verbose_name='SHA-256 do texto')),
+                ('model_name', models.CharField(max_length=100, verbose_name='Modelo')),
+                ('embedding', pgvector.django.vector.VectorField(dimensions=3072, verbose_name='Embedding')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Cache de Embedding',
+                'verbose_name_plural': 'Cache de Embeddings',
+                'constraints': [models.UniqueConstraint(fields=('text_hash', 'model_name'), name='uniq_embedding_cache_text_model')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:17
+
+import pgvector.django.bit
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='embeddingcache',
+            name='embedding_bits',
+            field=pgvector.django.bit.BitField(blank=True, length=3072, null=True, verbose_name='Embedding binário'),
+        ),
+        migrations.AddField(
+            model_name='embeddingcache',
+            name='embedding_int8',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Embedding int8'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0002_quantized_embeddings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMResponseCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 do prompt')),
+                ('model_name', models.CharField(max_length=100, verbose_name='Modelo')),
+                ('prompt_version', models.CharField(max_length=50, verbose_name='Versão do prompt')),
+                ('response', models.TextField(verbose_name='Resposta')),
+                ('tokens_used', models.PositiveIntegerField(default=0, verbose_name='Tokens da chamada original')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Acertos')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Último uso')),
+            ],
+            options={
+                'verbose_name': 'Cache de Resposta LLM',
+                'verbose_name_plural': 'Cache de Respostas LLM',
+            },
+        ),
+    ]
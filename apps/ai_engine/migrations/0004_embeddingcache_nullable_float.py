@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-19 06:18
+
+import pgvector.django.vector
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_engine', '0003_llm_response_cache'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='embeddingcache',
+            name='embedding',
+            field=pgvector.django.vector.VectorField(blank=True, dimensions=3072, null=True, verbose_name='Embedding'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+"""AI engine models — caches shared across documents."""
+from django.db import models
+from django.utils import timezone
+from pgvector.django import BitField, VectorField
+
+
+class EmbeddingCache(models.Model):
+    """Embedding já calculado para um texto, reaproveitado entre documentos.
+
+    Editais repetem muito texto padrão (citações da Lei 14.133, cláusulas de
+    habilitação); a chave é o SHA-256 do texto do chunk mais o modelo.
+    Guarda as formas que os chunks usam: o vetor float ou, com
+    ``EMBEDDING_STORAGE = "int8"``, só as formas quantizadas.
+    """
+
+    text_hash = models.CharField("SHA-256 do texto", max_length=64)
+    model_name = models.CharField("Modelo", max_length=100)
+    embedding = VectorField("Embedding", dimensions=3072, null=True, blank=True)
+    embedding_int8 = models.BinaryField("Embedding int8", null=True, blank=True)
+    embedding_bits = BitField("Embedding binário", length=3072, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Cache de Embedding"
+        verbose_name_plural = "Cache de Embeddings"
+        constraints = [
+            models.UniqueConstraint(fields=["text_hash", "model_name"], name="uniq_embedding_cache_text_model"),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} — {self.text_hash[:12]}"
+
+
+class LLMResponseCache(models.Model):
+    """Resposta do LLM reaproveitada quando o mesmo prompt é enviado de novo.
+
+    A chave é o SHA-256 de prompt de sistema, prompt do usuário, modelo,
+    ``PROMPT_VERSION`` e configuração de geração (ver ``apps.ai_engine.llm``).
+    """
+
+    fingerprint = models.CharField("SHA-256 do prompt", max_length=64, unique=True)
+    model_name = models.CharField("Modelo", max_length=100)
+    prompt_version = models.CharField("Versão do prompt", max_length=50)
+    response = models.TextField("Resposta")
+    tokens_used = models.PositiveIntegerField("Tokens da chamada original", default=0)
+    hits = models.PositiveIntegerField("Acertos", default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    used_at = models.DateTimeField("Último uso", default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Cache de Resposta LLM"
+        verbose_name_plural = "Cache de Respostas LLM"
+
+    def __str__(self):
+        return f"{self.model_name} {self.prompt_version} — {self.fingerprint[:12]}"
@@ -1,24 +1,285 @@
 """
 AI Pipeline — Document processing: PDF → text → chunks → embeddings.
 
-Estratégia de OCR:
-1. Tenta extrair texto com pdfplumber (nativo).
-2. Se o texto extraído for muito curto (< 100 chars por página), assume PDF escaneado.
-3. Aciona OCR com pytesseract via conversão PDF → imagem.
+Estratégia de extração de PDF (por página):
+1. Tenta o motor rápido (PyPDF2, texto puro, sem análise de layout).
+2. Páginas em que o resultado parece quebrado (caracteres inválidos, palavras
+   coladas, texto vazio) ou com muita cara de tabela voltam para o pdfplumber,
+   que faz análise de layout completa.
+3. Páginas com texto muito curto (< 100 chars) são tratadas como escaneadas:
+   cada uma é renderizada isoladamente e passa por OCR (pytesseract), com o
+   resultado em cache por (hash do arquivo, página).
+
+O motor usado em cada página fica registrado (``ExtractedPage.engine``).
 """
+import bisect
+import contextlib
+import ctypes
+import functools
+import hashlib
 import io
 import logging
+import multiprocessing
+import os
 import re
+import signal
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
 
 import pdfplumber
 import tiktoken
 from django.conf import settings
+from django.core.cache import cache
 
 logger = logging.getLogger(__name__)
 
 CHUNK_SIZE = 800  # tokens
 CHUNK_OVERLAP = 100  # tokens
 
+OCR_MIN_CHARS_PER_PAGE = 100
+OCR_DPI = 200
+
+ZIP_READ_CHUNK = 1024 * 1024
+
+# Motores de extração registrados por página
+ENGINE_FAST = "pypdf"
+ENGINE_LAYOUT = "pdfplumber"
+ENGINE_OCR = "ocr"
+ENGINE_DOCX = "docx"
+ENGINE_TEXT = "text"
+
+# Heurísticas do fallback para pdfplumber
+_FAST_MIN_CHARS = 40  # abaixo disso o motor rápido provavelmente falhou
+_BROKEN_CHAR_RATIO = 0.02  # fração de caracteres inválidos/de controle
+_GLUED_WORD_LEN = 25  # comprimento médio de "palavra" que indica espaços perdidos
+_TABLE_LINE_RATIO = 0.3  # fração de linhas com cara de linha de tabela
+_TABLE_MIN_LINES = 5
+
+_NUMERIC_TOKEN = re.compile(r"^(R\$)?\d[\d.,/%-]*$")
+_COLUMN_GAP = re.compile(r"\S {2,}\S")
+
+
+@dataclass
+class ExtractedPage:
+    text: str
+    engine: str
+    member: str = ""  # path inside a ZIP archive, when the page came from one
+    member_page: int | None = None  # 1-based page number within that member
+
+
+@dataclass
+class ExtractionResult:
+    """Texto extraído página a página, com o motor usado em cada uma."""
+
+    pages: list[ExtractedPage] = field(default_factory=list)
+    ocr_used: bool = False
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(p.text for p in self.pages)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def page_map(self) -> list[dict]:
+        """One entry per page: engine used and start offset of the page in ``text``."""
+        entries = []
+        offset = 0
+        for page in self.pages:
+            entry = {"engine": page.engine, "offset": offset}
+            if page.member:
+                entry.update(member=page.member, member_page=page.member_page)
+            entries.append(entry)
+            offset += len(page.text) + 2  # "\n\n" separator
+        return entries
+
+    def page_offsets(self) -> list[int]:
+        return [entry["offset"] for entry in self.page_map()]
+
+
+def _page_needs_layout(text: str) -> bool:
+    """True when the fast engine's page text looks broken or table-heavy."""
+    stripped = text.strip()
+    if len(stripped) < _FAST_MIN_CHARS:
+        return True
+
+    bad = stripped.count("\ufffd") + stripped.count("(cid:")
+    bad += sum(1 for ch in stripped if ord(ch) < 32 and ch not in "\n\t\r")
+    if bad / len(stripped) > _BROKEN_CHAR_RATIO:
+        return True
+
+    words = stripped.split()
+    if words and sum(len(w) for w in words) / len(words) > _GLUED_WORD_LEN:
+        return True
+
+    lines = [line for line in stripped.splitlines() if line.strip()]
+    if len(lines) >= _TABLE_MIN_LINES:
+        table_like = 0
+        for line in lines:
+            numeric = sum(1 for tok in line.split() if _NUMERIC_TOKEN.match(tok))
+            if numeric >= 3 or len(_COLUMN_GAP.findall(line)) >= 2:
+                table_like += 1
+        if table_like / len(lines) >= _TABLE_LINE_RATIO:
+            return True
+
+    return False
+
+
+def _open(source: bytes | str):
+    """File-like for PDF bytes, or the path itself (used by shard workers)."""
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def _count_pages(source: bytes | str) -> int | None:
+    try:
+        from PyPDF2 import PdfReader
+
+        return len(PdfReader(_open(source)).pages)
+    except Exception:
+        return None
+
+
+def _extract_fast_pages(source: bytes | str, start: int = 0, stop: int | None = None) -> list[str] | None:
+    """Plain text per page with PyPDF2. None if the file can't be parsed."""
+    try:
+        from PyPDF2 import PdfReader
+
+        reader = PdfReader(_open(source))
+        pages = []
+        for page in reader.pages[start:stop]:
+            try:
+                pages.append(page.extract_text() or "")
+            except Exception:
+                pages.append("")
+        return pages
+    except Exception:
+        logger.debug("PyPDF2 could not parse PDF, using pdfplumber", exc_info=True)
+        return None
+
+
+def _extract_pages(source: bytes | str, start: int = 0, stop: int | None = None) -> list[ExtractedPage]:
+    """Tiered text extraction for pages ``[start, stop)``, without OCR."""
+    fast_pages = _extract_fast_pages(source, start, stop)
+    try:
+        if fast_pages is None:
+            with pdfplumber.open(_open(source)) as pdf:
+                return [
+                    ExtractedPage(page.extract_text() or "", ENGINE_LAYOUT)
+                    for page in pdf.pages[start:stop]
+                ]
+
+        pages = [ExtractedPage(text, ENGINE_FAST) for text in fast_pages]
+        retry = [i for i, text in enumerate(fast_pages) if _page_needs_layout(text)]
+        if retry:
+            with pdfplumber.open(_open(source)) as pdf:
+                for i in retry:
+                    layout_text = pdf.pages[start + i].extract_text() or ""
+                    if layout_text.strip():
+                        pages[i] = ExtractedPage(layout_text, ENGINE_LAYOUT)
+        return pages
+    except Exception:
+        logger.exception("pdfplumber extraction failed")
+        return [] if fast_pages is None else [ExtractedPage(t, ENGINE_FAST) for t in fast_pages]
+
+
+_PR_SET_PDEATHSIG = 1
+
+
+def _die_with_parent():
+    """Pool initializer: exit if the worker that started the pool is killed (Linux only)."""
+    with contextlib.suppress(OSError, AttributeError):
+        ctypes.CDLL(None, use_errno=True).prctl(_PR_SET_PDEATHSIG, signal.SIGTERM)
+
+
+@contextlib.contextmanager
+def _allow_children():
+    """Let a daemonic process (a Celery prefork child) start a process pool.
+
+    ``multiprocessing`` refuses children of daemonic processes so they can't
+    outlive them; here the pool is shut down before the caller returns, and
+    ``_die_with_parent`` covers a worker killed mid-task.
+    """
+    config = multiprocessing.current_process()._config
+    daemon = config.pop("daemon", None)
+    try:
+        yield
+    finally:
+        if daemon is not None:
+            config["daemon"] = daemon
+
+
+def _map_in_processes(fn, args: list[tuple], workers: int) -> list | None:
+    """``[fn(*a) for a in args]`` across a process pool, in order.
+
+    Returns None when a pool can't be started so the caller can fall back to
+    running serially.
+    """
+    try:
+        with _allow_children(), ProcessPoolExecutor(
+            max_workers=min(workers, len(args)), initializer=_die_with_parent,
+        ) as pool:
+            return list(pool.map(fn, *zip(*args)))
+    except (AssertionError, OSError, BrokenProcessPool):
+        logger.warning("Process pool unavailable, running %d jobs serially", len(args), exc_info=True)
+        return None
+
+
+def _extract_sharded(file_content: bytes, page_count: int, workers: int) -> list[ExtractedPage]:
+    """Extract page ranges in a process pool and reassemble them in page order.
+
+    Workers read the PDF from a temp file instead of receiving the bytes, so
+    each shard only pays for parsing.
+    """
+    shard = max(settings.PDF_SHARD_PAGES, -(-page_count // workers))
+    ranges = [(start, min(start + shard, page_count)) for start in range(0, page_count, shard)]
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        tmp.write(file_content)
+        tmp.flush()
+        parts = _map_in_processes(
+            _extract_pages, [(tmp.name, start, stop) for start, stop in ranges], workers,
+        )
+    if parts is None:
+        return _extract_pages(file_content)
+    return [page for part in parts for page in part]
+
+
+def extract_pdf(file_content: bytes, file_hash: str = "", workers: int | None = None) -> ExtractionResult:
+    """Tiered PDF extraction: PyPDF2 first, pdfplumber only where needed, then OCR.
+
+    Documents with more than ``PDF_SHARD_PAGES`` pages are split into page
+    ranges and extracted across ``workers`` processes (default
+    ``PDF_EXTRACTION_WORKERS``). OCR is decided per page: only pages with less
+    than ``OCR_MIN_CHARS_PER_PAGE`` characters of native text are OCR'd.
+    """
+    result = ExtractionResult()
+
+    page_count = _count_pages(file_content)
+    workers = workers or settings.PDF_EXTRACTION_WORKERS
+    if page_count and workers > 1 and page_count > settings.PDF_SHARD_PAGES:
+        result.pages = _extract_sharded(file_content, page_count, workers)
+    else:
+        result.pages = _extract_pages(file_content)
+
+    # Páginas com pouco texto nativo provavelmente são escaneadas: OCR só nelas
+    sparse = [
+        n for n, page in enumerate(result.pages, start=1)
+        if len(page.text.strip()) < OCR_MIN_CHARS_PER_PAGE
+    ]
+    if sparse:
+        logger.info("%d of %d pages with little text, attempting OCR", len(sparse), result.page_count)
+        file_hash = file_hash or hashlib.sha256(file_content).hexdigest()
+        for n, text in _ocr_pages(file_content, sparse, file_hash).items():
+            if len(text.strip()) > len(result.pages[n - 1].text.strip()):
+                result.pages[n - 1] = ExtractedPage(text, ENGINE_OCR)
+                result.ocr_used = True
+
+    return result
+
 
 def extract_text_from_pdf(file_content: bytes) -> tuple[str, int, bool]:
     """
@@ -26,85 +287,264 @@ def extract_text_from_pdf(file_content: bytes) -> tuple[str, int, bool]:
 
     Returns: (text, page_count, ocr_used)
     """
-    text_parts = []
-    page_count = 0
-    ocr_used = False
+    result = extract_pdf(file_content)
+    return result.text, result.page_count, result.ocr_used
 
-    try:
-        with pdfplumber.open(io.BytesIO(file_content)) as pdf:
-            page_count = len(pdf.pages)
-            for page in pdf.pages:
-                page_text = page.extract_text() or ""
-                text_parts.append(page_text)
-    except Exception:
-        logger.exception("pdfplumber extraction failed")
-        return "", 0, False
 
-    full_text = "\n\n".join(text_parts)
+class ZipLimitExceededError(Exception):
+    """Archive exceeds the decompression budget (likely a zip bomb)."""
 
-    # Se o texto é muito escasso, tentar OCR
-    avg_chars_per_page = len(full_text) / max(page_count, 1)
-    if avg_chars_per_page < 100 and page_count > 0:
-        logger.info("Low text density (%.0f chars/page), attempting OCR", avg_chars_per_page)
-        ocr_text = _ocr_pdf(file_content)
-        if len(ocr_text) > len(full_text):
-            full_text = ocr_text
-            ocr_used = True
 
-    return full_text, page_count, ocr_used
+@dataclass
+class _ZipMember:
+    name: str  # full path, nested archives joined with "/"
+    path: str  # spooled copy on local disk
+    kind: str  # "pdf" | "docx"
 
 
-def _ocr_pdf(file_content: bytes) -> str:
-    """OCR fallback using pytesseract."""
-    try:
-        from pdf2image import convert_from_bytes
-        import pytesseract
+def _spool_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, budget: list[int], spool_dir: str) -> str:
+    """Stream one member to disk, charging the bytes actually inflated to the budget.
+
+    The declared ``file_size`` can lie, so the count is enforced while reading.
+    """
+    fd, path = tempfile.mkstemp(dir=spool_dir)
+    written = 0
+    with zf.open(info) as src, open(fd, "wb") as dst:
+        while chunk := src.read(ZIP_READ_CHUNK):
+            written += len(chunk)
+            budget[0] -= len(chunk)
+            if budget[0] < 0:
+                raise ZipLimitExceededError(f"{info.filename}: archive exceeds decompressed size limit")
+            if written > ZIP_READ_CHUNK and written / max(info.compress_size, 1) > settings.ZIP_MAX_RATIO:
+                raise ZipLimitExceededError(f"{info.filename}: compression ratio above limit")
+            dst.write(chunk)
+    return path
+
+
+def _collect_zip_members(source, prefix: str, depth: int, budget: list[int], spool_dir: str,
+                         members: list[_ZipMember]):
+    """Spool PDF/DOCX members to disk, descending into nested ZIPs up to ``ZIP_MAX_DEPTH``."""
+    with zipfile.ZipFile(source) as zf:
+        for info in sorted(zf.infolist(), key=lambda i: i.filename):
+            name = prefix + info.filename
+            lower = info.filename.lower()
+            if info.is_dir() or lower.startswith("__macosx"):
+                continue
+            if lower.endswith(".pdf"):
+                kind = "pdf"
+            elif lower.endswith(".docx"):
+                kind = "docx"
+            elif lower.endswith(".zip"):
+                kind = "zip"
+                if depth >= settings.ZIP_MAX_DEPTH:
+                    logger.warning("Skipping nested ZIP %s: depth limit %d", name, settings.ZIP_MAX_DEPTH)
+                    continue
+            else:
+                continue
+
+            if len(members) >= settings.ZIP_MAX_MEMBERS:
+                raise ZipLimitExceededError(f"more than {settings.ZIP_MAX_MEMBERS} documents in archive")
+            if info.file_size > budget[0]:
+                raise ZipLimitExceededError(f"{name}: archive exceeds decompressed size limit")
+
+            try:
+                path = _spool_member(zf, info, budget, spool_dir)
+            except (zipfile.BadZipFile, RuntimeError, OSError, EOFError):
+                logger.warning("Could not read ZIP member %s", name, exc_info=True)
+                continue
 
-        images = convert_from_bytes(file_content, dpi=200)
-        parts = []
+            if kind == "zip":
+                try:
+                    _collect_zip_members(path, f"{name}/", depth + 1, budget, spool_dir, members)
+                except zipfile.BadZipFile:
+                    logger.warning("Invalid nested ZIP %s", name)
+                finally:
+                    os.unlink(path)
+            else:
+                members.append(_ZipMember(name, path, kind))
+
+
+def _extract_zip_member(path: str, kind: str) -> ExtractionResult:
+    with open(path, "rb") as f:
+        content = f.read()
+    if kind == "pdf":
+        # Members are already spread across processes; don't shard within one.
+        return extract_pdf(content, workers=1)
+    return ExtractionResult([ExtractedPage(extract_text_from_docx(content), ENGINE_DOCX)])
+
+
+def extract_zip(source) -> ExtractionResult:
+    """Extract text from PDFs/DOCXs inside a ZIP (bytes, path or seekable file).
+
+    Members are streamed to a spool directory under a total decompressed
+    size budget (``ZIP_MAX_TOTAL_SIZE``) and per-member ratio guard
+    (``ZIP_MAX_RATIO``), then extracted in parallel. Each member keeps its
+    own page numbering in ``ExtractedPage.member``/``member_page``, and its
+    first page starts with a ``=== name ===`` header.
+    """
+    result = ExtractionResult()
+    members: list[_ZipMember] = []
+    budget = [settings.ZIP_MAX_TOTAL_SIZE]
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+        try:
+            _collect_zip_members(_open(source), "", 0, budget, spool_dir, members)
+        except zipfile.BadZipFile:
+            logger.warning("Invalid ZIP file")
+            return result
+        except ZipLimitExceededError as exc:
+            # Keep what was read before the limit hit; the rest is dropped.
+            logger.warning("ZIP extraction stopped: %s", exc)
+
+        if not members:
+            return result
+        args = [(m.path, m.kind) for m in members]
+        outputs = None
+        if len(members) > 1 and settings.PDF_EXTRACTION_WORKERS > 1:
+            outputs = _map_in_processes(_extract_zip_member, args, settings.PDF_EXTRACTION_WORKERS)
+        if outputs is None:
+            outputs = [_extract_zip_member(*a) for a in args]
+
+    for member, extracted in zip(members, outputs):
+        if not extracted.text.strip():
+            continue
+        for number, page in enumerate(extracted.pages, start=1):
+            page.member, page.member_page = member.name, number
+        first = extracted.pages[0]
+        if member.kind == "pdf":
+            first.text = f"=== {member.name} ({extracted.page_count} páginas) ===\n{first.text}"
+        else:
+            first.text = f"=== {member.name} ===\n{first.text}"
+        result.pages.extend(extracted.pages)
+        result.ocr_used = result.ocr_used or extracted.ocr_used
+    return result
+
+
+def _ocr_cache_key(file_hash: str, page_number: int) -> str:
+    return f"ocr:{file_hash}:{page_number}:{settings.TESSERACT_LANG}"
+
+
+def _ocr_page(pdf_path: str, page_number: int) -> str:
+    """Render a single page (1-based) and OCR it; only this page's image is in memory."""
+    from pdf2image import convert_from_path
+    import pytesseract
+
+    images = convert_from_path(pdf_path, dpi=OCR_DPI, first_page=page_number, last_page=page_number)
+    try:
+        return pytesseract.image_to_string(images[0], lang=settings.TESSERACT_LANG) if images else ""
+    finally:
         for img in images:
-            text = pytesseract.image_to_string(img, lang=settings.TESSERACT_LANG)
-            parts.append(text)
-        return "\n\n".join(parts)
+            img.close()
+
+
+def _ocr_pages(file_content: bytes, page_numbers: list[int], file_hash: str) -> dict[int, str]:
+    """OCR the given pages (1-based), reusing cached results by (file_hash, page).
+
+    Each worker thread renders one page and waits on its ``pdftoppm`` and
+    ``tesseract`` subprocesses, so ``OCR_WORKERS`` bounds both the number of
+    OCR processes and the number of page images held in memory.
+    """
+    keys = {n: _ocr_cache_key(file_hash, n) for n in page_numbers}
+    cached = cache.get_many(list(keys.values()))
+    texts = {n: cached[key] for n, key in keys.items() if key in cached}
+    missing = [n for n in page_numbers if n not in texts]
+    if not missing:
+        return texts
+
+    try:
+        import pdf2image  # noqa: F401
+        import pytesseract  # noqa: F401
     except ImportError:
-        logger.warning("pdf2image not available, OCR skipped")
-        return ""
-    except Exception:
-        logger.exception("OCR failed")
-        return ""
+        logger.warning("pdf2image/pytesseract not available, OCR skipped")
+        return texts
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        tmp.write(file_content)
+        tmp.flush()
+        with ThreadPoolExecutor(max_workers=settings.OCR_WORKERS) as pool:
+            futures = {pool.submit(_ocr_page, tmp.name, n): n for n in missing}
+            for future in as_completed(futures):
+                n = futures[future]
+                try:
+                    texts[n] = future.result()
+                except Exception:
+                    logger.exception("OCR failed for page %d", n)
+
+    cache.set_many(
+        {keys[n]: texts[n] for n in missing if n in texts},
+        timeout=settings.OCR_CACHE_TTL,
+    )
+    return texts
 
 
-def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[dict]:
+@functools.lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model("gpt-4o")
+
+
+def chunk_text(
+    text: str,
+    chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP,
+    page_offsets: list[int] | None = None,
+) -> list[dict]:
     """
     Split text into overlapping chunks by token count.
 
-    Returns list of {"content": str, "token_count": int, "page_number": int|None}
+    The text is encoded once and ``decode_with_offsets`` gives the character
+    offset of every token, so each chunk is a slice of ``text`` and the whole
+    pass is linear in the document length.
+
+    ``page_offsets`` (start of each page in ``text``, see
+    ``ExtractionResult.page_offsets``) gives exact page numbers; without it
+    the page is estimated from paragraph breaks.
+
+    Returns list of {"content": str, "start_offset": int, "end_offset": int,
+    "token_count": int, "page_number": int|None}; ``content`` is
+    ``text[start_offset:end_offset]``.
     """
-    enc = tiktoken.encoding_for_model("gpt-4o")
+    enc = _encoding()
     tokens = enc.encode(text)
+    if not tokens:
+        return []
+    _, offsets = enc.decode_with_offsets(tokens)
+    offsets.append(len(text))
+
+    if not page_offsets:
+        # Page number estimated from text position: two blank lines per page
+        breaks = [m.start() for m in re.finditer("\n\n", text)]
 
     chunks = []
     start = 0
     chunk_idx = 0
+    step = max(chunk_size - overlap, 1)
 
     while start < len(tokens):
         end = min(start + chunk_size, len(tokens))
-        chunk_tokens = tokens[start:end]
-        chunk_text = enc.decode(chunk_tokens)
-
-        # Estimate page number from text position
-        text_position = len(enc.decode(tokens[:start]))
-        page_breaks_before = text[:text_position].count("\n\n")
-        estimated_page = max(1, page_breaks_before // 2 + 1)
+        raw = text[offsets[start]:offsets[end]]
+        content = raw.strip()
+        if not content:  # whitespace only: nothing to search or embed
+            start = start + step if end < len(tokens) else end
+            continue
+        # Bounds of the stripped content; the page is that of its first character
+        text_position = offsets[start] + len(raw) - len(raw.lstrip())
+        text_end = offsets[end] - (len(raw) - len(raw.rstrip()))
+        if page_offsets:
+            page_number = bisect.bisect_right(page_offsets, text_position)
+        else:
+            page_breaks_before = bisect.bisect_right(breaks, text_position - 2)
+            page_number = max(1, page_breaks_before // 2 + 1)
 
         chunks.append({
-            "content": chunk_text.strip(),
-            "token_count": len(chunk_tokens),
-            "page_number": estimated_page,
+            "content": content,
+            "start_offset": text_position,
+            "end_offset": text_end,
+            "token_count": end - start,
+            "page_number": page_number,
             "chunk_index": chunk_idx,
         })
 
-        start = end - overlap if end < len(tokens) else end
+        start = start + step if end < len(tokens) else end
         chunk_idx += 1
 
     return chunks
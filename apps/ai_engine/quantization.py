@@ -0,0 +1,47 @@
+"""Compact embedding storage: int8 scalar and binary (sign) quantization.
+
+With ``EMBEDDING_STORAGE = "int8"`` a chunk keeps, instead of 3072 float32
+(12 KB) plus the HNSW prefix (3 KB):
+
+- ``embedding_bits``: one sign bit per dimension (384 B), scanned with the
+  Hamming distance for the coarse candidate list;
+- ``embedding_int8``: each dimension scaled by the vector's largest
+  absolute value to [-127, 127] (3 KB, TOASTed out of the row), used to
+  rescore the candidates against the float query.
+
+Only cosine similarity is needed, so the per-vector scale is not stored.
+"""
+import numpy as np
+from pgvector.utils import Bit
+
+INT8_MAX = 127
+
+
+def to_int8(vectors) -> np.ndarray:
+    """Quantize float vectors (one per row) to int8."""
+    matrix = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scale = np.abs(matrix).max(axis=1, keepdims=True)
+    scale[scale == 0] = 1
+    return np.rint(matrix / scale * INT8_MAX).astype(np.int8)
+
+
+def to_bits(vector) -> Bit:
+    """Sign bits of a float vector."""
+    return Bit(np.asarray(vector, dtype=np.float32) > 0)
+
+
+def int8_bytes(vector) -> bytes:
+    return to_int8(vector)[0].tobytes()
+
+
+def from_int8_bytes(rows) -> np.ndarray:
+    """Stack stored int8 vectors into a float32 matrix (one row per vector)."""
+    return np.stack([np.frombuffer(bytes(row), dtype=np.int8) for row in rows]).astype(np.float32)
+
+
+def cosine_distances(query, matrix: np.ndarray) -> np.ndarray:
+    """1 - cosine similarity between the query and each row of ``matrix``."""
+    query = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = 1
+    return 1 - (matrix @ query) / norms
@@ -1,17 +1,35 @@
 """RAG — Retrieval-Augmented Generation for opportunity analysis."""
+import hashlib
 import json
 import logging
 import time
 
 from django.conf import settings
+from django.db.models import Count, Max
 
-from apps.opportunities.models import AISummary, ExtractedRequirement, Opportunity
+from apps.opportunities.models import AISummary, DocumentChunk, ExtractedRequirement, Opportunity
 
-from . import prompts
-from .embeddings import search_similar_chunks
+from . import llm, prompts
+from .backends import get_backend
+from .pipeline import CHUNK_OVERLAP, CHUNK_SIZE
+from .search import RRF_K, hybrid_search
 
 logger = logging.getLogger(__name__)
 
+# Retrieval queries for the checklist sections the extractor must fill,
+# besides the opportunity's own title/description
+EXTRACTION_QUERIES = [
+    "habilitação jurídica contrato social",
+    "regularidade fiscal e trabalhista certidão negativa",
+    "qualificação econômico-financeira balanço patrimonial",
+    "atestado de capacidade técnica",
+    "garantia contratual",
+    "visita técnica",
+    "prazo de entrega e vigência do contrato",
+    "penalidades e sanções multa",
+]
+EXTRACTION_TOP_K = 15  # chunks retrieved for the extraction prompt
+
 _model = None
 
 
@@ -25,53 +43,81 @@ def _get_model():
         )
         _model = genai.GenerativeModel(
             settings.GEMINI_MODEL,
-            generation_config=genai.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=16000,
-            ),
+            generation_config=genai.GenerationConfig(**llm.GENERATION_CONFIG),
         )
     return _model
 
 
-def _call_llm(system: str, user: str, response_format: str = "json_object") -> tuple[dict, int]:
-    """Call Gemini LLM and return (parsed_json, tokens_used)."""
-    model = _get_model()
-
-    prompt = f"{system}\n\n---\n\n{user}"
-    if response_format == "json_object":
-        prompt += "\n\nIMPORTANTE: Responda APENAS com JSON válido, sem markdown ou texto adicional."
-
-    resp = model.generate_content(
-        prompt,
+def _call_llm(system: str, user: str, response_format: str = "json_object",
+              bypass_cache: bool = False) -> tuple[dict, int, bool]:
+    """Call Gemini LLM and return (parsed_json, tokens_used, cache_hit)."""
+    generation = llm.generate(
+        _get_model(), system, user,
+        json_response=response_format == "json_object",
+        bypass_cache=bypass_cache,
         request_options={"timeout": 120},
     )
-    content = resp.text
-
-    tokens = 0
-    if resp.usage_metadata:
-        tokens = (resp.usage_metadata.prompt_token_count or 0) + (resp.usage_metadata.candidates_token_count or 0)
+    content = generation.text
 
     if response_format == "json_object":
-        # Strip markdown code fences if present
-        cleaned = content.strip()
-        if cleaned.startswith("```"):
-            lines = cleaned.split("\n")
-            lines = [l for l in lines if not l.strip().startswith("```")]
-            cleaned = "\n".join(lines)
-
-        try:
-            data = json.loads(cleaned)
-        except json.JSONDecodeError:
+        data = llm.parse_json(content)
+        if data is None:
             data = {"raw_response": content}
             logger.warning("LLM response is not valid JSON: %s", content[:200])
     else:
         data = {"text": content}
 
-    return data, tokens
+    return data, generation.tokens, generation.cached
+
+
+def extraction_fingerprint(opportunity: Opportunity, api_metadata: str) -> str:
+    """SHA-256 of everything an extraction depends on.
+
+    The documents enter as their sorted ``file_hash`` plus processing status
+    (a document re-extracted after a failure changes the chunks, not the hash).
+    The chunks enter as their count and newest ``created_at`` (a rechunk
+    replaces them) and the number still pending embedding: until they get
+    vectors, retrieval over them is lexical only. Then everything that
+    decides which chunks are retrieved: chunking and search settings, the
+    retrieval queries and the embedding model.
+    """
+    documents = sorted(
+        f"{file_hash}:{status}"
+        for file_hash, status in opportunity.documents.values_list("file_hash", "processing_status")
+    )
+    opportunity_chunks = DocumentChunk.objects.filter(document__opportunity=opportunity)
+    chunks = opportunity_chunks.aggregate(count=Count("pk"), newest=Max("created_at"))
+    pending = opportunity_chunks.pending_embedding().count()
+    retrieval = {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "queries": EXTRACTION_QUERIES,
+        "top_k": EXTRACTION_TOP_K,
+        "rrf_k": RRF_K,
+        "hybrid_candidates": settings.HYBRID_SEARCH_CANDIDATES,
+        "vector_candidates": settings.VECTOR_SEARCH_CANDIDATES,
+        "quantized_candidates": settings.QUANTIZED_SEARCH_CANDIDATES,
+        "storage": settings.EMBEDDING_STORAGE,
+        "text_search_config": settings.TEXT_SEARCH_CONFIG,
+        "embedding_model": get_backend().model_name,
+    }
+    payload = json.dumps(
+        [api_metadata, documents, chunks["count"], str(chunks["newest"]), pending, retrieval,
+         prompts.PROMPT_VERSION, settings.GEMINI_MODEL],
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
 
 
-def run_extraction(opportunity: Opportunity) -> AISummary:
-    """Run full extraction: checklist + risks + fields."""
+def run_extraction(opportunity: Opportunity, bypass_cache: bool = False) -> AISummary:
+    """Run full extraction: checklist + risks + fields.
+
+    If neither the documents nor the API metadata changed since the latest
+    full analysis (same ``extraction_fingerprint``), that analysis is
+    returned as is and the requirements are kept. An analysis whose answer
+    was not valid JSON gets no fingerprint, so it is never reused.
+    ``bypass_cache`` forces a new extraction and LLM call.
+    """
     api_metadata = json.dumps({
         "objeto": opportunity.title,
         "descricao": opportunity.description,
@@ -85,18 +131,25 @@ def run_extraction(opportunity: Opportunity) -> AISummary:
         "srp": opportunity.is_srp,
     }, ensure_ascii=False, indent=2)
 
-    # RAG: retrieve relevant chunks via vector search or fallback to direct chunks
-    from apps.opportunities.models import DocumentChunk
+    fingerprint = extraction_fingerprint(opportunity, api_metadata)
+    if not bypass_cache:
+        previous = (
+            opportunity.ai_summaries.filter(analysis_type=AISummary.AnalysisType.FULL)
+            .order_by("-created_at")
+            .first()
+        )
+        if previous is not None and previous.input_fingerprint == fingerprint:
+            logger.info("Extraction inputs unchanged for %s, reusing analysis %s", opportunity.pk, previous.pk)
+            return previous
 
+    # RAG: retrieve relevant chunks via hybrid search or fallback to direct chunks
     chunks = []
+    queries = list(dict.fromkeys(q for q in (opportunity.title, opportunity.description) if q))
+    queries += EXTRACTION_QUERIES
     try:
-        chunks = search_similar_chunks(
-            query=opportunity.title,
-            opportunity_id=str(opportunity.pk),
-            top_k=15,
-        )
+        chunks = hybrid_search(str(opportunity.pk), queries, top_k=EXTRACTION_TOP_K)
     except Exception:
-        logger.warning("Vector search failed for %s, falling back to direct chunks", opportunity.pk)
+        logger.warning("Chunk search failed for %s, falling back to direct chunks", opportunity.pk)
 
     if not chunks:
         # Fallback: evenly spaced chunks across the document.
@@ -119,6 +172,7 @@ def run_extraction(opportunity: Opportunity) -> AISummary:
                 selected_ids = [all_ids[int(i * step)] for i in range(MAX_CHUNKS)]
             chunks = list(
                 base_qs.filter(pk__in=selected_ids)
+                .with_content()
                 .order_by("document", "chunk_index")
             )
 
@@ -136,7 +190,7 @@ def run_extraction(opportunity: Opportunity) -> AISummary:
     )
 
     start = time.time()
-    data, tokens = _call_llm(prompts.EXTRACTION_SYSTEM, user_prompt)
+    data, tokens, cache_hit = _call_llm(prompts.EXTRACTION_SYSTEM, user_prompt, bypass_cache=bypass_cache)
     elapsed_ms = int((time.time() - start) * 1000)
 
     # Persist extracted requirements
@@ -150,16 +204,18 @@ def run_extraction(opportunity: Opportunity) -> AISummary:
         model_name=settings.GEMINI_MODEL,
         tokens_used=tokens,
         processing_time_ms=elapsed_ms,
+        cache_hit=cache_hit,
+        input_fingerprint="" if "raw_response" in data else fingerprint,
     )
 
     logger.info(
-        "Extraction complete for %s: %d tokens, %dms",
-        opportunity.pk, tokens, elapsed_ms,
+        "Extraction complete for %s: %d tokens, %dms%s",
+        opportunity.pk, tokens, elapsed_ms, " (cached)" if cache_hit else "",
     )
     return summary
 
 
-def run_summary(opportunity: Opportunity) -> AISummary:
+def run_summary(opportunity: Opportunity, bypass_cache: bool = False) -> AISummary:
     """Generate executive summary."""
     api_metadata = json.dumps({
         "objeto": opportunity.title,
@@ -173,7 +229,7 @@ def run_summary(opportunity: Opportunity) -> AISummary:
     reqs = list(opportunity.requirements.values("category", "requirement"))
     latest_analysis = opportunity.ai_summaries.filter(
         analysis_type=AISummary.AnalysisType.FULL
-    ).first()
+    ).order_by("-created_at").first()
 
     risks = latest_analysis.content.get("riscos", []) if latest_analysis else []
 
@@ -184,8 +240,8 @@ def run_summary(opportunity: Opportunity) -> AISummary:
     )
 
     start = time.time()
-    data, tokens = _call_llm(
-        prompts.SUMMARY_SYSTEM, user_prompt, response_format="text"
+    data, tokens, cache_hit = _call_llm(
+        prompts.SUMMARY_SYSTEM, user_prompt, response_format="text", bypass_cache=bypass_cache,
     )
     elapsed_ms = int((time.time() - start) * 1000)
 
@@ -197,6 +253,7 @@ def run_summary(opportunity: Opportunity) -> AISummary:
         model_name=settings.GEMINI_MODEL,
         tokens_used=tokens,
         processing_time_ms=elapsed_ms,
+        cache_hit=cache_hit,
     )
     return summary
 
@@ -0,0 +1,110 @@
+"""In-worker vector retrieval for one opportunity's chunks.
+
+An analysis runs several retrieval queries against the chunks of a single
+opportunity (hundreds to a few thousand vectors). Instead of one
+``CosineDistance`` scan in Postgres per query, the opportunity's vectors
+are loaded once into a contiguous, L2-normalized float32 matrix and every
+batch of queries is answered with one matrix product.
+
+Matrices are kept per worker process in an LRU bounded by
+``RETRIEVER_CACHE_MB``. Each lookup checks a cheap fingerprint (chunk count
+and latest ``updated_at``), so re-indexed documents are reloaded.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+
+from apps.opportunities.models import DocumentChunk
+
+from . import quantization
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OpportunityVectors:
+    fingerprint: tuple
+    chunk_ids: list
+    matrix: np.ndarray  # (chunks, dimensions), rows L2-normalized
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def search(self, query_embeddings, top_k: int) -> list[list[tuple]]:
+        """``(chunk_id, cosine distance)`` best-first, top_k per query."""
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        distances = 1 - self.matrix @ (queries / norms).T  # (chunks, queries)
+        k = min(top_k, len(self.chunk_ids))
+        results = []
+        for column in distances.T:
+            best = np.argpartition(column, k - 1)[:k] if k < len(column) else np.arange(len(column))
+            best = best[np.argsort(column[best])]
+            results.append([(self.chunk_ids[i], float(column[i])) for i in best])
+        return results
+
+
+_cache: "OrderedDict[str, OpportunityVectors]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _chunks(opportunity_id):
+    qs = DocumentChunk.objects.filter(document__opportunity_id=opportunity_id)
+    if settings.EMBEDDING_STORAGE == "int8":
+        return qs.filter(embedding_int8__isnull=False)
+    return qs.filter(embedding__isnull=False)
+
+
+def _fingerprint(opportunity_id) -> tuple:
+    stats = _chunks(opportunity_id).aggregate(count=Count("pk"), updated=Max("updated_at"))
+    return settings.EMBEDDING_STORAGE, stats["count"], stats["updated"]
+
+
+def _load(opportunity_id, fingerprint: tuple) -> OpportunityVectors:
+    if settings.EMBEDDING_STORAGE == "int8":
+        rows = list(_chunks(opportunity_id).values_list("pk", "embedding_int8"))
+        matrix = quantization.from_int8_bytes(row[1] for row in rows) if rows else None
+    else:
+        rows = list(_chunks(opportunity_id).values_list("pk", "embedding"))
+        matrix = np.stack([row[1] for row in rows]).astype(np.float32, copy=False) if rows else None
+    if matrix is None:
+        matrix = np.empty((0, settings.EMBEDDING_DIMENSIONS), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    matrix = np.ascontiguousarray(matrix / norms, dtype=np.float32)
+    return OpportunityVectors(fingerprint, [row[0] for row in rows], matrix)
+
+
+def get_vectors(opportunity_id) -> OpportunityVectors:
+    """The opportunity's chunk vectors, from the worker cache when still current."""
+    key = str(opportunity_id)
+    fingerprint = _fingerprint(key)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry.fingerprint == fingerprint:
+            _cache.move_to_end(key)
+            return entry
+
+    entry = _load(key, fingerprint)
+    budget = settings.RETRIEVER_CACHE_MB * 1024 * 1024
+    with _lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        used = sum(e.nbytes for e in _cache.values())
+        while used > budget and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            used -= evicted.nbytes
+    logger.debug("Loaded %d chunk vectors for opportunity %s", len(entry.chunk_ids), key)
+    return entry
+
+
+def clear():
+    with _lock:
+        _cache.clear()
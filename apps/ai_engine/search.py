@@ -0,0 +1,76 @@
+"""Hybrid retrieval: Portuguese full-text ranking fused with vector ranking.
+
+Legal terms ("atestado de capacidade técnica", "garantia contratual") are
+matched far better lexically than by embedding similarity, and the lexical
+side still works for documents whose embeddings failed. Each query yields
+one ranking per method; rankings are combined with reciprocal-rank fusion,
+``score = sum(1 / (RRF_K + rank))``, which needs no calibration between
+``ts_rank_cd`` and cosine distances.
+"""
+import logging
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+
+from apps.opportunities.models import DocumentChunk
+
+from . import embeddings
+
+logger = logging.getLogger(__name__)
+
+RRF_K = 60
+# ts_rank_cd normalization: divide by 1 + log(document length)
+RANK_NORMALIZATION = 1
+
+
+def _any_term_query(query: str) -> SearchQuery:
+    # websearch syntax never raises on user text; "or" ranks chunks matching
+    # any of the terms instead of requiring all of them
+    words = re.findall(r"\w+", query)
+    return SearchQuery(" or ".join(words), config=settings.TEXT_SEARCH_CONFIG, search_type="websearch")
+
+
+def lexical_rankings(opportunity_id: str, queries: list[str], limit: int) -> list[list[tuple]]:
+    """Per query, the opportunity's ``limit`` best chunks by ``ts_rank_cd`` as ``(chunk_id, rank)``."""
+    rankings = []
+    for query in queries:
+        search_query = _any_term_query(query)
+        rows = (
+            DocumentChunk.objects.filter(
+                document__opportunity_id=opportunity_id, search_vector=search_query,
+            )
+            .annotate(rank=SearchRank(
+                F("search_vector"), search_query, cover_density=True, normalization=RANK_NORMALIZATION,
+            ))
+            .order_by("-rank")
+            .values_list("pk", "rank")[:limit]
+        )
+        rankings.append(list(rows))
+    return rankings
+
+
+def reciprocal_rank_fusion(rankings: list[list[tuple]]) -> list[tuple]:
+    """Fuse rankings of ``(chunk_id, score)`` into ``(chunk_id, rrf_score)``, best first."""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for position, (pk, _) in enumerate(ranking, start=1):
+            fused[pk] += 1 / (RRF_K + position)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_search(opportunity_id: str, queries: list[str], top_k: int = 10) -> list[DocumentChunk]:
+    """Chunks of one opportunity for the queries, lexical and vector rankings fused.
+
+    Each chunk gets ``rrf_score``. If the queries cannot be embedded, the
+    lexical rankings alone are used.
+    """
+    limit = max(settings.HYBRID_SEARCH_CANDIDATES, top_k)
+    rankings = lexical_rankings(opportunity_id, queries, limit)
+    try:
+        rankings += embeddings.opportunity_vector_rankings(opportunity_id, queries, limit)
+    except Exception:
+        logger.warning("Vector ranking failed for %s, using full-text only", opportunity_id, exc_info=True)
+    return embeddings.fetch_ranked(reciprocal_rank_fusion(rankings)[:top_k], attr="rrf_score")
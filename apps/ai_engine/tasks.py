@@ -2,14 +2,20 @@
 import logging
 
 from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.db.models import F
 
-from apps.opportunities.models import Opportunity, OpportunityDocument
+from apps.core.task_dedup import delay_once, hand_off, single_flight
+from apps.opportunities.models import DocumentChunk, Opportunity, OpportunityDocument
 
 logger = logging.getLogger(__name__)
 
 # Maximum number of poll retries before giving up on documents and proceeding.
 _DOC_POLL_MAX = 40  # 40 * 10s = ~6-7 min max wait
 _DOC_POLL_DELAY = 10  # seconds between polls
+# Consecutive single-chunk embedding failures after which the batcher stops retrying
+_EMBED_RETRY_MAX_FAILURES = 5
 
 
 def _refresh_document_list(opp: Opportunity):
@@ -52,9 +58,14 @@ def _refresh_document_list(opp: Opportunity):
         logger.warning("Failed to refresh document list for %s", opp.pk, exc_info=True)
 
 
-def _requeue_stuck_documents(opp: Opportunity) -> int:
-    """Re-queue failed/pending/stuck docs. Returns total doc count."""
-    from apps.opportunities.tasks import download_single_document, extract_document_text
+def _dispatch_documents(opp: Opportunity) -> int:
+    """Make sure the opportunity's documents are moving. Returns total doc count.
+
+    Only documents that are due are enqueued (see ``leases.dispatch_due``):
+    ones already queued or held by a live worker are left alone, and expired
+    leases are handled by the sweeper.
+    """
+    from apps.opportunities.leases import dispatch_due
 
     # First, check PNCP API for any new documents not yet in the DB
     _refresh_document_list(opp)
@@ -63,30 +74,106 @@ def _requeue_stuck_documents(opp: Opportunity) -> int:
     if not docs.exists():
         return 0
 
-    # Re-queue documents stuck in non-terminal states
-    requeue_statuses = [
-        OpportunityDocument.ProcessingStatus.PENDING,
-        OpportunityDocument.ProcessingStatus.FAILED,
-        OpportunityDocument.ProcessingStatus.DOWNLOADING,
-    ]
-    for doc in docs.filter(processing_status__in=requeue_statuses):
-        if doc.original_url:
-            doc.processing_status = OpportunityDocument.ProcessingStatus.PENDING
-            doc.error_message = ""
-            doc.save(update_fields=["processing_status", "error_message", "updated_at"])
-            download_single_document.delay(str(doc.pk))
-            logger.info("Re-queued download for document %s", doc.pk)
-
-    # Re-queue documents that were downloaded but never extracted
-    for doc in docs.filter(processing_status=OpportunityDocument.ProcessingStatus.DOWNLOADED):
-        extract_document_text.delay(str(doc.pk))
-        logger.info("Re-queued extraction for document %s", doc.pk)
+    dispatched = dispatch_due(docs)
+    if dispatched["download"] or dispatched["extract"]:
+        logger.info("Dispatched documents for %s: %s", opp.pk, dispatched)
 
     return docs.count()
 
 
+def request_embeddings():
+    """Make sure the embedding batcher runs within ``EMBED_MICROBATCH_WAIT`` seconds.
+
+    Documents indexed in the meantime collapse into the same run (see
+    ``delay_once``), so their chunks share API requests.
+    """
+    try:
+        delay_once(embed_pending_chunks, "", countdown=settings.EMBED_MICROBATCH_WAIT)
+    except Exception:
+        # The per-minute beat run picks the chunks up
+        logger.warning("Could not enqueue the embedding batcher", exc_info=True)
+
+
+def _embed_or_count_failure(ids: list, backend: str) -> bool:
+    """Embed the chunks ``ids``; on error count a failed attempt for those still pending."""
+    from .embeddings import embed_chunks
+
+    chunks = list(DocumentChunk.objects.filter(pk__in=ids).with_content())
+    try:
+        embed_chunks(chunks, backend or None)
+        return True
+    except SoftTimeLimitExceeded:
+        raise
+    except Exception:
+        logger.warning("Embedding failed for %d chunks", len(ids), exc_info=True)
+        # Batches written before the error are no longer pending
+        DocumentChunk.objects.pending_embedding().filter(pk__in=ids).update(
+            embedding_attempts=F("embedding_attempts") + 1
+        )
+        return False
+
+
+@shared_task(queue="embeddings", soft_time_limit=600, time_limit=660)
+@single_flight("backend")
+def embed_pending_chunks(backend: str = ""):
+    """Embed chunks without vectors across documents, oldest first.
+
+    Chunks are taken ``EMBED_MICROBATCH_SIZE`` at a time and sent to the
+    API in full ``EMBED_BATCH_SIZE`` requests; the run ends when fewer are
+    left. ``backend`` is an ``EMBEDDING_BACKENDS`` alias ("" = the
+    configured one). Enqueued by ``request_embeddings`` and every minute by
+    beat.
+
+    A failing round does not stop the run: its chunks count a failed
+    attempt and are then retried one at a time, after the new chunks, so a
+    chunk the API rejects only fails itself and stops being pending after
+    ``EMBED_MAX_ATTEMPTS`` (see ``pending_embedding``). Retries stop for
+    this run after ``_EMBED_RETRY_MAX_FAILURES`` failures in a row: the API
+    is down, not the chunks.
+    """
+    pending = DocumentChunk.objects.pending_embedding()
+    done: set = set()
+    embedded = failed = 0
+    while True:
+        ids = list(
+            pending.filter(embedding_attempts=0)
+            .order_by("created_at", "pk")
+            .values_list("pk", flat=True)[: settings.EMBED_MICROBATCH_SIZE]
+        )
+        if not ids or done.intersection(ids):  # nothing left, or no progress
+            break
+        done.update(ids)
+        if _embed_or_count_failure(ids, backend):
+            embedded += len(ids)
+        else:
+            failed += len(ids)
+        if len(ids) < settings.EMBED_MICROBATCH_SIZE:
+            break
+
+    retries = list(
+        pending.filter(embedding_attempts__gt=0)
+        .order_by("embedding_attempts", "created_at", "pk")
+        .values_list("pk", flat=True)[: settings.EMBED_MICROBATCH_SIZE]
+    )
+    in_a_row = 0
+    for pk in retries:
+        if _embed_or_count_failure([pk], backend):
+            embedded += 1
+            in_a_row = 0
+            continue
+        in_a_row += 1
+        if in_a_row >= _EMBED_RETRY_MAX_FAILURES:
+            logger.warning("Embedding batcher: retries postponed after %d failures in a row", in_a_row)
+            break
+
+    if embedded or failed:
+        logger.info("Embedding batcher: %d chunks embedded, %d failed", embedded, failed)
+    return {"embedded": embedded, "failed": failed}
+
+
 def _docs_ready(opp: Opportunity) -> tuple[bool, int]:
-    """Check if all documents reached a terminal state (indexed or failed).
+    """Check if all documents reached a terminal state (indexed or failed)
+    and their chunks have embeddings.
 
     Returns (all_done, indexed_count).
     """
@@ -102,18 +189,25 @@ def _docs_ready(opp: Opportunity) -> tuple[bool, int]:
         processing_status=OpportunityDocument.ProcessingStatus.FAILED
     ).count()
 
-    return (indexed + failed >= total), indexed
+    pending = DocumentChunk.objects.pending_embedding().filter(document__opportunity=opp).exists()
+    return (indexed + failed >= total and not pending), indexed
 
 
 @shared_task(bind=True, queue="ai", max_retries=2, default_retry_delay=30,
              soft_time_limit=600, time_limit=660)
+@single_flight("opportunity_id", "analysis_type", "bypass_cache")
 def run_ai_analysis(self, opportunity_id: str, analysis_type: str = "full",
-                    _doc_poll_count: int = 0):
+                    bypass_cache: bool = False, _doc_poll_count: int = 0):
     """Run AI analysis on an opportunity.
 
+    ``bypass_cache`` calls the LLM even for prompts answered before (see
+    ``apps.ai_engine.llm``).
+
     Uses non-blocking polling for document readiness: instead of sleeping
     in a loop (which blocks the worker), the task re-enqueues itself with
-    a short countdown when documents are not yet ready.
+    a short countdown when documents are not yet ready. One analysis per
+    opportunity, type and ``bypass_cache`` runs at a time, polls included
+    (see ``apps.core.task_dedup``).
     """
     try:
         opp = Opportunity.objects.get(pk=opportunity_id)
@@ -127,11 +221,11 @@ def run_ai_analysis(self, opportunity_id: str, analysis_type: str = "full",
             opp.status = Opportunity.Status.ANALYZING
             opp.save(update_fields=["status", "updated_at"])
 
-        # Kick off any stuck documents
-        total_docs = _requeue_stuck_documents(opp)
+        # Kick off any documents still waiting
+        total_docs = _dispatch_documents(opp)
         if total_docs == 0:
             # No documents at all — skip straight to analysis
-            return _run_analysis(self, opp, analysis_type, indexed_count=0)
+            return _run_analysis(self, opp, analysis_type, indexed_count=0, bypass_cache=bypass_cache)
 
     # Check if documents are ready (non-blocking)
     all_done, indexed_count = _docs_ready(opp)
@@ -143,10 +237,11 @@ def run_ai_analysis(self, opportunity_id: str, analysis_type: str = "full",
             opp.pk, _doc_poll_count + 1, _DOC_POLL_MAX, _DOC_POLL_DELAY,
         )
         run_ai_analysis.apply_async(
-            args=[opportunity_id, analysis_type],
+            args=[opportunity_id, analysis_type, bypass_cache],
             kwargs={"_doc_poll_count": _doc_poll_count + 1},
             countdown=_DOC_POLL_DELAY,
         )
+        hand_off()
         return
 
     if not all_done:
@@ -155,10 +250,11 @@ def run_ai_analysis(self, opportunity_id: str, analysis_type: str = "full",
             opp.pk, _doc_poll_count,
         )
 
-    return _run_analysis(self, opp, analysis_type, indexed_count)
+    return _run_analysis(self, opp, analysis_type, indexed_count, bypass_cache=bypass_cache)
 
 
-def _run_analysis(self, opp: Opportunity, analysis_type: str, indexed_count: int):
+def _run_analysis(self, opp: Opportunity, analysis_type: str, indexed_count: int,
+                  bypass_cache: bool = False):
     """Execute the actual AI analysis (extraction + summary)."""
     if indexed_count == 0 and opp.documents.exists():
         logger.warning(
@@ -172,10 +268,10 @@ def _run_analysis(self, opp: Opportunity, analysis_type: str, indexed_count: int
         from .rag import run_extraction, run_summary
 
         if analysis_type in ("full", "checklist", "risks"):
-            run_extraction(opp)
+            run_extraction(opp, bypass_cache=bypass_cache)
 
         if analysis_type in ("full", "summary"):
-            run_summary(opp)
+            run_summary(opp, bypass_cache=bypass_cache)
 
         logger.info("AI analysis '%s' complete for %s", analysis_type, opp.pk)
 
@@ -198,3 +294,11 @@ def _run_analysis(self, opp: Opportunity, analysis_type: str, indexed_count: int
             opp.save(update_fields=["status", "updated_at"])
             logger.warning("Reverted status for %s to %s", opp.pk, previous_status)
         raise self.retry(exc=exc)
+
+
+@shared_task(queue="ai")
+def prune_llm_cache():
+    """Drop expired and least recently used LLM responses (daily, via beat)."""
+    from .llm import prune
+
+    return {"deleted": prune()}
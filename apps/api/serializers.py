@@ -55,7 +55,7 @@ class AISummarySerializer(serializers.ModelSerializer):
         model = AISummary
         fields = [
             "id", "analysis_type", "content", "prompt_version",
-            "model_name", "tokens_used", "processing_time_ms", "created_at",
+            "model_name", "tokens_used", "processing_time_ms", "cache_hit", "created_at",
         ]
 
 
@@ -14,6 +14,11 @@ from .serializers import (
 )
 
 
+def _bypass_cache(request) -> bool:
+    """``bypass_cache`` from a JSON or form body ("true"/"1"/true)."""
+    return str(request.data.get("bypass_cache", "")).lower() in ("1", "true")
+
+
 class ClientViewSet(viewsets.ModelViewSet):
     queryset = Client.objects.filter(is_active=True)
     serializer_class = ClientSerializer
@@ -37,20 +42,22 @@ class OpportunityViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=True, methods=["post"])
     def run_ai(self, request, pk=None):
-        """POST /api/opportunities/{id}/run_ai/ {"analysis_type": "full"}"""
+        """POST /api/opportunities/{id}/run_ai/ {"analysis_type": "full", "bypass_cache": false}"""
         from apps.ai_engine.tasks import run_ai_analysis
+        from apps.core.task_dedup import delay_once
 
         analysis_type = request.data.get("analysis_type", "full")
-        run_ai_analysis.delay(str(pk), analysis_type)
-        return Response({"status": "enqueued", "analysis_type": analysis_type})
+        enqueued = delay_once(run_ai_analysis, str(pk), analysis_type, _bypass_cache(request))
+        status = "enqueued" if enqueued else "already_running"
+        return Response({"status": status, "analysis_type": analysis_type})
 
     @action(detail=True, methods=["post"])
     def run_matching(self, request, pk=None):
-        """POST /api/opportunities/{id}/run_matching/ {"client_id": "uuid"}"""
+        """POST /api/opportunities/{id}/run_matching/ {"client_id": "uuid", "bypass_cache": false}"""
         from apps.matching.tasks import run_matching
 
         client_id = request.data.get("client_id")
         if not client_id:
             return Response({"error": "client_id is required"}, status=400)
-        run_matching.delay(str(pk), client_id)
+        run_matching.delay(str(pk), client_id, _bypass_cache(request))
         return Response({"status": "enqueued", "client_id": client_id})
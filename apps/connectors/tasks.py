@@ -5,6 +5,8 @@ from datetime import date, timedelta
 from celery import shared_task
 from django.utils import timezone
 
+from apps.core.task_dedup import delay_once
+
 from .normalizer import persist_opportunity
 from .pncp import PNCPConnector, ALL_MODALITIES
 from .compras_gov import ComprasGovConnector
@@ -54,7 +56,7 @@ def ingest_pncp(
                     if created:
                         created_count += 1
                         from apps.opportunities.tasks import download_opportunity_documents
-                        download_opportunity_documents.delay(str(opp.pk))
+                        delay_once(download_opportunity_documents, str(opp.pk))
                 except Exception:
                     logger.warning("Failed to persist %s", norm_opp.external_id, exc_info=True)
 
@@ -89,7 +91,7 @@ def ingest_compras_gov(self, days_back: int = 1):
                 if created:
                     created_count += 1
                     from apps.opportunities.tasks import download_opportunity_documents
-                    download_opportunity_documents.delay(str(opp.pk))
+                    delay_once(download_opportunity_documents, str(opp.pk))
 
             logger.info(
                 "Compras.gov ingestion complete: %d new / %d total",
@@ -239,4 +241,4 @@ def _persist_new_document(opportunity, doc_data: dict):
 
     # Trigger download
     from apps.opportunities.tasks import download_opportunity_documents
-    download_opportunity_documents.delay(str(opportunity.pk))
+    delay_once(download_opportunity_documents, str(opportunity.pk))
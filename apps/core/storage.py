@@ -3,6 +3,7 @@ import hashlib
 import logging
 
 from django.conf import settings
+from django.core.files.base import ContentFile
 from storages.backends.s3boto3 import S3Boto3Storage
 
 logger = logging.getLogger(__name__)
@@ -31,3 +32,25 @@ def document_upload_path(instance, filename: str) -> str:
     year = instance.created_at.year if instance.created_at else "0000"
     source = getattr(instance, "source", "manual")
     return f"documents/{source}/{year}/{hash_prefix}/{filename}"
+
+
+def blob_path(file_hash: str) -> str:
+    """Content-addressed path: documents/blobs/<h[:2]>/<h[2:4]>/<hash>.
+
+    The same content always maps to the same object, no matter how many
+    documents (or URLs, or file names) point at it.
+    """
+    return f"documents/blobs/{file_hash[:2]}/{file_hash[2:4]}/{file_hash}"
+
+
+def store_blob(storage, file_hash: str, content: bytes) -> str:
+    """Save content at its blob path unless it is already there. Returns the name."""
+    name = blob_path(file_hash)
+    if storage.exists(name):
+        logger.debug("Blob %s already stored, skipping upload", name)
+        return name
+    saved = storage.save(name, ContentFile(content))
+    if saved != name:
+        # Another worker stored the same content in the meantime: drop the renamed copy
+        storage.delete(saved)
+    return name
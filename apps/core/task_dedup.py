@@ -0,0 +1,139 @@
+"""Idempotency locks for Celery tasks, keyed by task name and entity ID.
+
+The entity ID is the task's first argument, plus any further positional
+arguments passed to ``delay_once`` / named in ``single_flight`` (e.g. the
+analysis type), so calls that do different work are not collapsed.
+
+Two markers live in the shared cache (Redis), both with a TTL so a dead
+worker can't hold them forever:
+
+- ``queued``: set by ``delay_once`` when a message is sent. While it exists,
+  further ``delay_once`` calls for the same task and entity are dropped, so
+  a burst of enqueues (ingestion, the sweeper, a user clicking twice)
+  collapses into one message.
+- ``running``: taken by ``single_flight`` when the task starts. A second
+  message for the same entity that reaches a worker meanwhile (sent with a
+  plain ``.delay()``, or after the queued marker expired) is skipped.
+
+Both are cleared when the task finishes, except when it hands its work on to
+a message it sent itself (``self.retry()``, ``hand_off()``): the queued
+marker then stays until that message runs.
+
+Skipped duplicates are counted per task (``skipped_count``) and logged.
+"""
+import functools
+import inspect
+import logging
+import uuid
+from contextvars import ContextVar
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Set by hand_off() inside a single_flight task
+_handed_off: ContextVar[bool] = ContextVar("task_dedup_handed_off", default=False)
+
+
+def _key(task_name: str, entity_id, suffix: str) -> str:
+    return f"taskdedup:{task_name}:{entity_id}:{suffix}"
+
+
+def _entity(values) -> str:
+    return ":".join(str(v) for v in values)
+
+
+def _skipped_key(task_name: str) -> str:
+    return f"taskdedup:{task_name}:skipped"
+
+
+def _record_skip(task_name: str, entity_id, reason: str):
+    key = _skipped_key(task_name)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:  # evicted between add and incr
+            cache.set(key, 1, timeout=None)
+    logger.info("Skipped duplicate %s for %s (%s)", task_name, entity_id, reason)
+
+
+def skipped_count(task_name: str) -> int:
+    """Number of duplicate enqueues/executions skipped for the task."""
+    return cache.get(_skipped_key(task_name), 0)
+
+
+def delay_once(task, entity_id, *args, **options):
+    """Enqueue ``task(entity_id, *args)`` unless one is already queued or running.
+
+    ``args`` are part of the dedup key and must match the parameters the
+    task's ``single_flight`` names, in order. ``options`` are passed to
+    ``apply_async`` (``countdown``, ``kwargs``...). Returns the
+    ``AsyncResult``, or None if the enqueue was collapsed.
+    """
+    entity = _entity((entity_id, *args))
+    if cache.get(_key(task.name, entity, "running")) is not None:
+        _record_skip(task.name, entity, "running")
+        return None
+    queued = _key(task.name, entity, "queued")
+    if not cache.add(queued, 1, timeout=settings.TASK_DEDUP_TTL):
+        _record_skip(task.name, entity, "queued")
+        return None
+    try:
+        if options:
+            return task.apply_async(args=[entity_id, *args], **options)
+        return task.delay(entity_id, *args)
+    except Exception:
+        cache.delete(queued)
+        raise
+
+
+def hand_off():
+    """Keep the entity marked as queued after this run: the task re-enqueued itself."""
+    _handed_off.set(True)
+
+
+def single_flight(*entity_args: str):
+    """Run the decorated task body at most once at a time per ``entity_args`` values.
+
+    Goes under ``@shared_task``. Name the same parameters, in the same
+    order, that callers pass to ``delay_once``. A run that finds the entity already running
+    returns ``{"skipped": "duplicate"}`` without doing anything.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        task_name = f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            entity_id = _entity(bound.arguments[name] for name in entity_args)
+            running = _key(task_name, entity_id, "running")
+            token = uuid.uuid4().hex
+            if not cache.add(running, token, timeout=settings.TASK_DEDUP_TTL):
+                _record_skip(task_name, entity_id, "running")
+                return {"skipped": "duplicate"}
+
+            handed_off = _handed_off.set(False)
+            keep_queued = False
+            try:
+                result = fn(*args, **kwargs)
+                keep_queued = _handed_off.get()
+                return result
+            except Retry:
+                keep_queued = True
+                raise
+            finally:
+                _handed_off.reset(handed_off)
+                if cache.get(running) == token:
+                    cache.delete(running)
+                queued = _key(task_name, entity_id, "queued")
+                if keep_queued:
+                    cache.set(queued, 1, timeout=settings.TASK_DEDUP_TTL)
+                else:
+                    cache.delete(queued)
+
+        return wrapper
+    return decorator
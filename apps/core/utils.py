@@ -22,6 +22,11 @@ def object_hash(text: str) -> str:
     return hashlib.sha256(normalize_text(text).encode()).hexdigest()
 
 
+def url_hash(url: str) -> str:
+    """SHA-256 of a URL (stripped), used as a fixed-size unique key."""
+    return hashlib.sha256(url.strip().encode()).hexdigest()
+
+
 def truncate(text: str, max_len: int = 200) -> str:
     if len(text) <= max_len:
         return text
@@ -5,7 +5,7 @@ import time
 
 from django.conf import settings
 
-from apps.ai_engine import prompts
+from apps.ai_engine import llm, prompts
 from apps.clients.models import Client
 from apps.opportunities.models import AISummary, Opportunity
 
@@ -23,16 +23,17 @@ def _get_model():
         genai.configure(api_key=settings.GEMINI_API_KEY)
         _model = genai.GenerativeModel(
             settings.GEMINI_MODEL,
-            generation_config=genai.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=16000,
-            ),
+            generation_config=genai.GenerationConfig(**llm.GENERATION_CONFIG),
         )
     return _model
 
 
-def run_matching(opportunity: Opportunity, client: Client) -> Match:
-    """Run AI-powered matching between a client and an opportunity."""
+def run_matching(opportunity: Opportunity, client: Client, bypass_cache: bool = False) -> Match:
+    """Run AI-powered matching between a client and an opportunity.
+
+    An unchanged client profile and opportunity reuse the cached LLM answer
+    unless ``bypass_cache`` is set.
+    """
 
     # Build client profile
     client_profile = json.dumps({
@@ -70,7 +71,7 @@ def run_matching(opportunity: Opportunity, client: Client) -> Match:
     # Get extracted checklist if available
     latest_analysis = opportunity.ai_summaries.filter(
         analysis_type=AISummary.AnalysisType.FULL
-    ).first()
+    ).order_by("-created_at").first()
     checklist = "{}"
     if latest_analysis:
         checklist = json.dumps(
@@ -84,29 +85,12 @@ def run_matching(opportunity: Opportunity, client: Client) -> Match:
         checklist=checklist,
     )
 
-    prompt = f"{prompts.MATCHING_SYSTEM}\n\n---\n\n{user_prompt}"
-    prompt += "\n\nIMPORTANTE: Responda APENAS com JSON válido, sem markdown ou texto adicional."
-
-    model = _get_model()
     start = time.time()
-
-    resp = model.generate_content(prompt)
-    content = resp.text
-    tokens = 0
-    if resp.usage_metadata:
-        tokens = (resp.usage_metadata.prompt_token_count or 0) + (resp.usage_metadata.candidates_token_count or 0)
+    generation = llm.generate(_get_model(), prompts.MATCHING_SYSTEM, user_prompt, bypass_cache=bypass_cache)
     elapsed_ms = int((time.time() - start) * 1000)
 
-    # Clean markdown fences
-    cleaned = content.strip()
-    if cleaned.startswith("```"):
-        lines = cleaned.split("\n")
-        lines = [l for l in lines if not l.strip().startswith("```")]
-        cleaned = "\n".join(lines)
-
-    try:
-        data = json.loads(cleaned)
-    except json.JSONDecodeError:
+    data = llm.parse_json(generation.text)
+    if data is None:
         data = {"score": 0, "justificativa": "Erro ao processar resposta da IA"}
 
     # Upsert match
@@ -125,7 +109,8 @@ def run_matching(opportunity: Opportunity, client: Client) -> Match:
     )
 
     logger.info(
-        "Match %s ↔ %s: score=%d (%d tokens, %dms)",
-        client.name, opportunity.title[:50], match.score, tokens, elapsed_ms,
+        "Match %s ↔ %s: score=%d (%d tokens, %dms%s)",
+        client.name, opportunity.title[:50], match.score, generation.tokens, elapsed_ms,
+        ", cached" if generation.cached else "",
     )
     return match
@@ -10,8 +10,8 @@ logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True, queue="ai", max_retries=2, default_retry_delay=30)
-def run_matching(self, opportunity_id: str, client_id: str):
-    """Run matching between an opportunity and a client."""
+def run_matching(self, opportunity_id: str, client_id: str, bypass_cache: bool = False):
+    """Run matching between an opportunity and a client (``bypass_cache``: ignore cached LLM answers)."""
     try:
         opp = Opportunity.objects.get(pk=opportunity_id)
         client = Client.objects.get(pk=client_id)
@@ -22,7 +22,7 @@ def run_matching(self, opportunity_id: str, client_id: str):
     try:
         from .engine import run_matching as do_matching
 
-        match = do_matching(opp, client)
+        match = do_matching(opp, client, bypass_cache=bypass_cache)
 
         # Notify if high score
         if match.score >= 70:
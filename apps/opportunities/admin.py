@@ -3,6 +3,7 @@ from django.contrib import admin
 from .models import (
     AISummary,
     DocumentChunk,
+    DocumentURLIndex,
     ExtractedRequirement,
     Opportunity,
     OpportunityDocument,
@@ -59,6 +60,13 @@ class OpportunityDocumentAdmin(admin.ModelAdmin):
     list_filter = ["processing_status", "ocr_used"]
 
 
+@admin.register(DocumentURLIndex)
+class DocumentURLIndexAdmin(admin.ModelAdmin):
+    list_display = ["url", "file_hash", "content_length", "last_checked_at"]
+    search_fields = ["url", "file_hash"]
+    readonly_fields = ["url_hash"]
+
+
 @admin.register(DocumentChunk)
 class DocumentChunkAdmin(admin.ModelAdmin):
     list_display = ["document", "chunk_index", "page_number", "token_count"]
@@ -81,5 +89,5 @@ class OpportunityEventAdmin(admin.ModelAdmin):
 
 @admin.register(AISummary)
 class AISummaryAdmin(admin.ModelAdmin):
-    list_display = ["opportunity", "analysis_type", "model_name", "prompt_version", "created_at"]
-    list_filter = ["analysis_type", "model_name"]
+    list_display = ["opportunity", "analysis_type", "model_name", "prompt_version", "cache_hit", "created_at"]
+    list_filter = ["analysis_type", "model_name", "cache_hit"]
@@ -0,0 +1,201 @@
+"""Async batch downloader — many documents, few hosts, shared keep-alive.
+
+Most attachments come from a handful of hosts (pncp.gov.br, compras.gov.br),
+so instead of one task + one connection per document we download a batch
+with one ``httpx.AsyncClient`` per host: each host gets its own connection
+pool, keep-alive and concurrency cap, and a slow host only blocks its own
+slots.
+
+Within a batch, a host that fails ``max_host_failures`` times in a row is
+short-circuited: its remaining jobs come back as ``skipped`` so the caller
+can park them (see ``host_health``). ``min_interval`` spaces out request
+starts per host to stay polite with small municipal portals.
+
+This module does no database work (the event loop must not touch the ORM);
+the caller persists the results once the batch is done.
+"""
+import asyncio
+import logging
+import tempfile
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import httpx
+
+from .host_health import is_host_failure
+
+logger = logging.getLogger(__name__)
+
+# Bodies above this size spill from memory to a temp file while downloading
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+
+@dataclass
+class DownloadJob:
+    """One document to fetch. ``validators`` come from the URL index, if known."""
+
+    document_id: str
+    url: str
+    validators: dict | None = None
+
+
+@dataclass
+class DownloadResult:
+    document_id: str
+    url: str
+    body: tempfile.SpooledTemporaryFile | None = None
+    headers: httpx.Headers = field(default_factory=httpx.Headers)
+    unchanged: bool = False  # HEAD validators matched the URL index
+    error: str = ""
+    host_error: bool = False  # failure attributable to the host (5xx, 429, network)
+    skipped: bool = False  # not attempted: host short-circuited within the batch
+
+    def read(self) -> bytes:
+        self.body.seek(0)
+        return self.body.read()
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def response_validators(headers) -> dict:
+    """HTTP validators used to recognise content we already have."""
+    length = headers.get("content-length", "")
+    return {
+        "etag": headers.get("etag", "")[:255],
+        "last_modified": headers.get("last-modified", "")[:100],
+        "content_length": int(length) if length.isdigit() else None,
+    }
+
+
+def validators_match(known: dict, remote: dict) -> bool:
+    """True when the remote validators prove the URL still serves the known content.
+
+    ETag wins when both sides have one; otherwise both Content-Length and
+    Last-Modified must be present and equal (length alone is too weak).
+    """
+    if known.get("etag") and remote["etag"]:
+        return known["etag"] == remote["etag"]
+    return bool(
+        known.get("content_length") is not None
+        and known["content_length"] == remote["content_length"]
+        and known.get("last_modified")
+        and known["last_modified"] == remote["last_modified"]
+    )
+
+
+class BatchDownloader:
+    """Download many URLs concurrently with per-host pools and caps."""
+
+    def __init__(
+        self,
+        per_host_limit: int = 4,
+        total_limit: int = 16,
+        max_file_size: int = 200 * 1024 * 1024,
+        timeout: float = 60.0,
+        max_host_failures: int = 3,
+        min_interval: float = 0.0,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.per_host_limit = per_host_limit
+        self.total_limit = total_limit
+        self.max_file_size = max_file_size
+        self.timeout = timeout
+        self.max_host_failures = max_host_failures
+        self.min_interval = min_interval
+        self.transport = transport
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._host_slots: dict[str, asyncio.Semaphore] = {}
+        self._host_failures: dict[str, int] = {}
+        self._host_next_start: dict[str, float] = {}
+
+    def _client_for(self, host: str) -> httpx.AsyncClient:
+        if host not in self._clients:
+            self._clients[host] = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=15.0),
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.per_host_limit,
+                    max_keepalive_connections=self.per_host_limit,
+                    keepalive_expiry=30.0,
+                ),
+                headers={"User-Agent": "LicitaAI/1.0"},
+                transport=self.transport,
+            )
+            self._host_slots[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._clients[host]
+
+    async def _polite_start(self, host: str):
+        """Space request starts on the same host by ``min_interval`` seconds."""
+        if not self.min_interval:
+            return
+        loop = asyncio.get_running_loop()
+        start_at = max(loop.time(), self._host_next_start.get(host, 0.0))
+        self._host_next_start[host] = start_at + self.min_interval
+        await asyncio.sleep(start_at - loop.time())
+
+    async def _fetch(self, job: DownloadJob, total_slots: asyncio.Semaphore) -> DownloadResult:
+        result = DownloadResult(document_id=job.document_id, url=job.url)
+        host = host_of(job.url)
+        client = self._client_for(host)
+
+        # Per-host slot first: jobs queued behind a slow host must not hold global slots
+        async with self._host_slots[host], total_slots:
+            if self._host_failures.get(host, 0) >= self.max_host_failures:
+                result.skipped = True
+                return result
+            await self._polite_start(host)
+            try:
+                if job.validators:
+                    head = await client.head(job.url)
+                    remote = response_validators(head.headers)
+                    if head.is_success and validators_match(job.validators, remote):
+                        result.unchanged = True
+                        return result
+
+                async with client.stream("GET", job.url) as resp:
+                    resp.raise_for_status()
+                    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+                    try:
+                        total = 0
+                        async for chunk in resp.aiter_bytes(chunk_size=65536):
+                            total += len(chunk)
+                            if total > self.max_file_size:
+                                raise ValueError(
+                                    f"File exceeds {self.max_file_size // (1024*1024)} MB limit"
+                                )
+                            body.write(chunk)
+                    except BaseException:  # size limit, transport error or cancellation
+                        body.close()
+                        raise
+                    result.body = body
+                    result.headers = resp.headers
+                self._host_failures[host] = 0
+            except Exception as exc:
+                result.error = str(exc)[:500] or exc.__class__.__name__
+                result.host_error = is_host_failure(exc)
+                if result.host_error:
+                    self._host_failures[host] = self._host_failures.get(host, 0) + 1
+                logger.warning("Batch download failed for %s: %s", job.url, result.error)
+        return result
+
+    async def run(self, jobs: list[DownloadJob]) -> list[DownloadResult]:
+        total_slots = asyncio.Semaphore(self.total_limit)
+        try:
+            return await asyncio.gather(*(self._fetch(job, total_slots) for job in jobs))
+        finally:
+            await asyncio.gather(*(c.aclose() for c in self._clients.values()))
+            self._clients.clear()
+            self._host_slots.clear()
+            self._host_failures.clear()
+            self._host_next_start.clear()
+
+
+def download_batch(jobs: list[DownloadJob], **kwargs) -> list[DownloadResult]:
+    """Synchronous entry point for Celery tasks."""
+    return asyncio.run(BatchDownloader(**kwargs).run(jobs))
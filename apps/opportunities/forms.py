@@ -59,6 +59,10 @@ class RunAIForm(forms.Form):
         ("checklist", "Checklist de Habilitacao"),
         ("risks", "Riscos e Pegadinhas"),
     ])
+    bypass_cache = forms.BooleanField(
+        required=False, label="Ignorar cache",
+        help_text="Chama o modelo mesmo que o mesmo prompt ja tenha sido respondido",
+    )
 
 
 class RunMatchingForm(forms.Form):
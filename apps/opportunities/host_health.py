@@ -0,0 +1,117 @@
+"""Per-host health tracking and circuit breaker for attachment downloads.
+
+State lives in the shared cache (Redis), so every documents worker sees the
+same picture of a host:
+
+- successes/failures are counted in 1-minute buckets over a sliding window;
+- when a host has at least ``HOST_CIRCUIT_MIN_FAILURES`` failures and its
+  failure rate reaches ``HOST_CIRCUIT_FAILURE_RATE`` the circuit opens for a
+  cooldown that doubles on each consecutive trip;
+- after the cooldown one probe request is let through (half-open): success
+  closes the circuit, failure reopens it. Callers with several documents
+  for the host send only one of them (see ``half_open``).
+
+Tasks for hosts with an open circuit are parked (re-enqueued with a
+countdown) instead of holding a worker on a 60 s timeout.
+"""
+import logging
+import time
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SECONDS = 60
+
+
+def _key(host: str, suffix: str) -> str:
+    return f"hosthealth:{host}:{suffix}"
+
+
+def _buckets() -> range:
+    now = int(time.time() // BUCKET_SECONDS)
+    span = max(1, settings.HOST_CIRCUIT_WINDOW // BUCKET_SECONDS)
+    return range(now - span + 1, now + 1)
+
+
+def _incr(key: str):
+    timeout = settings.HOST_CIRCUIT_WINDOW + BUCKET_SECONDS
+    if not cache.add(key, 1, timeout=timeout):
+        try:
+            cache.incr(key)
+        except ValueError:  # expired between add and incr
+            cache.set(key, 1, timeout=timeout)
+
+
+def window_counts(host: str) -> tuple[int, int]:
+    """(successes, failures) for the host within the current window."""
+    keys = {}
+    for bucket in _buckets():
+        keys[_key(host, f"{bucket}:ok")] = "ok"
+        keys[_key(host, f"{bucket}:fail")] = "fail"
+    values = cache.get_many(list(keys))
+    ok = sum(v for k, v in values.items() if keys[k] == "ok")
+    fail = sum(v for k, v in values.items() if keys[k] == "fail")
+    return ok, fail
+
+
+def retry_after(host: str) -> int:
+    """Seconds to wait before contacting the host; 0 means go ahead.
+
+    When the cooldown is over but the host has tripped recently, only one
+    caller gets the probe slot; the others wait for its outcome.
+    """
+    open_until = cache.get(_key(host, "open"))
+    if open_until:
+        return max(1, int(open_until - time.time()))
+    if cache.get(_key(host, "trips")):
+        if not cache.add(_key(host, "probe"), 1, timeout=settings.HOST_CIRCUIT_PROBE_TIMEOUT):
+            return settings.HOST_CIRCUIT_PROBE_TIMEOUT
+    return 0
+
+
+def half_open(host: str) -> bool:
+    """Whether the host tripped recently: after ``retry_after`` returned 0,
+    the caller holds the single probe and must send one request only."""
+    return bool(cache.get(_key(host, "trips")))
+
+
+def record_success(host: str):
+    _incr(_key(host, f"{_buckets()[-1]}:ok"))
+    if cache.get(_key(host, "trips")):
+        logger.info("Circuit closed for %s", host)
+        cache.delete_many([_key(host, "trips"), _key(host, "probe")])
+
+
+def record_failure(host: str):
+    _incr(_key(host, f"{_buckets()[-1]}:fail"))
+
+    if cache.get(_key(host, "probe")):
+        _trip(host)  # half-open probe failed
+        return
+
+    ok, fail = window_counts(host)
+    rate = fail / (ok + fail)
+    if fail >= settings.HOST_CIRCUIT_MIN_FAILURES and rate >= settings.HOST_CIRCUIT_FAILURE_RATE:
+        _trip(host)
+
+
+def _trip(host: str):
+    trips = (cache.get(_key(host, "trips")) or 0) + 1
+    cooldown = min(
+        settings.HOST_CIRCUIT_COOLDOWN * 2 ** (trips - 1),
+        settings.HOST_CIRCUIT_MAX_COOLDOWN,
+    )
+    cache.set(_key(host, "trips"), trips, timeout=cooldown + settings.HOST_CIRCUIT_MAX_COOLDOWN)
+    cache.set(_key(host, "open"), time.time() + cooldown, timeout=cooldown)
+    cache.delete(_key(host, "probe"))
+    logger.warning("Circuit open for %s: %ds (trip #%d)", host, cooldown, trips)
+
+
+def is_host_failure(exc: Exception) -> bool:
+    """Errors that say something about the host (not about one file)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return isinstance(exc, httpx.TransportError)
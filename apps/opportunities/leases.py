@@ -0,0 +1,217 @@
+"""Processing leases for the document pipeline.
+
+A worker that moves a document into ``DOWNLOADING`` or ``EXTRACTING`` takes a
+lease (``lease_expires_at``) with a conditional UPDATE, so two workers can't
+process the same document at once, and keeps it alive with a heartbeat while
+it works. When a worker dies the heartbeat stops, the lease expires and the
+periodic sweeper (``sweep_document_leases``) hands the document back to the
+previous state with exponential backoff, or marks it failed after
+``DOCUMENT_MAX_ATTEMPTS``. Failed documents get the same bounded retries
+(``retry_failed``), so a transient error is not final.
+
+``next_attempt_at`` is the earliest time the sweeper may dispatch a document
+waiting in ``PENDING``/``DOWNLOADED``. Dispatching pushes it forward by one
+lease period, so a task message that gets lost is re-sent, but a queued one
+isn't duplicated.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OpportunityDocument
+
+logger = logging.getLogger(__name__)
+
+Status = OpportunityDocument.ProcessingStatus
+
+# Leased status → status to fall back to when the lease expires
+RECLAIM_TO = {
+    Status.DOWNLOADING: Status.PENDING,
+    Status.EXTRACTING: Status.DOWNLOADED,
+}
+
+
+def _lease_delta() -> timedelta:
+    return timedelta(seconds=settings.DOCUMENT_LEASE_SECONDS)
+
+
+def dispatch_deadline():
+    """``next_attempt_at`` for work that has just been enqueued."""
+    return timezone.now() + _lease_delta()
+
+
+def backoff(attempts: int) -> timedelta:
+    seconds = settings.DOCUMENT_RETRY_BACKOFF * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, settings.DOCUMENT_MAX_BACKOFF))
+
+
+def _claimable(status: str, from_statuses: list[str], now) -> Q:
+    expired = Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True)
+    return Q(processing_status__in=from_statuses) | (Q(processing_status=status) & expired)
+
+
+def acquire(document_ids, status: str, from_statuses: list[str]) -> list:
+    """Lease the given documents into ``status``; returns the PKs actually acquired.
+
+    Documents in ``from_statuses``, or already in ``status`` with an expired
+    lease, are claimable; anything else (leased by a live worker, already
+    done) is left alone.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        acquired = list(
+            OpportunityDocument.objects
+            .filter(_claimable(status, from_statuses, now), pk__in=document_ids)
+            .select_for_update(skip_locked=True)
+            .values_list("pk", flat=True)
+        )
+        OpportunityDocument.objects.filter(pk__in=acquired).update(
+            processing_status=status,
+            lease_expires_at=now + _lease_delta(),
+            heartbeat_at=now,
+            attempts=F("attempts") + 1,
+            next_attempt_at=None,
+            updated_at=now,
+        )
+    return acquired
+
+
+def heartbeat(document_ids, status: str) -> int:
+    """Extend the leases still held in ``status``. Returns the number renewed."""
+    now = timezone.now()
+    return OpportunityDocument.objects.filter(pk__in=document_ids, processing_status=status).update(
+        lease_expires_at=now + _lease_delta(), heartbeat_at=now,
+    )
+
+
+@contextmanager
+def keep_alive(document_ids, status: str):
+    """Heartbeat the leases from a background thread while the block runs."""
+    ids = list(document_ids)
+    stop = threading.Event()
+    interval = max(settings.DOCUMENT_LEASE_SECONDS / 3, 1)
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                heartbeat(ids, status)
+        except Exception:
+            logger.warning("Lease heartbeat failed for %d document(s)", len(ids), exc_info=True)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name="document-lease-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def reclaim_expired(limit: int = 500) -> dict:
+    """Return documents with expired leases to their previous state, with backoff."""
+    now = timezone.now()
+    reclaimed = failed = 0
+    with transaction.atomic():
+        # A leased status without a lease predates leases: treat it as expired
+        expired = list(
+            OpportunityDocument.objects
+            .filter(processing_status__in=list(RECLAIM_TO))
+            .filter(Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True))
+            .select_for_update(skip_locked=True)[:limit]
+        )
+        for doc in expired:
+            if doc.attempts >= settings.DOCUMENT_MAX_ATTEMPTS:
+                doc.processing_status = Status.FAILED
+                doc.error_message = f"Lease expirado após {doc.attempts} tentativas"
+                failed += 1
+            else:
+                doc.processing_status = RECLAIM_TO[doc.processing_status]
+                doc.next_attempt_at = now + backoff(doc.attempts)
+                reclaimed += 1
+            doc.lease_expires_at = None
+            doc.updated_at = now
+        OpportunityDocument.objects.bulk_update(
+            expired,
+            ["processing_status", "error_message", "next_attempt_at", "lease_expires_at", "updated_at"],
+            batch_size=500,
+        )
+    if expired:
+        logger.warning("Reclaimed %d expired document lease(s), %d failed", reclaimed, failed)
+    return {"reclaimed": reclaimed, "failed": failed}
+
+
+def dispatch_due(queryset=None, limit: int = 500) -> dict:
+    """Enqueue waiting documents whose ``next_attempt_at`` is due (or unset).
+
+    ``PENDING`` (and ``DOWNLOADED`` without a file) go to the batch
+    downloader; ``DOWNLOADED`` with a file goes to extraction.
+    """
+    from apps.core.task_dedup import delay_once
+
+    from .tasks import _enqueue_download_batches, extract_document_text
+
+    now = timezone.now()
+    queryset = queryset if queryset is not None else OpportunityDocument.objects.all()
+    with transaction.atomic():
+        due = list(
+            queryset
+            .filter(processing_status__in=[Status.PENDING, Status.DOWNLOADED], original_url__gt="")
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .select_for_update(skip_locked=True)
+            .values_list("pk", "processing_status", "file")[:limit]
+        )
+        to_download = [pk for pk, status, file in due if status == Status.PENDING or not file]
+        to_extract = [pk for pk, status, file in due if status == Status.DOWNLOADED and file]
+        OpportunityDocument.objects.filter(pk__in=to_download).update(
+            processing_status=Status.PENDING, next_attempt_at=dispatch_deadline(), updated_at=now,
+        )
+        OpportunityDocument.objects.filter(pk__in=to_extract).update(
+            next_attempt_at=dispatch_deadline(), updated_at=now,
+        )
+
+    _enqueue_download_batches(to_download)
+    for pk in to_extract:
+        delay_once(extract_document_text, str(pk))
+    return {"download": len(to_download), "extract": len(to_extract)}
+
+
+def retry_failed(limit: int = 500) -> dict:
+    """Give failed documents another try after ``backoff``, up to ``DOCUMENT_MAX_ATTEMPTS``.
+
+    Documents with a file go back to ``DOWNLOADED`` (the extraction failed),
+    the others to ``PENDING``; ``dispatch_due`` enqueues them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        failed = list(
+            OpportunityDocument.objects
+            .filter(
+                processing_status=Status.FAILED, original_url__gt="",
+                attempts__lt=settings.DOCUMENT_MAX_ATTEMPTS,
+            )
+            .order_by("updated_at")
+            .select_for_update(skip_locked=True)[:limit]
+        )
+        due = [doc for doc in failed if doc.updated_at + backoff(doc.attempts) <= now]
+        for doc in due:
+            doc.processing_status = Status.DOWNLOADED if doc.file else Status.PENDING
+            doc.next_attempt_at = None
+            doc.updated_at = now
+        OpportunityDocument.objects.bulk_update(
+            due, ["processing_status", "next_attempt_at", "updated_at"], batch_size=500,
+        )
+    if due:
+        logger.info("Retrying %d failed document(s)", len(due))
+    return {"retried": len(due)}
+
+
+def sweep() -> dict:
+    return {**reclaim_expired(), **retry_failed(), **dispatch_due()}
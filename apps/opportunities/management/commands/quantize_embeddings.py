@@ -0,0 +1,67 @@
+"""Fill the int8/bit embedding columns from the float vectors (EMBEDDING_STORAGE="int8")."""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps.ai_engine import quantization
+from apps.ai_engine.models import EmbeddingCache
+from apps.opportunities.models import DocumentChunk
+
+
+class Command(BaseCommand):
+    help = "Quantize existing chunk and cache embeddings to int8 + sign bits"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--drop-float", action="store_true",
+            help="Remove o vetor float dos chunks (~15 KB) e do cache (~12 KB) já quantizados",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for model in (DocumentChunk, EmbeddingCache):
+            done = self._quantize(model, batch_size)
+            self.stdout.write(f"{model._meta.verbose_name_plural}: {done} quantized")
+
+        if options["drop_float"]:
+            dropped = (
+                DocumentChunk.objects.filter(embedding_int8__isnull=False, embedding__isnull=False)
+                .update(embedding=None, embedding_index=None)
+            )
+            self.stdout.write(f"Float vectors dropped from {dropped} chunks")
+            dropped = (
+                EmbeddingCache.objects.filter(embedding_int8__isnull=False, embedding__isnull=False)
+                .update(embedding=None)
+            )
+            self.stdout.write(f"Float vectors dropped from {dropped} cache entries")
+
+        chunks = self._storage(DocumentChunk, ["embedding", "embedding_index", "embedding_int8", "embedding_bits"])
+        cached = self._storage(EmbeddingCache, ["embedding", "embedding_int8", "embedding_bits"])
+        self.stdout.write(
+            f"Vector storage: chunks {chunks / 2**20:.1f} MB + cache {cached / 2**20:.1f} MB "
+            f"= {(chunks + cached) / 2**20:.1f} MB"
+        )
+        self.stdout.write(self.style.SUCCESS("Done"))
+
+    def _storage(self, model, columns: list[str]) -> int:
+        """Bytes taken by the vector columns of ``model`` (as stored, after compression)."""
+        sizes = " + ".join(f"coalesce(pg_column_size({column}), 0)" for column in columns)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT coalesce(sum({sizes}), 0) FROM {model._meta.db_table}")
+            return int(cursor.fetchone()[0])
+
+    def _quantize(self, model, batch_size: int) -> int:
+        done = 0
+        pending = model.objects.filter(embedding__isnull=False, embedding_int8__isnull=True)
+        while True:
+            # Each batch drops out of ``pending`` once saved, so re-query from the start
+            rows = list(pending.only("pk", "embedding")[:batch_size])
+            if not rows:
+                return done
+            int8 = quantization.to_int8([row.embedding for row in rows])
+            for row, vector in zip(rows, int8):
+                row.embedding_int8 = vector.tobytes()
+                row.embedding_bits = quantization.to_bits(row.embedding).to_text()
+            with transaction.atomic():
+                model.objects.bulk_update(rows, ["embedding_int8", "embedding_bits"])
+            done += len(rows)
@@ -0,0 +1,243 @@
+"""Re-chunk and/or re-embed indexed documents in bulk, resumably.
+
+Examples::
+
+    # New chunk size: re-chunk in 8 processes, embeddings from the cache where texts repeat
+    manage.py reindex_documents --rechunk --chunk-size 600 --overlap 80 --workers 8
+
+    # New embedding model without downtime
+    EMBEDDING_NEXT_BACKEND=<alias> manage.py reindex_documents --dual-write  # (1) fill embedding_next
+    manage.py reindex_documents --promote                                   # (2) embedding_next -> embedding
+    # (3) deploy with EMBEDDING_BACKEND=<alias>, EMBEDDING_NEXT_BACKEND unset
+
+While EMBEDDING_NEXT_BACKEND is set, documents indexed meanwhile get both
+vectors (see ``embed_chunks``), so after (1) every chunk has the new one.
+The vector columns have ``EMBEDDING_DIMENSIONS`` dimensions: a model with
+another size needs a schema migration of those columns first, and is
+refused before any work starts.
+
+Documents are processed in primary-key order, ``--batch-size`` per round.
+With ``--rechunk`` the new chunks are embedded first, outside any
+transaction (the vectors land in ``EmbeddingCache``); then one transaction
+per round replaces the old chunks and sets their vectors from the cache,
+so searches never see a document without chunks or vectors and no
+transaction stays open across API calls. After every round the last
+primary key is written to ``--checkpoint``; ``--resume`` continues from it.
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from apps.ai_engine.backends import get_backend
+from apps.ai_engine.embeddings import embed_chunks, index_prefix_sql
+from apps.ai_engine.pipeline import CHUNK_OVERLAP, CHUNK_SIZE
+from apps.opportunities.models import DocumentChunk, DocumentText, OpportunityDocument
+
+PROMOTE_BATCH = 5000
+
+
+def _chunk_document(args):
+    """Process-pool worker: chunk boundaries of one document (content is sliced by the parent)."""
+    from apps.ai_engine.pipeline import chunk_text
+
+    document_id, text, page_offsets, chunk_size, overlap = args
+    chunks = chunk_text(text, chunk_size, overlap, page_offsets=page_offsets)
+    for chunk in chunks:
+        del chunk["content"]
+    return document_id, chunks
+
+
+def _warm_up(_):
+    return os.getpid()
+
+
+class Command(BaseCommand):
+    help = "Re-chunk/re-embed documents in bulk, with checkpoints (and dual-write for model migrations)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--opportunity", action="append", default=[], help="ID da oportunidade (repetível)")
+        parser.add_argument("--document", action="append", default=[], help="ID do documento (repetível)")
+        parser.add_argument("--since", help="Só documentos criados a partir desta data (AAAA-MM-DD)")
+        parser.add_argument("--rechunk", action="store_true", help="Refaz os chunks a partir do texto extraído")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos de chunking")
+        parser.add_argument("--reembed", action="store_true", help="Recalcula os embeddings dos chunks atuais")
+        parser.add_argument(
+            "--dual-write", action="store_true",
+            help="Grava em embedding_next com EMBEDDING_NEXT_BACKEND (ou --backend)",
+        )
+        parser.add_argument("--backend", default="", help="Alias de EMBEDDING_BACKENDS")
+        parser.add_argument("--promote", action="store_true", help="Move embedding_next para embedding")
+        parser.add_argument("--force", action="store_true", help="--promote mesmo com chunks sem embedding_next")
+        parser.add_argument("--batch-size", type=int, default=50, help="Documentos por rodada (transação)")
+        parser.add_argument("--checkpoint", default="reindex_documents.checkpoint.json")
+        parser.add_argument("--resume", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["promote"]:
+            return self._promote(options["force"])
+        if not (options["rechunk"] or options["reembed"] or options["dual_write"]):
+            raise CommandError("Use --rechunk, --reembed, --dual-write or --promote")
+        if options["dual_write"] and options["rechunk"]:
+            raise CommandError("--rechunk already dual-writes while EMBEDDING_NEXT_BACKEND is set")
+
+        backend = options["backend"] or None
+        column = "embedding"
+        if options["dual_write"]:
+            backend = backend or settings.EMBEDDING_NEXT_BACKEND
+            if not backend:
+                raise CommandError("--dual-write needs EMBEDDING_NEXT_BACKEND or --backend")
+            column = "embedding_next"
+        self._check_dimensions(backend)
+        if options["rechunk"] and settings.EMBEDDING_NEXT_BACKEND:
+            self._check_dimensions(settings.EMBEDDING_NEXT_BACKEND)
+
+        documents = self._documents(options)
+        run = {
+            key: options[key]
+            for key in ("opportunity", "document", "since", "rechunk", "chunk_size", "overlap",
+                        "reembed", "dual_write", "backend")
+        }
+        cursor = self._load_checkpoint(options, run)
+        if cursor:
+            documents = documents.filter(pk__gt=cursor)
+        total = documents.count()
+        self.stdout.write(f"{total} documents to process")
+
+        pool = None
+        if options["rechunk"] and options["workers"] > 1:
+            # Fork the workers before any connection is reopened: children never touch the DB
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=options["workers"])
+            list(pool.map(_warm_up, range(options["workers"])))
+
+        done = chunk_count = 0
+        started = time.monotonic()
+        try:
+            while True:
+                batch = list(documents.order_by("pk")[: options["batch_size"]])
+                if not batch:
+                    break
+                if options["rechunk"]:
+                    chunks = self._rechunk(batch, options, pool)
+                    # API calls outside the transaction: the chunks aren't saved yet,
+                    # so this only fills EmbeddingCache
+                    embed_chunks(chunks, backend)
+                    with transaction.atomic():
+                        self._replace_chunks(batch, chunks)
+                        embed_chunks(chunks, backend)  # all from the cache
+                else:
+                    chunks = list(DocumentChunk.objects.filter(document__in=batch).with_content())
+                    embed_chunks(chunks, backend, column=column)
+                cursor = batch[-1].pk
+                documents = documents.filter(pk__gt=cursor)
+                done += len(batch)
+                chunk_count += len(chunks)
+                self._save_checkpoint(options["checkpoint"], run, cursor, done, chunk_count)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{done}/{total} documents, {chunk_count} chunks ({done / elapsed:.1f} docs/s)"
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f"Done: {done} documents, {chunk_count} chunks"))
+
+    def _documents(self, options):
+        qs = OpportunityDocument.objects.defer(None).filter(
+            processing_status=OpportunityDocument.ProcessingStatus.INDEXED,
+        )
+        if options["opportunity"]:
+            qs = qs.filter(opportunity_id__in=options["opportunity"])
+        if options["document"]:
+            qs = qs.filter(pk__in=options["document"])
+        if options["since"]:
+            qs = qs.filter(created_at__date__gte=options["since"])
+        return qs
+
+    def _rechunk(self, batch: list[OpportunityDocument], options, pool) -> list[DocumentChunk]:
+        """New chunks of ``batch``, with content, not saved yet."""
+        texts = dict(DocumentText.objects.filter(document__in=batch).values_list("document_id", "content"))
+        jobs = [
+            (
+                doc.pk, texts.get(doc.pk, ""),
+                [entry["offset"] for entry in doc.page_map] or None,
+                options["chunk_size"], options["overlap"],
+            )
+            for doc in batch
+        ]
+        results = pool.map(_chunk_document, jobs) if pool else map(_chunk_document, jobs)
+
+        chunk_objs = []
+        for document_id, chunks in results:
+            for cd in chunks:
+                chunk = DocumentChunk(document_id=document_id, **cd)
+                chunk.content = texts[document_id][cd["start_offset"]:cd["end_offset"]]
+                chunk_objs.append(chunk)
+        return chunk_objs
+
+    def _replace_chunks(self, batch: list[OpportunityDocument], chunks: list[DocumentChunk]):
+        DocumentChunk.objects.filter(document__in=batch).delete()
+        DocumentChunk.objects.bulk_create(chunks, batch_size=1000)
+        DocumentChunk.objects.filter(document__in=batch).index_search_vectors()
+
+    def _check_dimensions(self, backend: str | None):
+        embedder = get_backend(backend)
+        if embedder.dimensions != settings.EMBEDDING_DIMENSIONS:
+            raise CommandError(
+                f"{embedder.model_name} has {embedder.dimensions} dimensions and the vector columns "
+                f"{settings.EMBEDDING_DIMENSIONS}: migrate the columns (embedding, embedding_next, "
+                "embedding_bits, EmbeddingCache) and EMBEDDING_DIMENSIONS first"
+            )
+
+    def _load_checkpoint(self, options, run: dict):
+        path = options["checkpoint"]
+        if not options["resume"]:
+            return None
+        if not os.path.exists(path):
+            raise CommandError(f"No checkpoint at {path}")
+        with open(path) as f:
+            state = json.load(f)
+        if state["run"] != run:
+            raise CommandError(f"Checkpoint {path} is for different options: {state['run']}")
+        self.stdout.write(f"Resuming after document {state['cursor']} ({state['documents']} done)")
+        return state["cursor"]
+
+    def _save_checkpoint(self, path: str, run: dict, cursor, documents: int, chunks: int):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"run": run, "cursor": str(cursor), "documents": documents, "chunks": chunks}, f)
+        os.replace(tmp, path)
+
+    def _promote(self, force: bool):
+        missing = DocumentChunk.objects.filter(embedding_next__isnull=True).exclude(
+            embedding__isnull=True, embedding_bits__isnull=True,
+        ).count()
+        if missing and not force:
+            raise CommandError(f"{missing} chunks have no embedding_next yet; run --dual-write first")
+
+        table = DocumentChunk._meta.db_table
+        promoted = 0
+        with connection.cursor() as cursor:
+            while True:
+                # The quantized forms belong to the old model: quantize_embeddings redoes them
+                cursor.execute(
+                    f"UPDATE {table} SET embedding = embedding_next, "
+                    f"embedding_index = {index_prefix_sql('embedding_next')}, embedding_next = NULL, "
+                    "embedding_int8 = NULL, embedding_bits = NULL "
+                    f"WHERE id IN (SELECT id FROM {table} WHERE embedding_next IS NOT NULL LIMIT {PROMOTE_BATCH})"
+                )
+                promoted += cursor.rowcount
+                if cursor.rowcount < PROMOTE_BATCH:
+                    break
+        self.stdout.write(self.style.SUCCESS(f"Promoted {promoted} chunks"))
+        self.stdout.write("Now set EMBEDDING_BACKEND to the new backend and unset EMBEDDING_NEXT_BACKEND")
+        if settings.EMBEDDING_STORAGE == "int8":
+            self.stdout.write("EMBEDDING_STORAGE=int8: run quantize_embeddings --drop-float")
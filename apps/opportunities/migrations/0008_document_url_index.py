@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:30
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0007_opportunity_last_monitored_at_opportunityevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentURLIndex',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('url', models.URLField(max_length=2000, verbose_name='URL')),
+                ('url_hash', models.CharField(help_text='SHA-256 da URL para lookup indexado', max_length=64, unique=True, verbose_name='Hash da URL')),
+                ('file_hash', models.CharField(db_index=True, max_length=64, verbose_name='SHA-256 do conteúdo')),
+                ('blob_name', models.CharField(max_length=500, verbose_name='Blob armazenado')),
+                ('etag', models.CharField(blank=True, max_length=255, verbose_name='ETag')),
+                ('last_modified', models.CharField(blank=True, max_length=100, verbose_name='Last-Modified')),
+                ('content_length', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Content-Length')),
+                ('mime_type', models.CharField(blank=True, max_length=100, verbose_name='MIME type')),
+                ('last_checked_at', models.DateTimeField(blank=True, null=True, verbose_name='Última verificação')),
+            ],
+            options={
+                'verbose_name': 'Índice de URL de Documento',
+                'verbose_name_plural': 'Índice de URLs de Documentos',
+            },
+        ),
+    ]
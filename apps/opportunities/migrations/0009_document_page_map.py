@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0008_document_url_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='opportunitydocument',
+            name='page_map',
+            field=models.JSONField(blank=True, default=list, help_text='Uma entrada por página com o motor de extração usado', verbose_name='Mapa de páginas'),
+        ),
+    ]
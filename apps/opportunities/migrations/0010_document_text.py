@@ -0,0 +1,71 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:50
+
+import logging
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def try_lz4_compression(apps, schema_editor):
+    # lz4 TOAST compression needs PostgreSQL 14+ built with lz4; pglz otherwise
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute(
+                "ALTER TABLE opportunities_documenttext ALTER COLUMN content SET COMPRESSION lz4;"
+            )
+    except Exception as e:
+        logger.warning("Skipping lz4 compression for document text: %s", e)
+
+
+def copy_extracted_text(apps, schema_editor):
+    OpportunityDocument = apps.get_model("opportunities", "OpportunityDocument")
+    DocumentText = apps.get_model("opportunities", "DocumentText")
+    rows = (
+        OpportunityDocument.objects.exclude(extracted_text="")
+        .values_list("pk", "extracted_text")
+        .iterator(chunk_size=200)
+    )
+    batch = []
+    for pk, text in rows:
+        batch.append(DocumentText(document_id=pk, content=text))
+        if len(batch) >= 200:
+            DocumentText.objects.bulk_create(batch)
+            batch = []
+    DocumentText.objects.bulk_create(batch)
+
+
+def restore_extracted_text(apps, schema_editor):
+    OpportunityDocument = apps.get_model("opportunities", "OpportunityDocument")
+    DocumentText = apps.get_model("opportunities", "DocumentText")
+    for pk, text in DocumentText.objects.values_list("document_id", "content").iterator(chunk_size=200):
+        OpportunityDocument.objects.filter(pk=pk).update(extracted_text=text)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0009_document_page_map'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentText',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='text', serialize=False, to='opportunities.opportunitydocument')),
+                ('content', models.TextField(blank=True, verbose_name='Texto extraído')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Texto de Documento',
+                'verbose_name_plural': 'Textos de Documentos',
+            },
+        ),
+        migrations.RunPython(try_lz4_compression, migrations.RunPython.noop),
+        migrations.RunPython(copy_extracted_text, restore_extracted_text),
+        migrations.RemoveField(
+            model_name='opportunitydocument',
+            name='extracted_text',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-19 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0010_document_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='opportunitydocument',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Tentativas'),
+        ),
+        migrations.AddField(
+            model_name='opportunitydocument',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Último heartbeat'),
+        ),
+        migrations.AddField(
+            model_name='opportunitydocument',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Lease expira em'),
+        ),
+        migrations.AddField(
+            model_name='opportunitydocument',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Próxima tentativa'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:03
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def locate_chunks(apps, schema_editor):
+    """Find each chunk's content in its document text and store the offsets.
+
+    A document with a chunk that is not in its text would keep a vector
+    without a passage once ``content`` is dropped: its chunks are deleted
+    and it goes back to extraction (picked up by the lease sweeper).
+    """
+    DocumentChunk = apps.get_model("opportunities", "DocumentChunk")
+    DocumentText = apps.get_model("opportunities", "DocumentText")
+    OpportunityDocument = apps.get_model("opportunities", "OpportunityDocument")
+    document_ids = DocumentChunk.objects.values_list("document_id", flat=True).distinct()
+    missing = 0
+    stale = set()
+    for document_id in document_ids.iterator(chunk_size=200):
+        text = (
+            DocumentText.objects.filter(document_id=document_id)
+            .values_list("content", flat=True).first()
+        ) or ""
+        chunks = list(
+            DocumentChunk.objects.filter(document_id=document_id)
+            .order_by("chunk_index").only("pk", "content")
+        )
+        cursor = 0
+        for chunk in chunks:
+            # Chunks overlap, so search from the previous chunk's start
+            start = text.find(chunk.content, cursor)
+            if start < 0:
+                start = text.find(chunk.content)
+            if start < 0:
+                missing += 1
+                stale.add(document_id)
+                continue
+            chunk.start_offset = start
+            chunk.end_offset = start + len(chunk.content)
+            cursor = start
+        DocumentChunk.objects.bulk_update(chunks, ["start_offset", "end_offset"], batch_size=500)
+    if stale:
+        DocumentChunk.objects.filter(document_id__in=stale).delete()
+        # Fire the deferred FK checks now: ALTER TABLE refuses pending trigger events
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        documents = OpportunityDocument.objects.filter(pk__in=stale)
+        reset = {"attempts": 0, "next_attempt_at": None, "lease_expires_at": None}
+        documents.exclude(file="").update(processing_status="downloaded", **reset)
+        documents.filter(file="").update(processing_status="pending", **reset)
+        logger.warning(
+            "%d chunk(s) not found in their document text; %d document(s) sent back to extraction",
+            missing, len(stale),
+        )
+
+
+def restore_chunk_content(apps, schema_editor):
+    DocumentChunk = apps.get_model("opportunities", "DocumentChunk")
+    DocumentText = apps.get_model("opportunities", "DocumentText")
+    for text in DocumentText.objects.iterator(chunk_size=50):
+        chunks = list(DocumentChunk.objects.filter(document_id=text.document_id))
+        for chunk in chunks:
+            chunk.content = text.content[chunk.start_offset:chunk.end_offset]
+        DocumentChunk.objects.bulk_update(chunks, ["content"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0011_document_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='start_offset',
+            field=models.PositiveIntegerField(default=0, verbose_name='Início no texto'),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='end_offset',
+            field=models.PositiveIntegerField(default=0, verbose_name='Fim no texto'),
+        ),
+        migrations.AlterField(
+            model_name='documentchunk',
+            name='content',
+            field=models.TextField(blank=True, verbose_name='Conteúdo do chunk'),
+        ),
+        migrations.RunPython(locate_chunks, restore_chunk_content),
+        migrations.RemoveField(
+            model_name='documentchunk',
+            name='content',
+        ),
+    ]
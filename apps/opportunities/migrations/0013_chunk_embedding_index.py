@@ -0,0 +1,41 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:12
+
+import pgvector.django.indexes
+import pgvector.django.vector
+from django.db import migrations
+
+BACKFILL_BATCH = 5000
+
+
+def backfill_embedding_index(apps, schema_editor):
+    # Before the HNSW index exists: bulk-building it afterwards is much faster
+    table = "opportunities_documentchunk"
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                f"UPDATE {table} SET embedding_index = (embedding::real[])[1:768]::vector "
+                f"WHERE id IN (SELECT id FROM {table} WHERE embedding IS NOT NULL "
+                f"AND embedding_index IS NULL LIMIT {BACKFILL_BATCH})"
+            )
+            if cursor.rowcount < BACKFILL_BATCH:
+                break
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0012_chunk_offsets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_index',
+            field=pgvector.django.vector.VectorField(blank=True, dimensions=768, help_text='Primeiras EMBEDDING_INDEX_DIMENSIONS dimensões, para busca aproximada (HNSW)', null=True, verbose_name='Embedding reduzido'),
+        ),
+        migrations.RunPython(backfill_embedding_index, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='documentchunk',
+            index=pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding_index'], m=16, name='idx_chunk_embedding_hnsw', opclasses=['vector_cosine_ops']),
+        ),
+    ]
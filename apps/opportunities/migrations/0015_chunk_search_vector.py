@@ -0,0 +1,46 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:26
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+BACKFILL_BATCH = 5000
+
+
+def backfill_search_vector(apps, schema_editor):
+    # Before the GIN index exists, like 0013
+    table = "opportunities_documentchunk"
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                f"UPDATE {table} AS c SET search_vector = to_tsvector(%s::regconfig, "
+                "substr(t.content, c.start_offset + 1, c.end_offset - c.start_offset)) "
+                "FROM opportunities_documenttext AS t "
+                f"WHERE t.document_id = c.document_id AND c.id IN (SELECT id FROM {table} "
+                "WHERE search_vector IS NULL AND end_offset > start_offset "
+                f"AND document_id IN (SELECT document_id FROM opportunities_documenttext) LIMIT {BACKFILL_BATCH})",
+                [settings.TEXT_SEARCH_CONFIG],
+            )
+            if cursor.rowcount < BACKFILL_BATCH:
+                break
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0014_quantized_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, null=True, verbose_name='Vetor de busca'),
+        ),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='documentchunk',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='idx_chunk_search_vector'),
+        ),
+    ]
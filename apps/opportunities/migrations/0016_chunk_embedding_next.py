@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:35
+
+import pgvector.django.vector
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0015_chunk_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_next',
+            field=pgvector.django.vector.VectorField(blank=True, dimensions=3072, null=True, verbose_name='Embedding (próximo modelo)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0016_chunk_embedding_next'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aisummary',
+            name='cache_hit',
+            field=models.BooleanField(default=False, help_text='Resposta reaproveitada do cache de LLM, sem chamada ao modelo', verbose_name='Do cache'),
+        ),
+    ]
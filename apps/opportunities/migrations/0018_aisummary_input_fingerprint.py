@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0017_aisummary_cache_hit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aisummary',
+            name='input_fingerprint',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 dos hashes dos documentos, metadados da API, versão do prompt e modelo', max_length=64, verbose_name='Impressão das entradas'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-19 06:20
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_file_size(apps, schema_editor):
+    """Size of the stored content, from a document that has the same hash."""
+    DocumentURLIndex = apps.get_model("opportunities", "DocumentURLIndex")
+    OpportunityDocument = apps.get_model("opportunities", "OpportunityDocument")
+    sizes = OpportunityDocument.objects.filter(
+        file_hash=OuterRef("file_hash"), file_size__isnull=False,
+    ).values("file_size")[:1]
+    DocumentURLIndex.objects.filter(file_size__isnull=True).update(file_size=Subquery(sizes))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0018_aisummary_input_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documenturlindex',
+            name='file_size',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Tamanho do conteúdo armazenado (o Content-Length pode faltar ou ser o comprimido)', null=True, verbose_name='Tamanho (bytes)'),
+        ),
+        migrations.RunPython(backfill_file_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0019_url_index_file_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Com EMBED_MAX_ATTEMPTS falhas o chunk deixa de ser embedado', verbose_name='Tentativas de embedding com falha'),
+        ),
+    ]
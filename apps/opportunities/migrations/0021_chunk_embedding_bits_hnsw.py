@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-19 07:05
+
+from django.db import migrations
+
+INDEX = "idx_chunk_embedding_bits_hnsw"
+
+
+def create_bits_index(apps, schema_editor):
+    """HNSW on the sign bits (Hamming), for EMBEDDING_STORAGE="int8".
+
+    Needs pgvector 0.7 (``bit_hamming_ops``); on older versions the quantized
+    search keeps scanning every row (see ``embeddings._search_quantized``).
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cursor.fetchone()
+    if row is None or tuple(int(part) for part in row[0].split(".")[:2]) < (0, 7):
+        return
+    table = apps.get_model("opportunities", "DocumentChunk")._meta.db_table
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX} ON {table} "
+        "USING hnsw (embedding_bits bit_hamming_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def drop_bits_index(apps, schema_editor):
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opportunities', '0020_documentchunk_embedding_attempts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_bits_index, drop_bits_index),
+    ]
@@ -1,7 +1,12 @@
 """Opportunity domain models — Edital, Itens, Documentos, IA, Matching."""
+from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
-from pgvector.django import VectorField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models
+from django.db.models import F
+from django.db.models.functions import Substr
+from pgvector.django import BitField, HnswIndex, VectorField
 
 from apps.core.models import TimeStampedModel
 from apps.core.storage import document_upload_path
@@ -155,8 +160,19 @@ class OpportunityItem(TimeStampedModel):
         return f"Item {self.item_number}: {self.description[:60]}"
 
 
+class OpportunityDocumentManager(models.Manager):
+    """Listagens não carregam o ``page_map`` (uma entrada por página)."""
+
+    def get_queryset(self):
+        return super().get_queryset().defer("page_map")
+
+
 class OpportunityDocument(TimeStampedModel):
-    """Anexo/documento de uma licitação (edital, TR, planilha, etc.)."""
+    """Anexo/documento de uma licitação (edital, TR, planilha, etc.).
+
+    O texto extraído fica em ``DocumentText`` (fora da linha), carregado sob
+    demanda com ``get_extracted_text()``.
+    """
 
     class ProcessingStatus(models.TextChoices):
         PENDING = "pending", "Pendente"
@@ -183,11 +199,24 @@ class OpportunityDocument(TimeStampedModel):
         choices=ProcessingStatus.choices,
         default=ProcessingStatus.PENDING,
     )
-    extracted_text = models.TextField("Texto extraído", blank=True)
     page_count = models.PositiveIntegerField("Páginas", null=True, blank=True)
     ocr_used = models.BooleanField("OCR utilizado", default=False)
+    page_map = models.JSONField(
+        "Mapa de páginas", default=list, blank=True,
+        help_text="Uma entrada por página com o motor de extração usado",
+    )
     error_message = models.TextField("Erro", blank=True)
 
+    # Processing lease (see apps.opportunities.leases)
+    lease_expires_at = models.DateTimeField("Lease expira em", null=True, blank=True, db_index=True)
+    heartbeat_at = models.DateTimeField("Último heartbeat", null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField("Tentativas", default=0)
+    next_attempt_at = models.DateTimeField(
+        "Próxima tentativa", null=True, blank=True, db_index=True,
+    )
+
+    objects = OpportunityDocumentManager()
+
     class Meta:
         verbose_name = "Documento da Oportunidade"
         verbose_name_plural = "Documentos da Oportunidade"
@@ -195,20 +224,149 @@ class OpportunityDocument(TimeStampedModel):
     def __str__(self):
         return f"{self.file_name or self.original_url[:60]}"
 
+    def get_extracted_text(self) -> str:
+        try:
+            return self.text.content
+        except DocumentText.DoesNotExist:
+            return ""
+
+    def set_extracted_text(self, content: str):
+        DocumentText.objects.update_or_create(document=self, defaults={"content": content})
+
+
+class DocumentText(models.Model):
+    """Texto extraído de um documento, fora da linha quente de ``OpportunityDocument``.
+
+    A coluna usa compressão lz4 do TOAST (PostgreSQL 14+) e só é lida pelo
+    pipeline de processamento.
+    """
+
+    document = models.OneToOneField(
+        OpportunityDocument, on_delete=models.CASCADE, primary_key=True, related_name="text",
+    )
+    content = models.TextField("Texto extraído", blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Texto de Documento"
+        verbose_name_plural = "Textos de Documentos"
+
+    def __str__(self):
+        return f"Texto — {self.document_id}"
+
+
+class DocumentURLIndex(TimeStampedModel):
+    """Índice URL → conteúdo, para evitar baixar de novo arquivos já conhecidos.
+
+    Guarda os validadores HTTP (ETag, Last-Modified, Content-Length) da última
+    resposta de cada URL e o blob (por hash) onde o conteúdo foi armazenado.
+    """
+
+    url = models.URLField("URL", max_length=2000)
+    url_hash = models.CharField(
+        "Hash da URL", max_length=64, unique=True,
+        help_text="SHA-256 da URL para lookup indexado",
+    )
+    file_hash = models.CharField("SHA-256 do conteúdo", max_length=64, db_index=True)
+    blob_name = models.CharField("Blob armazenado", max_length=500)
+    file_size = models.PositiveBigIntegerField(
+        "Tamanho (bytes)", null=True, blank=True,
+        help_text="Tamanho do conteúdo armazenado (o Content-Length pode faltar ou ser o comprimido)",
+    )
+    etag = models.CharField("ETag", max_length=255, blank=True)
+    last_modified = models.CharField("Last-Modified", max_length=100, blank=True)
+    content_length = models.PositiveBigIntegerField("Content-Length", null=True, blank=True)
+    mime_type = models.CharField("MIME type", max_length=100, blank=True)
+    last_checked_at = models.DateTimeField("Última verificação", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Índice de URL de Documento"
+        verbose_name_plural = "Índice de URLs de Documentos"
+
+    def __str__(self):
+        return f"{self.url[:60]} → {self.file_hash[:12]}"
+
+    def validators(self) -> dict:
+        return {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "content_length": self.content_length,
+        }
+
+
+class DocumentChunkQuerySet(models.QuerySet):
+    def with_content(self):
+        """Anota ``content``: o trecho do texto do documento, recortado no banco."""
+        return self.annotate(content=Substr(
+            "document__text__content",
+            F("start_offset") + 1,
+            F("end_offset") - F("start_offset"),
+        ))
+
+    def pending_embedding(self):
+        """Chunks sem vetor em nenhuma das formas (float ou quantizada) que ainda serão embedados.
+
+        Ficam de fora os trechos vazios (nada a embedar) e os chunks que já
+        falharam ``EMBED_MAX_ATTEMPTS`` vezes.
+        """
+        return self.filter(
+            embedding__isnull=True, embedding_bits__isnull=True,
+            end_offset__gt=F("start_offset"),
+            embedding_attempts__lt=settings.EMBED_MAX_ATTEMPTS,
+        )
+
+    def index_search_vectors(self) -> int:
+        """Preenche ``search_vector`` a partir do trecho do texto, em um único UPDATE."""
+        subquery, params = self.values("pk").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {DocumentChunk._meta.db_table} AS c SET search_vector = to_tsvector("
+                "%s::regconfig, substr(t.content, c.start_offset + 1, c.end_offset - c.start_offset)) "
+                f"FROM {DocumentText._meta.db_table} AS t "
+                f"WHERE t.document_id = c.document_id AND c.id IN ({subquery})",
+                [settings.TEXT_SEARCH_CONFIG, *params],
+            )
+            return cursor.rowcount
+
 
 class DocumentChunk(TimeStampedModel):
-    """Chunk de texto de um documento para RAG com embedding vetorial."""
+    """Chunk de texto de um documento para RAG com embedding vetorial.
+
+    O chunk não guarda cópia do texto: ``start_offset``/``end_offset`` são
+    posições (em caracteres) no ``DocumentText`` do documento. Use
+    ``DocumentChunk.objects.with_content()`` para ler o conteúdo.
+    """
 
     document = models.ForeignKey(
         OpportunityDocument, on_delete=models.CASCADE, related_name="chunks"
     )
     chunk_index = models.PositiveIntegerField("Índice do chunk")
-    content = models.TextField("Conteúdo do chunk")
+    start_offset = models.PositiveIntegerField("Início no texto", default=0)
+    end_offset = models.PositiveIntegerField("Fim no texto", default=0)
     page_number = models.PositiveIntegerField("Página", null=True, blank=True)
     token_count = models.PositiveIntegerField("Tokens", null=True, blank=True)
     embedding = VectorField(
         "Embedding", dimensions=3072, null=True, blank=True
     )
+    # Prefixo (Matryoshka) do embedding, indexável: HNSW não aceita 3072 dimensões
+    embedding_index = VectorField(
+        "Embedding reduzido", dimensions=768, null=True, blank=True,
+        help_text="Primeiras EMBEDDING_INDEX_DIMENSIONS dimensões, para busca aproximada (HNSW)",
+    )
+    # Embedding do próximo modelo durante uma migração (reindex_documents --dual-write);
+    # mesmo tamanho de ``embedding``: outro tamanho exige migrar as colunas vetoriais
+    embedding_next = VectorField("Embedding (próximo modelo)", dimensions=3072, null=True, blank=True)
+    # Formas quantizadas (EMBEDDING_STORAGE="int8"), ver apps.ai_engine.quantization
+    embedding_int8 = models.BinaryField("Embedding int8", null=True, blank=True)
+    embedding_bits = BitField("Embedding binário", length=3072, null=True, blank=True)
+    # tsvector do trecho (TEXT_SEARCH_CONFIG), para a busca lexical da recuperação híbrida
+    search_vector = SearchVectorField("Vetor de busca", null=True, blank=True)
+    embedding_attempts = models.PositiveSmallIntegerField(
+        "Tentativas de embedding com falha", default=0,
+        help_text="Com EMBED_MAX_ATTEMPTS falhas o chunk deixa de ser embedado",
+    )
+
+    objects = DocumentChunkQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Chunk de Documento"
@@ -217,6 +375,11 @@ class DocumentChunk(TimeStampedModel):
         unique_together = [("document", "chunk_index")]
         indexes = [
             models.Index(fields=["document", "chunk_index"], name="idx_chunk_doc_idx"),
+            HnswIndex(
+                name="idx_chunk_embedding_hnsw", fields=["embedding_index"],
+                m=16, ef_construction=64, opclasses=["vector_cosine_ops"],
+            ),
+            GinIndex(fields=["search_vector"], name="idx_chunk_search_vector"),
         ]
 
     def __str__(self):
@@ -278,6 +441,14 @@ class AISummary(TimeStampedModel):
     model_name = models.CharField("Modelo IA", max_length=100)
     tokens_used = models.PositiveIntegerField("Tokens consumidos", default=0)
     processing_time_ms = models.PositiveIntegerField("Tempo (ms)", default=0)
+    cache_hit = models.BooleanField(
+        "Do cache", default=False,
+        help_text="Resposta reaproveitada do cache de LLM, sem chamada ao modelo",
+    )
+    input_fingerprint = models.CharField(
+        "Impressão das entradas", max_length=64, blank=True, default="",
+        help_text="SHA-256 dos hashes dos documentos, metadados da API, versão do prompt e modelo",
+    )
 
     class Meta:
         verbose_name = "Resumo IA"
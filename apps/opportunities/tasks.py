@@ -1,54 +1,195 @@
 """Celery tasks — document download and processing."""
 import hashlib
-import io
 import logging
-import zipfile
+import random
 
 import httpx
 from celery import shared_task
-
-from .models import Opportunity, OpportunityDocument
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from apps.core.storage import store_blob
+from apps.core.task_dedup import delay_once, hand_off, single_flight
+from apps.core.utils import url_hash
+
+from . import host_health, leases
+from .downloader import (
+    DownloadJob,
+    download_batch,
+    host_of,
+    response_validators,
+    validators_match,
+)
+from .models import DocumentChunk, DocumentURLIndex, Opportunity, OpportunityDocument
 
 logger = logging.getLogger(__name__)
 
 
-def _extract_text_from_zip(zip_content: bytes) -> tuple[str, int, bool]:
-    """Extract text from PDFs/DOCXs inside a ZIP file."""
-    from apps.ai_engine.pipeline import extract_text_from_docx, extract_text_from_pdf
+_MAX_FILE_SIZE = 200 * 1024 * 1024  # 200 MB
+
+# Fields written when a document gets its content (downloaded or linked)
+_CONTENT_FIELDS = [
+    "file", "file_hash", "file_size", "mime_type", "processing_status",
+    "attempts", "next_attempt_at", "updated_at",
+]
 
-    texts = []
-    total_pages = 0
-    ocr_used = False
 
+def _probe_url(url: str) -> dict | None:
+    """HEAD the URL and return its validators (None if the host refuses HEAD)."""
     try:
-        with zipfile.ZipFile(io.BytesIO(zip_content)) as zf:
-            for name in sorted(zf.namelist()):
-                lower = name.lower()
-                if lower.endswith("/") or lower.startswith("__MACOSX"):
-                    continue
-                try:
-                    data = zf.read(name)
-                except Exception:
-                    continue
-
-                if lower.endswith(".pdf"):
-                    text, pages, ocr = extract_text_from_pdf(data)
-                    if text.strip():
-                        texts.append(f"=== {name} ({pages} páginas) ===\n{text}")
-                        total_pages += pages
-                        ocr_used = ocr_used or ocr
-                elif lower.endswith(".docx"):
-                    text = extract_text_from_docx(data)
-                    if text.strip():
-                        texts.append(f"=== {name} ===\n{text}")
-    except zipfile.BadZipFile:
-        logger.warning("Invalid ZIP file")
-        return "", 0, False
-
-    return "\n\n".join(texts), total_pages, ocr_used
+        resp = httpx.head(url, timeout=15, follow_redirects=True)
+        resp.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    return response_validators(resp.headers)
+
+
+def _lookup_indexed_content(doc: OpportunityDocument) -> DocumentURLIndex | None:
+    """Return the URL index entry if the URL is known and its content unchanged."""
+    entry = DocumentURLIndex.objects.filter(url_hash=url_hash(doc.original_url)).first()
+    if not entry:
+        return None
+    remote = _probe_url(doc.original_url)
+    if remote is None or not validators_match(entry.validators(), remote):
+        return None
+    entry.last_checked_at = timezone.now()
+    entry.save(update_fields=["last_checked_at", "updated_at"])
+    return entry
+
+
+def _link_content(
+    doc: OpportunityDocument, name: str, file_hash: str, file_size: int | None, mime_type: str,
+):
+    """Point a document at stored content. Caller saves with ``_CONTENT_FIELDS``."""
+    doc.file.name = name
+    doc.file_hash = file_hash
+    doc.file_size = file_size
+    doc.mime_type = mime_type
+    doc.processing_status = OpportunityDocument.ProcessingStatus.DOWNLOADED
+    doc.attempts = 0
+    doc.next_attempt_at = leases.dispatch_deadline()  # extraction is enqueued right away
+
+
+def _store_content(doc: OpportunityDocument, content: bytes, headers) -> None:
+    """Store downloaded content once per hash, index the URL and link the document.
+
+    Content already referenced by another document (legacy per-document paths)
+    is reused as is; new content goes to the hash-keyed blob layout.
+    """
+    file_hash = hashlib.sha256(content).hexdigest()
+    mime_type = headers.get("content-type", "").split(";")[0].strip()
+
+    existing = (
+        OpportunityDocument.objects
+        .filter(file_hash=file_hash)
+        .exclude(pk=doc.pk)
+        .exclude(file="")
+        .only("file", "mime_type")
+        .first()
+    )
+    if existing:
+        name = existing.file.name
+        mime_type = existing.mime_type or mime_type
+        logger.info("Document %s deduped from %s (hash match)", doc.pk, existing.pk)
+    else:
+        name = store_blob(doc.file.storage, file_hash, content)
+
+    _link_content(doc, name, file_hash, len(content), mime_type)
+
+    DocumentURLIndex.objects.update_or_create(
+        url_hash=url_hash(doc.original_url),
+        defaults={
+            "url": doc.original_url,
+            "file_hash": file_hash,
+            "blob_name": name,
+            "file_size": len(content),
+            "mime_type": mime_type,
+            "last_checked_at": timezone.now(),
+            **response_validators(headers),
+        },
+    )
+
+
+def _park_countdown(wait: int) -> int:
+    """Requeue delay for parked work, with jitter so a host is not hit in a burst."""
+    return wait + random.randint(0, 30)
+
+
+def _park_documents(
+    docs: list[OpportunityDocument], host: str, wait: int, requeue: bool = False,
+) -> int:
+    """Keep documents of an unavailable host pending and retry them later.
+
+    With ``requeue=True`` a single batch task is scheduled for all of them;
+    otherwise the caller re-enqueues its own task with the returned countdown.
+    The lease sweeper leaves them alone until that task had its chance.
+    """
+    countdown = _park_countdown(wait)
+    now = timezone.now()
+    OpportunityDocument.objects.filter(pk__in=[d.pk for d in docs]).update(
+        processing_status=OpportunityDocument.ProcessingStatus.PENDING,
+        error_message=f"Host {host} indisponível; nova tentativa em ~{wait}s",
+        next_attempt_at=leases.dispatch_deadline() + timezone.timedelta(seconds=countdown),
+        updated_at=now,
+    )
+    if requeue:
+        download_documents_batch.apply_async(args=[[str(d.pk) for d in docs]], countdown=countdown)
+    logger.info("Parked %d document(s) for %s (%ds)", len(docs), host, wait)
+    return countdown
+
+
+# Everything a chunk holds besides its document: copied when content is reused
+_COPIED_CHUNK_FIELDS = (
+    "chunk_index", "start_offset", "end_offset", "page_number", "token_count",
+    "embedding", "embedding_index", "embedding_next", "embedding_int8", "embedding_bits", "search_vector",
+)
+
+
+def _reuse_indexed_content(doc: OpportunityDocument) -> int | None:
+    """Copy text, chunks and embeddings from an indexed document with the same content.
+
+    Returns the number of chunks copied, or None when there is no such
+    document and the content has to be processed from scratch. Page fields
+    are set on ``doc`` but not saved; the caller marks it indexed.
+    """
+    if not doc.file_hash:
+        return None
+    source = (
+        OpportunityDocument.objects.defer(None)
+        .filter(file_hash=doc.file_hash, processing_status=OpportunityDocument.ProcessingStatus.INDEXED)
+        .exclude(pk=doc.pk)
+        .order_by("created_at")
+        .first()
+    )
+    if source is None:
+        return None
+
+    chunk_rows = source.chunks.values(*_COPIED_CHUNK_FIELDS)
+    with transaction.atomic():
+        doc.chunks.all().delete()
+        copied = DocumentChunk.objects.bulk_create(
+            [DocumentChunk(document=doc, **row) for row in chunk_rows],
+            batch_size=500,
+        )
+        doc.set_extracted_text(source.get_extracted_text())
+        doc.page_count = source.page_count
+        doc.ocr_used = source.ocr_used
+        doc.page_map = source.page_map
+    return len(copied)
+
+
+def _enqueue_download_batches(document_ids) -> int:
+    """Split document IDs into ``download_documents_batch`` tasks."""
+    ids = [str(pk) for pk in document_ids]
+    size = settings.DOCUMENT_DOWNLOAD_BATCH_SIZE
+    for i in range(0, len(ids), size):
+        download_documents_batch.delay(ids[i : i + size])
+    return len(ids)
 
 
 @shared_task(bind=True, queue="documents", max_retries=3, default_retry_delay=60)
+@single_flight("opportunity_id")
 def download_opportunity_documents(self, opportunity_id: str):
     """Download all pending documents for an opportunity."""
     try:
@@ -57,17 +198,150 @@ def download_opportunity_documents(self, opportunity_id: str):
         logger.error("Opportunity %s not found", opportunity_id)
         return
 
-    pending_docs = opp.documents.filter(
-        processing_status=OpportunityDocument.ProcessingStatus.PENDING
+    return leases.dispatch_due(opp.documents.all())
+
+
+@shared_task(bind=True, queue="documents", soft_time_limit=1500, time_limit=1800)
+def download_documents_batch(self, document_ids: list[str]):
+    """Download many documents in one task with the async per-host downloader.
+
+    Connections are pooled and kept alive per host, with a per-host
+    concurrency cap. Status changes are written with bulk updates; failed
+    documents fall back to ``download_single_document`` and its retry policy.
+    """
+    docs = list(
+        OpportunityDocument.objects
+        .filter(pk__in=document_ids, original_url__gt="")
+        .exclude(processing_status__in=[
+            OpportunityDocument.ProcessingStatus.DOWNLOADED,
+            OpportunityDocument.ProcessingStatus.EXTRACTING,
+            OpportunityDocument.ProcessingStatus.INDEXED,
+        ])
     )
+    if not docs:
+        return {"downloaded": 0, "linked": 0, "failed": 0, "parked": 0}
+
+    # Park documents whose host has an open circuit
+    parked = 0
+    by_host: dict[str, list[OpportunityDocument]] = {}
+    for doc in docs:
+        by_host.setdefault(host_of(doc.original_url), []).append(doc)
+    for host, host_docs in list(by_host.items()):
+        wait = host_health.retry_after(host)
+        if wait:
+            _park_documents(host_docs, host, wait, requeue=True)
+            parked += len(host_docs)
+            del by_host[host]
+        elif host_health.half_open(host) and len(host_docs) > 1:
+            # This batch holds the probe: one document goes, the rest wait for its outcome
+            _park_documents(host_docs[1:], host, settings.HOST_CIRCUIT_PROBE_TIMEOUT, requeue=True)
+            parked += len(host_docs) - 1
+            by_host[host] = host_docs[:1]
+    docs = [doc for host_docs in by_host.values() for doc in host_docs]
+    if not docs:
+        return {"downloaded": 0, "linked": 0, "failed": 0, "parked": parked}
+
+    acquired = set(leases.acquire(
+        [d.pk for d in docs],
+        OpportunityDocument.ProcessingStatus.DOWNLOADING,
+        [OpportunityDocument.ProcessingStatus.PENDING, OpportunityDocument.ProcessingStatus.FAILED],
+    ))
+    docs = [doc for doc in docs if doc.pk in acquired]
+    if not docs:
+        return {"downloaded": 0, "linked": 0, "failed": 0, "parked": parked}
+
+    index = {
+        entry.url_hash: entry
+        for entry in DocumentURLIndex.objects.filter(
+            url_hash__in=[url_hash(d.original_url) for d in docs]
+        )
+    }
+    jobs = []
+    for doc in docs:
+        entry = index.get(url_hash(doc.original_url))
+        jobs.append(DownloadJob(
+            document_id=str(doc.pk),
+            url=doc.original_url,
+            validators=entry.validators() if entry else None,
+        ))
+
+    with leases.keep_alive(acquired, OpportunityDocument.ProcessingStatus.DOWNLOADING):
+        results = download_batch(
+            jobs,
+            per_host_limit=settings.DOCUMENT_DOWNLOAD_PER_HOST,
+            total_limit=settings.DOCUMENT_DOWNLOAD_CONCURRENCY,
+            max_file_size=_MAX_FILE_SIZE,
+            min_interval=settings.DOCUMENT_DOWNLOAD_HOST_INTERVAL,
+        )
 
-    for doc in pending_docs:
-        download_single_document.delay(str(doc.pk))
+    by_id = {str(d.pk): d for d in docs}
+    done, failed, linked_entries = [], [], []
+    skipped: dict[str, list[OpportunityDocument]] = {}
+    for result in results:
+        doc = by_id[result.document_id]
+        host = host_of(doc.original_url)
+        if result.skipped:
+            skipped.setdefault(host, []).append(doc)
+            continue
+        if result.host_error:
+            host_health.record_failure(host)
+        elif not result.error:
+            host_health.record_success(host)
+        try:
+            if result.error:
+                raise ValueError(result.error)
+            if result.unchanged:
+                entry = index[url_hash(doc.original_url)]
+                _link_content(doc, entry.blob_name, entry.file_hash, entry.file_size, entry.mime_type)
+                linked_entries.append(entry.pk)
+            else:
+                _store_content(doc, result.read(), result.headers)
+            done.append(doc)
+        except Exception as exc:
+            doc.processing_status = OpportunityDocument.ProcessingStatus.FAILED
+            doc.error_message = str(exc)[:500]
+            failed.append(doc)
+        finally:
+            result.close()
+
+    now = timezone.now()
+    for doc in done + failed:
+        doc.updated_at = now
+    with transaction.atomic():
+        OpportunityDocument.objects.bulk_update(done, _CONTENT_FIELDS)
+        OpportunityDocument.objects.bulk_update(failed, ["processing_status", "error_message", "updated_at"])
+        DocumentURLIndex.objects.filter(pk__in=linked_entries).update(last_checked_at=now)
+
+    for host, host_docs in skipped.items():
+        _park_documents(host_docs, host, settings.HOST_CIRCUIT_COOLDOWN, requeue=True)
+        parked += len(host_docs)
+
+    for doc in done:
+        delay_once(extract_document_text, str(doc.pk))
+    for doc in failed:
+        delay_once(download_single_document, str(doc.pk), countdown=60)
+
+    logger.info(
+        "Batch download: %d downloaded, %d linked, %d failed, %d parked (of %d)",
+        len(done) - len(linked_entries), len(linked_entries), len(failed), parked,
+        len(document_ids),
+    )
+    return {
+        "downloaded": len(done) - len(linked_entries),
+        "linked": len(linked_entries),
+        "failed": len(failed),
+        "parked": parked,
+    }
 
 
 @shared_task(bind=True, queue="documents", max_retries=3, default_retry_delay=60)
+@single_flight("document_id")
 def download_single_document(self, document_id: str):
-    """Download a single document and compute its hash."""
+    """Download a single document and compute its hash.
+
+    Content already known to the URL index is linked without downloading
+    (HEAD precheck on ETag / Last-Modified / Content-Length).
+    """
     try:
         doc = OpportunityDocument.objects.get(pk=document_id)
     except OpportunityDocument.DoesNotExist:
@@ -80,67 +354,58 @@ def download_single_document(self, document_id: str):
         doc.save(update_fields=["processing_status", "error_message", "updated_at"])
         return
 
-    doc.processing_status = OpportunityDocument.ProcessingStatus.DOWNLOADING
-    doc.save(update_fields=["processing_status", "updated_at"])
-
-    max_file_size = 200 * 1024 * 1024  # 200 MB
+    host = host_of(doc.original_url)
+    wait = host_health.retry_after(host)
+    if wait:
+        countdown = _park_documents([doc], host, wait)
+        download_single_document.apply_async(args=[document_id], countdown=countdown)
+        hand_off()
+        return {"parked": wait}
+
+    if not leases.acquire(
+        [doc.pk],
+        OpportunityDocument.ProcessingStatus.DOWNLOADING,
+        [OpportunityDocument.ProcessingStatus.PENDING, OpportunityDocument.ProcessingStatus.FAILED],
+    ):
+        logger.info("Document %s is leased or already downloaded, skipping", document_id)
+        return {"skipped": True}
 
     try:
-        with httpx.stream("GET", doc.original_url, timeout=60, follow_redirects=True) as resp:
+        entry = _lookup_indexed_content(doc)
+        if entry:
+            _link_content(doc, entry.blob_name, entry.file_hash, entry.file_size, entry.mime_type)
+            doc.save(update_fields=_CONTENT_FIELDS)
+            logger.info("Document %s linked to known content %s (URL index)", document_id, entry.file_hash[:12])
+            delay_once(extract_document_text, str(doc.pk))
+            return
+
+        timeout = httpx.Timeout(60, connect=10)
+        with (
+            leases.keep_alive([doc.pk], OpportunityDocument.ProcessingStatus.DOWNLOADING),
+            httpx.stream("GET", doc.original_url, timeout=timeout, follow_redirects=True) as resp,
+        ):
             resp.raise_for_status()
 
             chunks = []
             total = 0
-            content_type = resp.headers.get("content-type", "")
             for chunk in resp.iter_bytes(chunk_size=65536):
                 total += len(chunk)
-                if total > max_file_size:
-                    raise ValueError(f"File exceeds {max_file_size // (1024*1024)} MB limit")
+                if total > _MAX_FILE_SIZE:
+                    raise ValueError(f"File exceeds {_MAX_FILE_SIZE // (1024*1024)} MB limit")
                 chunks.append(chunk)
 
-        content = b"".join(chunks)
-        file_hash = hashlib.sha256(content).hexdigest()
-
-        # Dedup by hash: if another doc already has this content, copy its file
-        # reference instead of saving a new one, but still proceed to extraction.
-        existing = (
-            OpportunityDocument.objects
-            .filter(file_hash=file_hash)
-            .exclude(pk=doc.pk)
-            .exclude(file="")
-            .first()
-        )
-        if existing and existing.file:
-            doc.file = existing.file
-            doc.file_hash = file_hash
-            doc.file_size = existing.file_size
-            doc.mime_type = existing.mime_type or content_type.split(";")[0].strip()
-            doc.processing_status = OpportunityDocument.ProcessingStatus.DOWNLOADED
-            doc.save(update_fields=[
-                "file", "file_hash", "file_size", "mime_type",
-                "processing_status", "updated_at",
-            ])
-            logger.info("Document %s deduped from %s (hash match)", document_id, existing.pk)
-            extract_document_text.delay(str(doc.pk))
-            return
+        host_health.record_success(host)
+        _store_content(doc, b"".join(chunks), resp.headers)
+        doc.save(update_fields=_CONTENT_FIELDS)
 
-        # Determine filename
-        filename = doc.file_name or doc.original_url.split("/")[-1] or f"{file_hash[:12]}.pdf"
-
-        from django.core.files.base import ContentFile
-        doc.file.save(filename, ContentFile(content), save=False)
-        doc.file_hash = file_hash
-        doc.file_size = len(content)
-        doc.mime_type = content_type.split(";")[0].strip()
-        doc.processing_status = OpportunityDocument.ProcessingStatus.DOWNLOADED
-        doc.save()
-
-        logger.info("Downloaded: %s (%d bytes)", filename, len(content))
+        logger.info("Downloaded: %s (%d bytes)", doc.file.name, doc.file_size)
 
         # Enqueue text extraction
-        extract_document_text.delay(str(doc.pk))
+        delay_once(extract_document_text, str(doc.pk))
 
     except Exception as exc:
+        if host_health.is_host_failure(exc):
+            host_health.record_failure(host)
         doc.processing_status = OpportunityDocument.ProcessingStatus.FAILED
         doc.error_message = str(exc)[:500]
         doc.save(update_fields=["processing_status", "error_message", "updated_at"])
@@ -149,6 +414,7 @@ def download_single_document(self, document_id: str):
 
 
 @shared_task(bind=True, queue="documents", max_retries=2, default_retry_delay=30)
+@single_flight("document_id")
 def extract_document_text(self, document_id: str):
     """Extract text from a downloaded document and create chunks + embeddings."""
     try:
@@ -159,75 +425,17 @@ def extract_document_text(self, document_id: str):
     if not doc.file:
         return
 
-    doc.processing_status = OpportunityDocument.ProcessingStatus.EXTRACTING
-    doc.save(update_fields=["processing_status", "updated_at"])
+    if not leases.acquire(
+        [doc.pk],
+        OpportunityDocument.ProcessingStatus.EXTRACTING,
+        [OpportunityDocument.ProcessingStatus.DOWNLOADED, OpportunityDocument.ProcessingStatus.FAILED],
+    ):
+        logger.info("Document %s is leased or already indexed, skipping", document_id)
+        return
 
     try:
-        file_content = doc.file.read()
-        mime = doc.mime_type.lower()
-        fname = (doc.file_name or "").lower()
-
-        from apps.ai_engine.pipeline import (
-            chunk_text,
-            extract_text_from_docx,
-            extract_text_from_pdf,
-        )
-
-        # Handle ZIP files: extract PDFs inside and concatenate text
-        is_zip = (
-            "zip" in mime
-            or fname.endswith(".zip")
-            or file_content[:4] == b"PK\x03\x04"
-        )
-        if is_zip:
-            text, page_count, ocr_used = _extract_text_from_zip(file_content)
-            doc.page_count = page_count
-            doc.ocr_used = ocr_used
-        elif "pdf" in mime or fname.endswith(".pdf"):
-            text, page_count, ocr_used = extract_text_from_pdf(file_content)
-            doc.page_count = page_count
-            doc.ocr_used = ocr_used
-        elif "word" in mime or fname.endswith(".docx"):
-            text = extract_text_from_docx(file_content)
-        else:
-            text = file_content.decode("utf-8", errors="replace")
-
-        # PostgreSQL TEXT fields cannot contain NUL bytes
-        text = text.replace("\x00", "")
-        doc.extracted_text = text
-        doc.file_name = (doc.file_name or "").replace("\x00", "")
-        doc.processing_status = OpportunityDocument.ProcessingStatus.INDEXED
-        doc.save(update_fields=[
-            "extracted_text", "file_name", "page_count", "ocr_used",
-            "processing_status", "updated_at",
-        ])
-
-        # Create chunks
-        from apps.opportunities.models import DocumentChunk
-
-        doc.chunks.all().delete()  # Idempotent reprocessing
-        chunks_data = chunk_text(text)
-
-        chunk_objs = []
-        for cd in chunks_data:
-            chunk_objs.append(DocumentChunk(
-                document=doc,
-                chunk_index=cd["chunk_index"],
-                content=cd["content"],
-                page_number=cd["page_number"],
-                token_count=cd["token_count"],
-            ))
-        DocumentChunk.objects.bulk_create(chunk_objs)
-
-        # Generate embeddings (non-fatal — AI can still use chunks without embeddings)
-        try:
-            from apps.ai_engine.embeddings import embed_chunks
-            embed_chunks(list(doc.chunks.all()))
-        except Exception:
-            logger.warning("Embedding failed for %s, chunks saved without vectors", doc.file_name, exc_info=True)
-
-        logger.info("Indexed document %s: %d chunks", doc.file_name, len(chunk_objs))
-
+        with leases.keep_alive([doc.pk], OpportunityDocument.ProcessingStatus.EXTRACTING):
+            _extract_and_index(doc)
     except Exception as exc:
         doc.processing_status = OpportunityDocument.ProcessingStatus.FAILED
         doc.error_message = str(exc)[:500]
@@ -236,15 +444,119 @@ def extract_document_text(self, document_id: str):
         raise self.retry(exc=exc)
 
 
+def _mark_indexed(doc: OpportunityDocument, fields: list[str]):
+    doc.processing_status = OpportunityDocument.ProcessingStatus.INDEXED
+    doc.error_message = ""
+    doc.attempts = 0
+    doc.lease_expires_at = None
+    doc.save(update_fields=[
+        *fields, "processing_status", "error_message", "attempts", "lease_expires_at", "updated_at",
+    ])
+
+
+def _extract_and_index(doc: OpportunityDocument):
+    """Extraction → chunks (embeddings requested) for a document leased in EXTRACTING."""
+    # Same content already indexed (republished edital, same annex on
+    # several opportunities): copy its artifacts instead of reprocessing.
+    reused = _reuse_indexed_content(doc)
+    if reused is not None:
+        if doc.chunks.pending_embedding().exists():
+            from apps.ai_engine.tasks import request_embeddings
+            request_embeddings()
+        _mark_indexed(doc, ["page_count", "ocr_used", "page_map"])
+        logger.info("Reused indexed content for %s: %d chunks", doc.file_name, reused)
+        return
+
+    mime = doc.mime_type.lower()
+    fname = (doc.file_name or "").lower()
+
+    from apps.ai_engine.pipeline import (
+        ENGINE_DOCX,
+        ENGINE_TEXT,
+        ExtractedPage,
+        ExtractionResult,
+        chunk_text,
+        extract_pdf,
+        extract_text_from_docx,
+        extract_zip,
+    )
+
+    # Handle ZIP files: members are streamed from the stored file, which
+    # is never read into memory as a whole (S3 objects are downloaded to a
+    # temp file that rolls over to disk past AWS_S3_MAX_MEMORY_SIZE).
+    # DOCX files are ZIPs too.
+    is_docx = "word" in mime or fname.endswith(".docx")
+    doc.file.open("rb")
+    magic = doc.file.read(4)
+    doc.file.seek(0)
+    is_zip = (
+        "zip" in mime
+        or fname.endswith(".zip")
+        or (magic == b"PK\x03\x04" and not is_docx)
+    )
+    try:
+        if is_zip:
+            result = extract_zip(doc.file)
+        else:
+            file_content = doc.file.read()
+            if "pdf" in mime or fname.endswith(".pdf"):
+                result = extract_pdf(file_content, doc.file_hash)
+            elif is_docx:
+                result = ExtractionResult(
+                    [ExtractedPage(extract_text_from_docx(file_content), ENGINE_DOCX)]
+                )
+            else:
+                result = ExtractionResult(
+                    [ExtractedPage(file_content.decode("utf-8", errors="replace"), ENGINE_TEXT)]
+                )
+    finally:
+        doc.file.close()
+
+    # PostgreSQL TEXT fields cannot contain NUL bytes
+    for page in result.pages:
+        page.text = page.text.replace("\x00", "")
+    text = result.text
+    doc.set_extracted_text(text)
+    if is_zip or "pdf" in mime or fname.endswith(".pdf"):
+        doc.page_count = result.page_count
+        doc.ocr_used = result.ocr_used
+    doc.page_map = result.page_map()
+    doc.file_name = (doc.file_name or "").replace("\x00", "")
+
+    # Create chunks
+    doc.chunks.all().delete()  # Idempotent reprocessing
+    chunks_data = chunk_text(text, page_offsets=result.page_offsets())
+
+    chunk_objs = []
+    for cd in chunks_data:
+        chunk_objs.append(DocumentChunk(
+            document=doc,
+            chunk_index=cd["chunk_index"],
+            start_offset=cd["start_offset"],
+            end_offset=cd["end_offset"],
+            page_number=cd["page_number"],
+            token_count=cd["token_count"],
+        ))
+    DocumentChunk.objects.bulk_create(chunk_objs)
+    doc.chunks.index_search_vectors()
+
+    # Embeddings are batched across documents (apps.ai_engine.tasks.embed_pending_chunks);
+    # until then the chunks are found by full-text search
+    if chunk_objs:
+        from apps.ai_engine.tasks import request_embeddings
+        request_embeddings()
+
+    _mark_indexed(doc, ["file_name", "page_count", "ocr_used", "page_map"])
+    logger.info("Indexed document %s: %d chunks", doc.file_name, len(chunk_objs))
+
+
 @shared_task(queue="documents")
 def download_pending_documents():
-    """Scan for documents with pending status and enqueue download."""
-    pending = OpportunityDocument.objects.filter(
-        processing_status=OpportunityDocument.ProcessingStatus.PENDING,
-        original_url__gt="",
-    ).values_list("pk", flat=True)[:200]
+    """Enqueue waiting documents (pending download or extraction) that are due."""
+    return leases.dispatch_due()
 
-    for doc_id in pending:
-        download_single_document.delay(str(doc_id))
 
-    return {"enqueued": len(pending)}
+@shared_task(queue="documents")
+def sweep_document_leases():
+    """Requeue documents whose processing lease expired, then dispatch due work."""
+    return leases.sweep()
@@ -147,8 +147,12 @@ class RunAIView(LoginRequiredMixin, View):
         form = RunAIForm(request.POST)
         if form.is_valid():
             from apps.ai_engine.tasks import run_ai_analysis
-            run_ai_analysis.delay(str(opp.pk), form.cleaned_data["analysis_type"])
-            messages.success(request, "Analise IA enfileirada com sucesso.")
+            from apps.core.task_dedup import delay_once
+            if delay_once(run_ai_analysis, str(opp.pk), form.cleaned_data["analysis_type"],
+                          form.cleaned_data["bypass_cache"]):
+                messages.success(request, "Analise IA enfileirada com sucesso.")
+            else:
+                messages.info(request, "Analise IA ja esta em andamento para esta oportunidade.")
         else:
             messages.error(request, "Formulario invalido.")
         return redirect("opportunities:detail", pk=pk)
@@ -157,6 +161,8 @@ class RunAIView(LoginRequiredMixin, View):
 class ReprocessDocumentsView(LoginRequiredMixin, View):
     def post(self, request, pk):
         opp = get_object_or_404(Opportunity, pk=pk)
+        from apps.core.task_dedup import delay_once
+
         from .models import OpportunityDocument
         from .tasks import download_single_document, extract_document_text
 
@@ -168,13 +174,13 @@ class ReprocessDocumentsView(LoginRequiredMixin, View):
                 OpportunityDocument.ProcessingStatus.DOWNLOADED,
                 OpportunityDocument.ProcessingStatus.EXTRACTING,
             ):
-                extract_document_text.delay(str(doc.pk))
+                delay_once(extract_document_text, str(doc.pk))
                 requeued += 1
             elif doc.original_url:
                 doc.processing_status = OpportunityDocument.ProcessingStatus.PENDING
                 doc.error_message = ""
                 doc.save(update_fields=["processing_status", "error_message", "updated_at"])
-                download_single_document.delay(str(doc.pk))
+                delay_once(download_single_document, str(doc.pk))
                 requeued += 1
 
         if requeued:
@@ -12,6 +12,7 @@ app.autodiscover_tasks()
 
 # ── Named queues ────────────────────────────────────────
 app.conf.task_routes = {
+    "apps.ai_engine.tasks.embed_pending_chunks": {"queue": "embeddings"},
     "apps.connectors.tasks.*": {"queue": "ingest"},
     "apps.ai_engine.tasks.*": {"queue": "ai"},
     "apps.opportunities.tasks.download_*": {"queue": "documents"},
@@ -61,4 +62,22 @@ app.conf.beat_schedule = {
         "kwargs": {"hours_back": 6},
         "options": {"queue": "ingest"},
     },
+    # Leases de documentos expirados (worker morreu) + documentos com nova tentativa vencida
+    "sweep-document-leases": {
+        "task": "apps.opportunities.tasks.sweep_document_leases",
+        "schedule": crontab(minute="*"),
+        "options": {"queue": "documents"},
+    },
+    # Chunks sem embedding que o batcher não pegou (broker indisponível, falha da API)
+    "embed-pending-chunks": {
+        "task": "apps.ai_engine.tasks.embed_pending_chunks",
+        "schedule": crontab(minute="*"),
+        "options": {"queue": "embeddings"},
+    },
+    # Cache de respostas do LLM: expiradas e excedentes — diário, 04:00 UTC
+    "prune-llm-cache": {
+        "task": "apps.ai_engine.tasks.prune_llm_cache",
+        "schedule": crontab(hour=4, minute=0),
+        "options": {"queue": "ai"},
+    },
 }
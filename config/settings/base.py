@@ -148,6 +148,10 @@ AWS_DEFAULT_ACL = None
 AWS_S3_FILE_OVERWRITE = False
 AWS_QUERYSTRING_AUTH = True
 AWS_S3_SIGNATURE_VERSION = "s3v4"
+# Objects opened for reading are downloaded to a temp file that stays in
+# memory up to this size and then rolls over to disk (0 = never: a ZIP of
+# several hundred MB would be held in RAM while its members are extracted)
+AWS_S3_MAX_MEMORY_SIZE = env.int("AWS_S3_MAX_MEMORY_SIZE", default=16 * 1024 * 1024)
 
 STORAGES = {
     "default": {
@@ -178,6 +182,8 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 1800  # 30 min hard limit
 CELERY_TASK_SOFT_TIME_LIMIT = 1500  # 25 min soft limit
+# Queued/running markers per (task, entity) — see apps.core.task_dedup
+TASK_DEDUP_TTL = env.int("TASK_DEDUP_TTL", default=CELERY_TASK_TIME_LIMIT)
 
 # ── DRF ─────────────────────────────────────────────────
 REST_FRAMEWORK = {
@@ -201,6 +207,47 @@ GEMINI_API_KEY = env("GEMINI_API_KEY", default="")
 GEMINI_MODEL = env("GEMINI_MODEL", default="gemini-2.0-flash")
 GEMINI_EMBEDDING_MODEL = env("GEMINI_EMBEDDING_MODEL", default="gemini-embedding-001")
 EMBEDDING_DIMENSIONS = 3072
+# Embedding backends by alias (see apps.ai_engine.backends). EMBEDDING_BACKEND
+# indexes chunks and embeds queries; switching it requires re-embedding.
+EMBEDDING_BACKENDS = {
+    "gemini": {"BACKEND": "apps.ai_engine.backends.GeminiBackend"},
+    "local": {"BACKEND": "apps.ai_engine.backends.HashingBackend"},
+}
+EMBEDDING_BACKEND = env("EMBEDDING_BACKEND", default="gemini")
+# During a model migration: backend also written to DocumentChunk.embedding_next
+# (see the reindex_documents command)
+EMBEDDING_NEXT_BACKEND = env("EMBEDDING_NEXT_BACKEND", default="")
+# Cross-document embedding batcher: chunks per round, max seconds a new chunk waits
+EMBED_MICROBATCH_SIZE = env.int("EMBED_MICROBATCH_SIZE", default=500)
+EMBED_MICROBATCH_WAIT = env.int("EMBED_MICROBATCH_WAIT", default=5)
+# Failed embedding attempts after which a chunk is left without a vector
+# (no longer pending: the batcher and analyses stop waiting for it)
+EMBED_MAX_ATTEMPTS = env.int("EMBED_MAX_ATTEMPTS", default=5)
+# Prefix of each embedding kept in DocumentChunk.embedding_index (HNSW-indexed);
+# changing it needs a migration of that column and a backfill
+EMBEDDING_INDEX_DIMENSIONS = 768
+# Corpus-wide search: ANN candidates re-ranked with the full vector
+VECTOR_SEARCH_CANDIDATES = env.int("VECTOR_SEARCH_CANDIDATES", default=100)
+HNSW_EF_SEARCH = env.int("HNSW_EF_SEARCH", default=100)
+# "float": chunks keep the float32 vector (+ HNSW prefix); "int8": only the
+# int8 vector and sign bits (~3.4 KB instead of ~15 KB per chunk), searched by
+# Hamming distance and rescored in Python. Run quantize_embeddings when switching.
+EMBEDDING_STORAGE = env("EMBEDDING_STORAGE", default="float")
+QUANTIZED_SEARCH_CANDIDATES = env.int("QUANTIZED_SEARCH_CANDIDATES", default=200)
+# Per-worker LRU of opportunity chunk matrices for in-memory retrieval (~12 KB per chunk)
+RETRIEVER_CACHE_MB = env.int("RETRIEVER_CACHE_MB", default=256)
+# PostgreSQL text search configuration for DocumentChunk.search_vector
+# (changing it needs DocumentChunk.objects.index_search_vectors() over all chunks)
+TEXT_SEARCH_CONFIG = env("TEXT_SEARCH_CONFIG", default="portuguese")
+HYBRID_SEARCH_CANDIDATES = env.int("HYBRID_SEARCH_CANDIDATES", default=50)
+# Search query embeddings: per-worker LRU (entries) in front of Redis
+QUERY_EMBEDDING_CACHE_SIZE = env.int("QUERY_EMBEDDING_CACHE_SIZE", default=512)
+QUERY_EMBEDDING_CACHE_TTL = env.int("QUERY_EMBEDDING_CACHE_TTL", default=30 * 24 * 3600)
+# Persistent LLM response cache (apps.ai_engine.llm): seconds an answer is
+# reused, and entries kept by the daily prune (least recently used go first)
+LLM_CACHE_ENABLED = env.bool("LLM_CACHE_ENABLED", default=True)
+LLM_CACHE_TTL = env.int("LLM_CACHE_TTL", default=30 * 24 * 3600)
+LLM_CACHE_MAX_ENTRIES = env.int("LLM_CACHE_MAX_ENTRIES", default=5000)
 
 # ── API connectors ─────────────────────────────────────
 PNCP_API_BASE_URL = env("PNCP_API_BASE_URL", default="https://pncp.gov.br/api/pncp")
@@ -232,5 +279,42 @@ WAHA_API_URL = env("WAHA_API_URL", default="http://waha:3000")
 WAHA_API_KEY = env("WAHA_API_KEY", default="")
 WAHA_SESSION = env("WAHA_SESSION", default="default")
 
+# ── Documents ───────────────────────────────────────────
+# Batch downloader: documents per task, connections per host, total in flight
+DOCUMENT_DOWNLOAD_BATCH_SIZE = env.int("DOCUMENT_DOWNLOAD_BATCH_SIZE", default=50)
+DOCUMENT_DOWNLOAD_PER_HOST = env.int("DOCUMENT_DOWNLOAD_PER_HOST", default=4)
+DOCUMENT_DOWNLOAD_CONCURRENCY = env.int("DOCUMENT_DOWNLOAD_CONCURRENCY", default=16)
+DOCUMENT_DOWNLOAD_HOST_INTERVAL = env.float("DOCUMENT_DOWNLOAD_HOST_INTERVAL", default=0.2)
+
+# Circuit breaker per attachment host (see apps.opportunities.host_health)
+HOST_CIRCUIT_WINDOW = env.int("HOST_CIRCUIT_WINDOW", default=300)  # seconds
+HOST_CIRCUIT_MIN_FAILURES = env.int("HOST_CIRCUIT_MIN_FAILURES", default=5)
+HOST_CIRCUIT_FAILURE_RATE = env.float("HOST_CIRCUIT_FAILURE_RATE", default=0.5)
+HOST_CIRCUIT_COOLDOWN = env.int("HOST_CIRCUIT_COOLDOWN", default=120)  # doubles per trip
+HOST_CIRCUIT_MAX_COOLDOWN = env.int("HOST_CIRCUIT_MAX_COOLDOWN", default=3600)
+HOST_CIRCUIT_PROBE_TIMEOUT = env.int("HOST_CIRCUIT_PROBE_TIMEOUT", default=90)
+
+# Processing leases: a worker's claim on a document expires unless renewed by
+# its heartbeat; the sweeper retries expired ones with exponential backoff
+DOCUMENT_LEASE_SECONDS = env.int("DOCUMENT_LEASE_SECONDS", default=300)
+DOCUMENT_MAX_ATTEMPTS = env.int("DOCUMENT_MAX_ATTEMPTS", default=5)
+DOCUMENT_RETRY_BACKOFF = env.int("DOCUMENT_RETRY_BACKOFF", default=60)  # doubles per attempt
+DOCUMENT_MAX_BACKOFF = env.int("DOCUMENT_MAX_BACKOFF", default=3600)
+
+# PDF extraction: documents above PDF_SHARD_PAGES pages are split into page
+# ranges of at least that size and extracted across a process pool. The pool
+# is per Celery worker process: with --concurrency=2, up to 2x this many run
+PDF_EXTRACTION_WORKERS = env.int("PDF_EXTRACTION_WORKERS", default=max(1, min(4, (os.cpu_count() or 1) // 2)))
+PDF_SHARD_PAGES = env.int("PDF_SHARD_PAGES", default=50)
+
+# ZIP attachments: nesting depth, decompressed size budget per archive,
+# per-member compression ratio and number of documents (zip bomb guards)
+ZIP_MAX_DEPTH = env.int("ZIP_MAX_DEPTH", default=3)
+ZIP_MAX_TOTAL_SIZE = env.int("ZIP_MAX_TOTAL_SIZE", default=1024 * 1024 * 1024)
+ZIP_MAX_RATIO = env.int("ZIP_MAX_RATIO", default=100)
+ZIP_MAX_MEMBERS = env.int("ZIP_MAX_MEMBERS", default=500)
+
 # ── OCR ─────────────────────────────────────────────────
 TESSERACT_LANG = env("TESSERACT_LANG", default="por")
+OCR_WORKERS = env.int("OCR_WORKERS", default=2)  # concurrent pages being rendered/OCR'd
+OCR_CACHE_TTL = env.int("OCR_CACHE_TTL", default=30 * 24 * 3600)
@@ -35,5 +35,5 @@ echo "Iniciando Celery worker..."
 exec celery -A config.celery worker \
     --loglevel=info \
     --concurrency=2 \
-    --queues=ingest,documents,ai,notifications \
+    --queues=ingest,documents,embeddings,ai,notifications \
     -n worker@%h
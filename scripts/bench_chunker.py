@@ -0,0 +1,102 @@
+"""Benchmark chunk_text: the old quadratic chunker vs. the linear one.
+
+Usage: python scripts/bench_chunker.py [--pages 1000] [--encoding cl100k_base]
+
+Builds a synthetic edital with ``--pages`` pages (~3 KB of text each, joined
+like ``ExtractionResult.text``), chunks it with both implementations and
+checks that they produce the same chunks and page numbers. The old chunker
+re-decodes the whole prefix for every chunk, so expect it to take minutes at
+1,000 pages; ``--skip-legacy`` times only the new one.
+
+``--encoding`` swaps the tokenizer (e.g. when the ``gpt-4o`` encoding can't
+be downloaded); both implementations use the same one.
+"""
+import argparse
+import bisect
+import os
+import sys
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.development")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+django.setup()
+
+import tiktoken  # noqa: E402
+
+from apps.ai_engine import pipeline  # noqa: E402
+
+PARAGRAPH = (
+    "{n}.{i} A CONTRATADA deverá executar os serviços de manutenção predial "
+    "preventiva e corretiva conforme o Termo de Referência, observando as "
+    "normas técnicas da ABNT e a legislação vigente, sob pena das sanções "
+    "previstas no art. 156 da Lei nº 14.133/2021. "
+)
+
+
+def build_document(pages: int) -> tuple[str, list[int]]:
+    texts = [
+        f"Página {n}\n" + "\n".join(PARAGRAPH.format(n=n, i=i) for i in range(1, 11))
+        for n in range(1, pages + 1)
+    ]
+    offsets, position = [], 0
+    for text in texts:
+        offsets.append(position)
+        position += len(text) + 2
+    return "\n\n".join(texts), offsets
+
+
+def legacy_chunk_text(text, chunk_size, overlap, page_offsets):
+    """chunk_text as it was: prefix decode per chunk."""
+    enc = pipeline._encoding()
+    tokens = enc.encode(text)
+    chunks, start = [], 0
+    while start < len(tokens):
+        end = min(start + chunk_size, len(tokens))
+        content = enc.decode(tokens[start:end])
+        text_position = len(enc.decode(tokens[:start]))
+        chunks.append({
+            "content": content.strip(),
+            "token_count": end - start,
+            "page_number": bisect.bisect_right(page_offsets, text_position),
+        })
+        start = end - overlap if end < len(tokens) else end
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--encoding", help="Encoding do tiktoken no lugar do gpt-4o")
+    parser.add_argument("--skip-legacy", action="store_true", help="Não rodar o chunker antigo")
+    args = parser.parse_args()
+
+    if args.encoding:
+        encoding = tiktoken.get_encoding(args.encoding)
+        pipeline._encoding = lambda: encoding
+
+    text, offsets = build_document(args.pages)
+    pipeline._encoding()  # load the tokenizer outside the timings
+    print(f"{args.pages} páginas, {len(text) / 1e6:.1f} M caracteres")
+
+    t0 = time.perf_counter()
+    chunks = pipeline.chunk_text(text, page_offsets=offsets)
+    t_new = time.perf_counter() - t0
+    print(f"linear:    {t_new:8.2f}s  {len(chunks)} chunks")
+
+    if args.skip_legacy:
+        return
+
+    t0 = time.perf_counter()
+    legacy = legacy_chunk_text(text, pipeline.CHUNK_SIZE, pipeline.CHUNK_OVERLAP, offsets)
+    t_old = time.perf_counter() - t0
+    print(f"quadrático:{t_old:8.2f}s  {len(legacy)} chunks  ({t_old / max(t_new, 1e-6):.0f}x)")
+
+    same_pages = sum(a["page_number"] == b["page_number"] for a, b in zip(chunks, legacy))
+    same_content = sum(a["content"] == b["content"] for a, b in zip(chunks, legacy))
+    print(f"iguais: conteúdo {same_content}/{len(legacy)}, página {same_pages}/{len(legacy)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark quantized embedding search: recall of Hamming candidates + int8 rescoring.
+
+Usage: python scripts/bench_quantization.py [--vectors 20000] [--queries 50] [--k 10]
+
+Uses the synthetic corpus of ``bench_vector_index.py`` and, for each
+candidate count, reports recall@k against the exact float32 top-k of
+two strategies: sign bits only (Hamming) and Hamming candidates rescored
+with the int8 vectors — what ``search_similar_chunks`` does when
+``EMBEDDING_STORAGE = "int8"``. Also prints the bytes stored per text,
+chunk and ``EmbeddingCache`` row together.
+Real Gemini embeddings should be checked the same way before lowering
+``QUANTIZED_SEARCH_CANDIDATES``.
+"""
+import argparse
+import time
+
+import numpy as np
+from bench_vector_index import DIMENSIONS, synthetic_vectors
+
+from apps.ai_engine import quantization
+
+INDEX_DIMENSIONS = 768  # EMBEDDING_INDEX_DIMENSIONS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", default="10,50,100,200,500",
+                        help="Números de candidatos por Hamming a testar (separados por vírgula)")
+    args = parser.parse_args()
+
+    corpus, queries = synthetic_vectors(args.vectors, args.queries)
+    truth = np.argsort(-(queries @ corpus.T), axis=1)[:, : args.k]
+
+    t0 = time.perf_counter()
+    int8 = quantization.to_int8(corpus).astype(np.float32)
+    bits = corpus > 0
+    print(f"{args.vectors} vetores quantizados em {time.perf_counter() - t0:.1f}s")
+    # Float: vector + HNSW prefix in the chunk, vector in the cache; int8: int8 + bits in both
+    float_chunk = (DIMENSIONS + INDEX_DIMENSIONS) * 4
+    int8_chunk = DIMENSIONS + DIMENSIONS // 8
+    print("bytes/texto (chunk + cache):")
+    print(f"  float32 {float_chunk} + {DIMENSIONS * 4} = {float_chunk + DIMENSIONS * 4}")
+    print(f"  int8    {int8_chunk} + {int8_chunk} = {2 * int8_chunk}\n")
+
+    print(f"{'candidatos':>10} {'recall bits':>12} {'recall +int8':>13} {'ms/consulta':>12}")
+    for candidates in (int(c) for c in args.candidates.split(",")):
+        hits_bits = hits_rescored = 0
+        t0 = time.perf_counter()
+        for query, expected in zip(queries, truth):
+            hamming = np.count_nonzero(bits != (query > 0), axis=1)
+            pool = np.argsort(hamming, kind="stable")[:candidates]
+            distances = quantization.cosine_distances(query, int8[pool])
+            rescored = pool[np.argsort(distances)[: args.k]]
+            expected = set(expected.tolist())
+            hits_bits += len(set(pool[: args.k].tolist()) & expected)
+            hits_rescored += len(set(rescored.tolist()) & expected)
+        elapsed_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        total = args.k * len(queries)
+        print(f"{candidates:10} {hits_bits / total:12.3f} {hits_rescored / total:13.3f} {elapsed_ms:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark corpus-wide vector search: exact scan vs. HNSW on a prefix + re-ranking.
+
+Usage: python scripts/bench_vector_index.py [--vectors 20000] [--queries 50] [--k 10]
+
+Loads synthetic 3072-dim vectors into a temporary table with the same layout
+as ``DocumentChunk`` (full ``embedding`` + ``embedding_index`` prefix with an
+HNSW index), then for each candidate count reports recall@k against the
+exact top-k (computed with NumPy) and the mean query latency, next to the
+latency of the exact sequential scan.
+
+The vectors imitate Matryoshka embeddings: clustered, with the variance
+concentrated in the leading dimensions. Real Gemini embeddings should be
+checked the same way before lowering ``VECTOR_SEARCH_CANDIDATES``.
+"""
+import argparse
+import os
+import sys
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.development")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from pgvector.psycopg.vector import register_vector_info  # noqa: E402
+from psycopg.types import TypeInfo  # noqa: E402
+
+DIMENSIONS = 3072
+
+
+def synthetic_vectors(n: int, queries: int, seed: int = 42) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    scale = 1 / np.sqrt(1 + np.arange(DIMENSIONS) / 64)  # most energy in the prefix
+    centers = rng.standard_normal((max(n // 50, 1), DIMENSIONS)) * scale
+    corpus = centers[rng.integers(len(centers), size=n)] + 0.5 * rng.standard_normal((n, DIMENSIONS)) * scale
+    picks = corpus[rng.integers(n, size=queries)]
+    query = picks + 0.3 * rng.standard_normal((queries, DIMENSIONS)) * scale
+    normalize = lambda m: (m / np.linalg.norm(m, axis=1, keepdims=True)).astype(np.float32)  # noqa: E731
+    return normalize(corpus), normalize(query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", type=int, default=settings.EMBEDDING_INDEX_DIMENSIONS,
+                        help="Dimensões do prefixo indexado")
+    parser.add_argument("--candidates", default="10,20,50,100,200",
+                        help="Números de candidatos do HNSW a testar (separados por vírgula)")
+    args = parser.parse_args()
+
+    corpus, queries = synthetic_vectors(args.vectors, args.queries)
+    truth = np.argsort(-(queries @ corpus.T), axis=1)[:, : args.k]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        raw = cursor.cursor
+        register_vector_info(raw, TypeInfo.fetch(raw.connection, "vector"))
+        cursor.execute(
+            f"CREATE TEMP TABLE _bench_chunks (id int PRIMARY KEY, embedding vector({DIMENSIONS}), "
+            f"embedding_index vector({args.dims})) ON COMMIT DROP"
+        )
+        t0 = time.perf_counter()
+        with raw.copy("COPY _bench_chunks (id, embedding) FROM STDIN WITH (FORMAT BINARY)") as copy:
+            copy.set_types(["int4", "vector"])
+            for i, vector in enumerate(corpus):
+                copy.write_row((i, vector))
+        cursor.execute(
+            f"UPDATE _bench_chunks SET embedding_index = (embedding::real[])[1:{args.dims}]::vector"
+        )
+        print(f"{args.vectors} vetores carregados em {time.perf_counter() - t0:.1f}s")
+
+        t0 = time.perf_counter()
+        cursor.execute(
+            "CREATE INDEX ON _bench_chunks USING hnsw (embedding_index vector_cosine_ops) "
+            "WITH (m = 16, ef_construction = 64)"
+        )
+        cursor.execute("ANALYZE _bench_chunks")
+        print(f"índice HNSW ({args.dims} dims) em {time.perf_counter() - t0:.1f}s\n")
+
+        t0 = time.perf_counter()
+        for query in queries:
+            cursor.execute(
+                "SELECT id FROM _bench_chunks ORDER BY embedding <=> %s LIMIT %s", [query, args.k],
+            )
+        exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        print(f"{'estratégia':28} {'recall@' + str(args.k):>10} {'ms/consulta':>12}")
+        print(f"{'scan exato (3072 dims)':28} {1.0:10.3f} {exact_ms:12.1f}")
+
+        for candidates in (int(c) for c in args.candidates.split(",")):
+            cursor.execute(f"SET LOCAL hnsw.ef_search = {max(40, candidates)}")
+            hits, t0 = 0, time.perf_counter()
+            for query, expected in zip(queries, truth):
+                cursor.execute(
+                    "SELECT id FROM _bench_chunks WHERE id IN ("
+                    "  SELECT id FROM _bench_chunks ORDER BY embedding_index <=> %s LIMIT %s"
+                    ") ORDER BY embedding <=> %s LIMIT %s",
+                    [query[: args.dims], candidates, query, args.k],
+                )
+                hits += len({row[0] for row in cursor.fetchall()} & set(expected.tolist()))
+            elapsed_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+            recall = hits / (args.k * len(queries))
+            print(f"{f'HNSW {candidates} cand. + rerank':28} {recall:10.3f} {elapsed_ms:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
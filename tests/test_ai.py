@@ -1,9 +1,14 @@
 """Tests for AI pipeline — unit tests with mocked LLM calls."""
+import io
 import json
+import zipfile
 from unittest.mock import MagicMock, patch
 
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from apps.ai_engine import backends, embeddings, pipeline, retriever, search
 from apps.ai_engine.pipeline import chunk_text
 
 
@@ -26,9 +31,746 @@ class TestChunking:
         assert "quick brown fox" in chunks[0]["content"]
 
 
+PROSE = (
+    "O presente edital tem por objeto a contratação de empresa especializada "
+    "para prestação de serviços de manutenção predial, conforme termo de referência.\n"
+) * 3
+
+
+@pytest.mark.usefixtures("locmem_cache")
+class TestTieredPdfExtraction:
+    def test_plain_prose_stays_on_fast_path(self):
+        assert not pipeline._page_needs_layout(PROSE)
+
+    def test_broken_pages_need_layout(self):
+        assert pipeline._page_needs_layout("")
+        assert pipeline._page_needs_layout("(cid:12)(cid:40)(cid:7) " * 20)
+        assert pipeline._page_needs_layout("Opresenteeditaltemporobjetoacontratação " * 5)
+
+    def test_table_pages_need_layout(self):
+        rows = "\n".join(f"Item {i}  Cimento CP-II  {i * 10}  R$32,50  R$325,00" for i in range(1, 8))
+        assert pipeline._page_needs_layout(rows)
+
+    @patch("apps.ai_engine.pipeline.pdfplumber.open")
+    @patch("apps.ai_engine.pipeline._extract_fast_pages")
+    def test_only_flagged_pages_go_to_pdfplumber(self, mock_fast, mock_open):
+        mock_fast.return_value = [PROSE, "(cid:3)" * 40, PROSE]
+        layout_page = MagicMock()
+        layout_page.extract_text.return_value = "Tabela de preços reconstruída"
+        pdf = MagicMock()
+        pdf.pages = [MagicMock(), layout_page, MagicMock()]
+        mock_open.return_value.__enter__.return_value = pdf
+
+        result = pipeline.extract_pdf(b"%PDF")
+
+        assert [p.engine for p in result.pages] == ["pypdf", "pdfplumber", "pypdf"]
+        assert result.page_map()[1]["engine"] == "pdfplumber"
+        assert "reconstruída" in result.text
+        pdf.pages[0].extract_text.assert_not_called()
+        assert not result.ocr_used
+
+
+def _map_in_daemon(results):
+    results.put(pipeline._map_in_processes(abs, [(-1,), (-2,), (-3,)], 2))
+
+
+@pytest.mark.usefixtures("locmem_cache")
+class TestShardedPdfExtraction:
+    PAGES = [f"Página {n} do edital: cláusula {n} trata das obrigações da contratada." for n in range(1, 8)]
+
+    def test_shards_reassembled_in_page_order(self, make_pdf, settings):
+        settings.PDF_EXTRACTION_WORKERS = 3
+        settings.PDF_SHARD_PAGES = 2
+
+        result = pipeline.extract_pdf(make_pdf(self.PAGES))
+
+        assert [p.text.strip() for p in result.pages] == self.PAGES
+        offsets = result.page_offsets()
+        assert result.text[offsets[4]:].startswith("Página 5 ")
+
+    def test_pool_starts_inside_daemonic_worker(self):
+        import multiprocessing
+
+        # Celery prefork children are daemonic, like this process
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=_map_in_daemon, args=(results,), daemon=True)
+        worker.start()
+        worker.join(timeout=60)
+
+        assert results.get(timeout=5) == [1, 2, 3]
+
+    @patch("apps.ai_engine.pipeline.ProcessPoolExecutor", side_effect=AssertionError)
+    def test_falls_back_to_serial_without_pool(self, _pool, make_pdf, settings):
+        settings.PDF_EXTRACTION_WORKERS = 3
+        settings.PDF_SHARD_PAGES = 2
+
+        result = pipeline.extract_pdf(make_pdf(self.PAGES))
+
+        assert [p.text.strip() for p in result.pages] == self.PAGES
+
+    def test_chunk_pages_follow_page_offsets(self):
+        pages = ["primeira página " * 50, "segunda página " * 50, "terceira página " * 50]
+        offsets, position = [], 0
+        for page in pages:
+            offsets.append(position)
+            position += len(page) + 2
+
+        chunks = chunk_text("\n\n".join(pages), chunk_size=60, overlap=0, page_offsets=offsets)
+
+        assert chunks[0]["page_number"] == 1
+        assert chunks[-1]["page_number"] == 3
+        assert {c["page_number"] for c in chunks} == {1, 2, 3}
+
+
+@pytest.mark.usefixtures("locmem_cache")
+class TestPerPageOcr:
+    TEXT_PAGE = "Cláusula primeira: o objeto desta licitação é a contratação de serviços de limpeza. " * 2
+
+    @patch("apps.ai_engine.pipeline._ocr_page")
+    def test_only_sparse_pages_are_ocred(self, mock_ocr, make_pdf):
+        mock_ocr.side_effect = lambda path, n: f"Anexo escaneado, página {n}, texto reconhecido pelo OCR " * 2
+        pdf = make_pdf([self.TEXT_PAGE, "", self.TEXT_PAGE, ""])
+
+        result = pipeline.extract_pdf(pdf, file_hash="abc")
+
+        assert sorted(call.args[1] for call in mock_ocr.call_args_list) == [2, 4]
+        assert [p.engine for p in result.pages] == ["pypdf", "ocr", "pypdf", "ocr"]
+        assert result.ocr_used
+        assert "página 4" in result.pages[3].text
+
+    @patch("apps.ai_engine.pipeline._ocr_page")
+    def test_ocr_results_cached_by_file_hash_and_page(self, mock_ocr, make_pdf):
+        mock_ocr.return_value = "Texto reconhecido de uma página escaneada do termo de referência " * 2
+        pdf = make_pdf([self.TEXT_PAGE, ""])
+
+        pipeline.extract_pdf(pdf, file_hash="abc")
+        result = pipeline.extract_pdf(pdf, file_hash="abc")
+
+        assert mock_ocr.call_count == 1
+        assert result.pages[1].engine == "ocr"
+
+
+def _zip(members: dict[str, bytes]) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+@pytest.mark.usefixtures("locmem_cache")
+class TestZipExtraction:
+    LINE = "Termo de referência: especificações técnicas do objeto e obrigações da contratada. " * 2
+
+    def test_nested_members_keep_their_own_pages(self, make_pdf, settings):
+        settings.PDF_EXTRACTION_WORKERS = 2
+        inner = _zip({"anexo_ii.pdf": make_pdf([f"Anexo II p1 {self.LINE}"])})
+        archive = _zip({
+            "edital.pdf": make_pdf([f"Edital p1 {self.LINE}", f"Edital p2 {self.LINE}"]),
+            "anexos.zip": inner,
+            "leiame.txt": b"ignorado",
+        })
+
+        result = pipeline.extract_zip(archive)
+
+        assert [(p.member, p.member_page) for p in result.pages] == [
+            ("anexos.zip/anexo_ii.pdf", 1), ("edital.pdf", 1), ("edital.pdf", 2),
+        ]
+        assert result.pages[1].text.startswith("=== edital.pdf (2 páginas) ===")
+        assert result.page_map()[2]["member_page"] == 2
+
+    def test_nested_archives_beyond_depth_are_skipped(self, make_pdf, settings):
+        settings.ZIP_MAX_DEPTH = 1
+        deepest = _zip({"fundo.pdf": make_pdf([self.LINE])})
+        archive = _zip({"a.zip": _zip({"b.zip": deepest}), "edital.pdf": make_pdf([self.LINE])})
+
+        result = pipeline.extract_zip(archive)
+
+        assert {p.member for p in result.pages} == {"edital.pdf"}
+
+    def test_high_ratio_member_stops_extraction(self, make_pdf):
+        archive = _zip({"a.pdf": make_pdf([self.LINE]), "bomba.pdf": b"\0" * (20 * 1024 * 1024)})
+
+        result = pipeline.extract_zip(archive)
+
+        assert {p.member for p in result.pages} == {"a.pdf"}
+
+    def test_total_size_budget(self, make_pdf, settings):
+        pdf = make_pdf([self.LINE])
+        settings.ZIP_MAX_TOTAL_SIZE = len(pdf) + 10
+        archive = _zip({"a.pdf": pdf, "b.pdf": pdf})
+
+        result = pipeline.extract_zip(archive)
+
+        assert {p.member for p in result.pages} == {"a.pdf"}
+
+
+@pytest.mark.django_db
+class TestEmbedChunks:
+    @patch("apps.ai_engine.embeddings._embed_batch")
+    def test_vectors_written_in_one_update_per_batch(self, mock_embed, sample_opportunity):
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        mock_embed.side_effect = lambda texts, _backend: [[0.5] * 3072 for _ in texts]
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        chunks = DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=doc, chunk_index=i, start_offset=0, end_offset=1) for i in range(250)
+        ])
+        for chunk in chunks:
+            chunk.content = f"chunk {chunk.chunk_index}"
+
+        with CaptureQueriesContext(connection) as queries:
+            assert embeddings.embed_chunks(chunks) == 250
+
+        updates = [q for q in queries.captured_queries if q["sql"].startswith("UPDATE")]
+        assert len(updates) == 3
+        assert [len(call.args[0]) for call in mock_embed.call_args_list] == [100, 100, 50]
+        assert not doc.chunks.filter(embedding__isnull=True).exists()
+        assert doc.chunks.first().embedding[0] == 0.5
+        assert len(doc.chunks.first().embedding_index) == 768
+
+    @patch("apps.ai_engine.embeddings._embed_batch")
+    def test_repeated_texts_come_from_cache(self, mock_embed, sample_opportunity):
+        from apps.ai_engine.models import EmbeddingCache
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        mock_embed.side_effect = lambda texts, _backend: [[float(len(t))] * 3072 for t in texts]
+
+        def make_chunks(url, texts):
+            doc = OpportunityDocument.objects.create(opportunity=sample_opportunity, original_url=url)
+            chunks = DocumentChunk.objects.bulk_create([
+                DocumentChunk(document=doc, chunk_index=i) for i in range(len(texts))
+            ])
+            for chunk, text in zip(chunks, texts):
+                chunk.content = text
+            return doc, chunks
+
+        boilerplate = "Nos termos da Lei nº 14.133/2021, a licitante deverá apresentar..."
+        _, first = make_chunks("https://pncp.gov.br/a.pdf", [boilerplate, "Objeto A", boilerplate])
+        embeddings.embed_chunks(first)
+        assert mock_embed.call_args.args[0] == [boilerplate, "Objeto A"]
+
+        doc, second = make_chunks("https://pncp.gov.br/b.pdf", ["Objeto B", boilerplate])
+        embeddings.embed_chunks(second)
+
+        assert mock_embed.call_args.args[0] == ["Objeto B"]
+        assert EmbeddingCache.objects.count() == 3
+        stored = {c.chunk_index: c.embedding[0] for c in doc.chunks.all()}
+        assert stored == {0: len("Objeto B"), 1: len(boilerplate)}
+
+    @patch("apps.ai_engine.embeddings._embed_batch")
+    def test_int8_storage_caches_only_quantized_forms(self, mock_embed, sample_opportunity, settings):
+        from apps.ai_engine.models import EmbeddingCache
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        mock_embed.side_effect = lambda texts, _backend: [[0.5] * 3072 for _ in texts]
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        chunks = DocumentChunk.objects.bulk_create([DocumentChunk(document=doc, chunk_index=i) for i in range(2)])
+        for chunk in chunks:
+            chunk.content = "Objeto"
+
+        settings.EMBEDDING_STORAGE = "int8"
+        embeddings.embed_chunks(chunks[:1])
+        cached = EmbeddingCache.objects.get()
+        assert cached.embedding is None
+        assert len(cached.embedding_int8) == 3072
+
+        # Back to float storage: the text is embedded again to complete the row
+        settings.EMBEDDING_STORAGE = "float"
+        embeddings.embed_chunks(chunks[1:])
+        assert mock_embed.call_count == 2
+        cached.refresh_from_db()
+        assert cached.embedding[0] == 0.5
+        assert DocumentChunk.objects.get(pk=chunks[1].pk).embedding[0] == 0.5
+
+
+@pytest.fixture
+def query_cache(locmem_cache):
+    """Empty query-embedding caches (worker LRU + locmem instead of Redis)."""
+    embeddings._query_embeddings.clear()
+    yield locmem_cache
+    embeddings._query_embeddings.clear()
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("query_cache")
+class TestVectorSearch:
+    def test_fetch_ranked_skips_deleted_chunks(self, sample_opportunity, django_assert_num_queries):
+        import uuid
+
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf", file_name="edital.pdf",
+        )
+        doc.set_extracted_text("ab")
+        chunks = DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=doc, chunk_index=i, start_offset=i, end_offset=i + 1) for i in range(2)
+        ])
+
+        with django_assert_num_queries(1):
+            results = embeddings.fetch_ranked([(chunks[1].pk, 0.1), (uuid.uuid4(), 0.2), (chunks[0].pk, 0.3)])
+            assert [(c.content, c.document.file_name) for c in results] == [("b", "edital.pdf"), ("a", "edital.pdf")]
+
+    @patch("apps.ai_engine.backends._get_client")
+    @patch("apps.ai_engine.embeddings._embed_batch")
+    def test_corpus_search_reranks_ann_candidates(self, mock_embed, mock_client, sample_opportunity, settings):
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        settings.VECTOR_SEARCH_CANDIDATES = 2
+        query = [1.0] * 3072
+        vectors = {
+            "a": [-1.0] * 768 + [1.0] * 2304,  # far on the prefix: not a candidate
+            "b": [1.0, 0.0] * 384 + [1.0] * 2304,  # 2nd on the prefix, best on the full vector
+            "c": [1.0] * 768 + [-1.0] * 2304,  # best on the prefix only
+        }
+        mock_embed.side_effect = lambda texts, _backend: [vectors[t] for t in texts]
+        mock_client.return_value.embed_content.return_value = {"embedding": [query]}
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        doc.set_extracted_text("abc")
+        chunks = DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=doc, chunk_index=i, start_offset=i, end_offset=i + 1) for i in range(3)
+        ])
+        for chunk, text in zip(chunks, "abc"):
+            chunk.content = text
+        embeddings.embed_chunks(chunks)
+
+        results = embeddings.search_similar_chunks("prazo de entrega", top_k=2)
+
+        assert [c.content for c in results] == ["b", "c"]
+
+    @patch("apps.ai_engine.backends._get_client")
+    @patch("apps.ai_engine.embeddings._embed_batch")
+    def test_int8_storage_rescores_hamming_candidates(self, mock_embed, mock_client, sample_opportunity, settings):
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        settings.EMBEDDING_STORAGE = "int8"
+        settings.QUANTIZED_SEARCH_CANDIDATES = 2
+        query = [1.0] * 3072
+        vectors = {
+            "a": [-1.0] * 2000 + [1.0] * 1072,  # many sign flips: not a candidate
+            "b": [1.0] * 2900 + [-1.0] * 172,  # 2nd by Hamming, best by cosine
+            "c": [0.01] * 3000 + [-1.0] * 72,  # best by Hamming only
+        }
+        mock_embed.side_effect = lambda texts, _backend: [vectors[t] for t in texts]
+        mock_client.return_value.embed_content.return_value = {"embedding": [query]}
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        doc.set_extracted_text("abc")
+        chunks = DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=doc, chunk_index=i, start_offset=i, end_offset=i + 1) for i in range(3)
+        ])
+        for chunk, text in zip(chunks, "abc"):
+            chunk.content = text
+        embeddings.embed_chunks(chunks)
+
+        results = embeddings.search_similar_chunks("prazo de entrega", top_k=2)
+
+        assert [c.content for c in results] == ["b", "c"]
+        assert results[0].distance < results[1].distance
+        stored = DocumentChunk.objects.get(pk=chunks[1].pk)
+        assert stored.embedding is None and stored.embedding_index is None
+        assert len(stored.embedding_int8) == 3072
+
+
+    def test_hamming_ordering_uses_the_index_operator_on_pgvector_07(self):
+        from django.db.models import Value
+
+        from apps.opportunities.models import DocumentChunk
+
+        bits = Value("1" * 3072)
+        sql = {}
+        for version in [(0, 6, 2), (0, 7, 0)]:
+            with patch.object(embeddings, "_pgvector_version", return_value=version):
+                sql[version] = str(DocumentChunk.objects.order_by(embeddings._hamming_distance(bits)).query)
+
+        assert "<~>" not in sql[(0, 6, 2)] and "bit_count" in sql[(0, 6, 2)]
+        assert "<~>" in sql[(0, 7, 0)]
+
+
+@pytest.mark.usefixtures("query_cache")
+class TestQueryEmbeddingCache:
+    @patch("apps.ai_engine.backends._get_client")
+    def test_normalized_query_embedded_once(self, mock_client, query_cache):
+        import numpy as np
+
+        embed = mock_client.return_value.embed_content
+        embed.side_effect = lambda content, **kwargs: {"embedding": [[float(len(q))] * 3 for q in content]}
+
+        first = embeddings._embed_queries(["Prazo  de entrega", "garantia"])
+        again = embeddings._embed_queries(["Prazo de entrega\n", "garantia"])
+        embeddings._query_embeddings.clear()  # another worker: served from Redis
+        shared = embeddings._embed_queries(["Prazo de entrega"])
+
+        assert first == again == [[16.0] * 3, [8.0] * 3]
+        assert shared == [[16.0] * 3]
+        embed.assert_called_once()
+        assert embed.call_args.kwargs["content"] == ["Prazo de entrega", "garantia"]
+        assert all(v.dtype == np.float32 for v in embeddings._query_embeddings.values())
+
+
+@pytest.mark.django_db
+class TestOpportunityRetriever:
+    def _chunks(self, opportunity, vectors):
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        doc = OpportunityDocument.objects.create(
+            opportunity=opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        doc.set_extracted_text("".join(vectors))
+        return DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=doc, chunk_index=i, start_offset=i, end_offset=i + 1, embedding=vector)
+            for i, vector in enumerate(vectors.values())
+        ])
+
+    @patch("apps.ai_engine.embeddings._embed_queries")
+    def test_queries_answered_from_cached_matrix(self, mock_queries, sample_opportunity, django_assert_num_queries):
+        self._chunks(sample_opportunity, {
+            "a": [1.0, 0.0] + [0.0] * 3070,
+            "b": [0.0, 1.0] + [0.0] * 3070,
+            "c": [-1.0, 0.0] + [0.0] * 3070,
+        })
+        mock_queries.return_value = [[1.0, 0.1] + [0.0] * 3070, [0.1, 1.0] + [0.0] * 3070]
+
+        results = embeddings.search_opportunity_chunks(str(sample_opportunity.pk), ["prazo", "garantia"], top_k=2)
+
+        assert [c.content for c in results] == ["a", "b"]
+        mock_queries.assert_called_once_with(["prazo", "garantia"], None)
+        with django_assert_num_queries(1):  # fingerprint only
+            retriever.get_vectors(str(sample_opportunity.pk))
+
+    def test_reloads_when_chunks_change(self, sample_opportunity):
+        chunks = self._chunks(sample_opportunity, {"a": [1.0] * 3072})
+        first = retriever.get_vectors(sample_opportunity.pk)
+        chunks[0].embedding = [-1.0] * 3072
+        chunks[0].save()
+
+        second = retriever.get_vectors(sample_opportunity.pk)
+
+        assert second is not first
+        assert second.matrix[0, 0] < 0
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("query_cache")
+class TestHybridSearch:
+    TEXTS = [
+        "O licitante deverá apresentar atestado de capacidade técnica emitido por pessoa jurídica.",
+        "A entrega dos materiais ocorrerá em até 30 dias após a emissão da nota de empenho.",
+        "Será exigida garantia contratual de cinco por cento do valor do contrato.",
+    ]
+
+    def _index(self, opportunity, vectors=None):
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        doc = OpportunityDocument.objects.create(
+            opportunity=opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        doc.set_extracted_text(" ".join(self.TEXTS))
+        chunks, offset = [], 0
+        for i, text in enumerate(self.TEXTS):
+            chunks.append(DocumentChunk(
+                document=doc, chunk_index=i, start_offset=offset, end_offset=offset + len(text),
+                embedding=vectors[i] if vectors else None,
+            ))
+            offset += len(text) + 1
+        DocumentChunk.objects.bulk_create(chunks)
+        doc.chunks.index_search_vectors()
+
+    @patch("apps.ai_engine.embeddings._embed_queries")
+    def test_full_text_without_embeddings(self, mock_queries, sample_opportunity):
+        self._index(sample_opportunity)
+
+        results = search.hybrid_search(str(sample_opportunity.pk), ["atestados de capacidade técnica"], top_k=2)
+
+        assert [c.content for c in results] == [self.TEXTS[0]]
+        mock_queries.assert_not_called()
+
+    @patch("apps.ai_engine.embeddings._embed_queries")
+    def test_fuses_lexical_and_vector_rankings(self, mock_queries, sample_opportunity):
+        self._index(sample_opportunity, vectors=[
+            [0.0, 1.0] + [0.0] * 3070,
+            [1.0, 0.0] + [0.0] * 3070,
+            [0.9, 0.1] + [0.0] * 3070,
+        ])
+        mock_queries.return_value = [[1.0, 0.0] + [0.0] * 3070]
+
+        results = search.hybrid_search(str(sample_opportunity.pk), ["garantia contratual"], top_k=3)
+
+        # 1st lexically and 2nd by vector beats 1st by vector only
+        assert [c.content for c in results] == [self.TEXTS[2], self.TEXTS[1], self.TEXTS[0]]
+        assert results[0].rrf_score == pytest.approx(1 / 61 + 1 / 62)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = search.reciprocal_rank_fusion([[("a", 0.9), ("b", 0.5)], [("b", 0.1), ("c", 0.2)]])
+
+        assert [pk for pk, _ in fused] == ["b", "a", "c"]
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("query_cache")
+class TestLocalEmbeddingBackend:
+    @pytest.fixture(autouse=True)
+    def _local(self, settings):
+        settings.EMBEDDING_BACKEND = "local"
+        backends.reset()
+        yield
+        backends.reset()
+
+    def test_deterministic_and_normalized(self):
+        import numpy as np
+
+        backend = backends.get_backend()
+        first, other = backend.embed_documents(["Garantia contratual", "garantía  CONTRATUAL!"])
+
+        assert len(first) == 3072
+        assert np.linalg.norm(first) == pytest.approx(1.0)
+        assert first == other  # case, accents and punctuation folded
+        assert backend.embed_queries(["Garantia contratual"]) == [first]
+
+    def test_index_and_search_offline(self, sample_opportunity):
+        from apps.ai_engine.models import EmbeddingCache
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        texts = ["entrega dos materiais em trinta dias", "atestado de capacidade técnica", "garantia contratual"]
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        doc.set_extracted_text("\n".join(texts))
+        chunks, offset = [], 0
+        for i, text in enumerate(texts):
+            chunks.append(DocumentChunk(document=doc, chunk_index=i, start_offset=offset, end_offset=offset + len(text)))
+            offset += len(text) + 1
+        DocumentChunk.objects.bulk_create(chunks)
+        for chunk, text in zip(chunks, texts):
+            chunk.content = text
+
+        embeddings.embed_chunks(chunks)
+        results = embeddings.search_opportunity_chunks(str(sample_opportunity.pk), ["atestados de capacidade"], top_k=1)
+
+        assert [c.content for c in results] == ["atestado de capacidade técnica"]
+        assert set(EmbeddingCache.objects.values_list("model_name", flat=True)) == {"hashing-3gram-3072"}
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("locmem_cache")
+class TestEmbeddingBatcher:
+    def _document(self, opportunity, url, texts):
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        doc = OpportunityDocument.objects.create(
+            opportunity=opportunity, original_url=url,
+            processing_status=OpportunityDocument.ProcessingStatus.INDEXED,
+        )
+        doc.set_extracted_text("".join(texts))
+        DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=doc, chunk_index=i, start_offset=i, end_offset=i + 1)
+            for i in range(len(texts))
+        ])
+        return doc
+
+    @patch("apps.ai_engine.embeddings._embed_batch")
+    def test_chunks_of_several_documents_share_a_request(self, mock_embed, sample_opportunity):
+        from apps.ai_engine import tasks
+        from apps.opportunities.models import DocumentChunk
+
+        mock_embed.side_effect = lambda texts, _backend: [[float(ord(t))] * 3072 for t in texts]
+        for n, texts in enumerate(["ab", "cde", "fg"]):
+            self._document(sample_opportunity, f"https://pncp.gov.br/edital-{n}.pdf", texts)
+        assert tasks._docs_ready(sample_opportunity) == (False, 3)
+
+        assert tasks.embed_pending_chunks() == {"embedded": 7, "failed": 0}
+
+        mock_embed.assert_called_once()
+        assert sorted(mock_embed.call_args.args[0]) == list("abcdefg")
+        assert not DocumentChunk.objects.pending_embedding().exists()
+        assert tasks._docs_ready(sample_opportunity) == (True, 3)
+
+    @patch("apps.ai_engine.embeddings._embed_batch")
+    def test_rejected_chunk_only_fails_itself(self, mock_embed, sample_opportunity, settings):
+        from apps.ai_engine import tasks
+        from apps.opportunities.models import DocumentChunk
+
+        def embed(texts, _backend):
+            if "x" in texts:
+                raise ValueError("400 invalid argument")
+            return [[1.0] * 3072 for _ in texts]
+
+        mock_embed.side_effect = embed
+        self._document(sample_opportunity, "https://pncp.gov.br/edital.pdf", "abxcd")
+
+        assert tasks.embed_pending_chunks() == {"embedded": 4, "failed": 5}
+        assert list(DocumentChunk.objects.pending_embedding().values_list("start_offset", flat=True)) == [2]
+        assert tasks._docs_ready(sample_opportunity) == (False, 1)
+
+        for _ in range(settings.EMBED_MAX_ATTEMPTS - 2):
+            tasks.embed_pending_chunks()
+        assert not DocumentChunk.objects.pending_embedding().exists()
+        assert tasks._docs_ready(sample_opportunity) == (True, 1)
+
+    @patch("apps.ai_engine.embeddings._embed_batch", side_effect=ConnectionError)
+    def test_retries_stop_while_the_api_is_down(self, mock_embed, sample_opportunity):
+        from apps.ai_engine import tasks
+
+        self._document(sample_opportunity, "https://pncp.gov.br/edital.pdf", "abcdefgh")
+
+        assert tasks.embed_pending_chunks() == {"embedded": 0, "failed": 8}
+        assert mock_embed.call_count == 1 + tasks._EMBED_RETRY_MAX_FAILURES
+
+    @patch("apps.ai_engine.embeddings._embed_batch")
+    def test_empty_chunks_are_not_pending(self, mock_embed, sample_opportunity):
+        from apps.ai_engine import tasks
+        from apps.opportunities.models import DocumentChunk
+
+        doc = self._document(sample_opportunity, "https://pncp.gov.br/edital.pdf", "")
+        doc.set_extracted_text("   ")
+        DocumentChunk.objects.create(document=doc, chunk_index=0, start_offset=0, end_offset=0)
+
+        assert not DocumentChunk.objects.pending_embedding().exists()
+        assert tasks._docs_ready(sample_opportunity) == (True, 1)
+        assert tasks.embed_pending_chunks() == {"embedded": 0, "failed": 0}
+        mock_embed.assert_not_called()
+
+    @patch("apps.ai_engine.tasks.embed_pending_chunks.apply_async")
+    def test_requests_collapse_into_one_delayed_run(self, mock_async, settings):
+        from apps.ai_engine import tasks
+
+        settings.EMBED_MICROBATCH_WAIT = 5
+        for _ in range(3):
+            tasks.request_embeddings()
+
+        mock_async.assert_called_once_with(args=[""], countdown=5)
+
+
+class TestQuantization:
+    @pytest.mark.django_db
+    def test_drop_float_clears_chunks_and_cache(self, sample_opportunity):
+        from django.core.management import call_command
+
+        from apps.ai_engine.models import EmbeddingCache
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        chunk = DocumentChunk.objects.create(document=doc, chunk_index=0, embedding=[0.5] * 3072)
+        EmbeddingCache.objects.create(text_hash="a" * 64, model_name="m", embedding=[0.5] * 3072)
+        out = io.StringIO()
+
+        call_command("quantize_embeddings", "--drop-float", stdout=out)
+
+        chunk.refresh_from_db()
+        cached = EmbeddingCache.objects.get()
+        assert chunk.embedding is None and len(chunk.embedding_int8) == 3072
+        assert cached.embedding is None and len(cached.embedding_int8) == 3072
+        assert "Vector storage: chunks" in out.getvalue()
+
+    def test_int8_keeps_cosine_ranking(self):
+        import numpy as np
+
+        from apps.ai_engine import quantization
+
+        rng = np.random.default_rng(0)
+        corpus = rng.standard_normal((50, 3072)).astype(np.float32)
+        query = corpus[7] + 0.1 * rng.standard_normal(3072)
+        stored = quantization.from_int8_bytes(quantization.int8_bytes(v) for v in corpus)
+
+        distances = quantization.cosine_distances(query, stored)
+
+        assert int(np.argmin(distances)) == 7
+        assert quantization.to_bits([0.5, -0.2, 0.0]).to_text() == "100"
+
+
+class TestLLMResponseCache:
+    def _model(self, *texts):
+        model = MagicMock()
+        model.generate_content.side_effect = [
+            MagicMock(text=text, usage_metadata=MagicMock(prompt_token_count=100, candidates_token_count=20))
+            for text in texts
+        ]
+        return model
+
+    def test_repeated_prompt_is_answered_from_cache(self, db):
+        from apps.ai_engine import llm
+        from apps.ai_engine.models import LLMResponseCache
+
+        model = self._model('```json\n{"score": 80}\n```')
+        first = llm.generate(model, "sistema", "usuário")
+        second = llm.generate(model, "sistema", "usuário")
+
+        assert model.generate_content.call_count == 1
+        assert (first.tokens, first.cached) == (120, False)
+        assert (second.tokens, second.cached) == (0, True)
+        assert llm.parse_json(second.text) == {"score": 80}
+        assert LLMResponseCache.objects.get().hits == 1
+
+    def test_key_covers_prompts_and_prompt_version(self, db, monkeypatch):
+        from apps.ai_engine import llm, prompts
+
+        model = self._model("{}", "{}", "{}")
+        llm.generate(model, "sistema", "usuário")
+        llm.generate(model, "sistema", "outro usuário")
+        monkeypatch.setattr(prompts, "PROMPT_VERSION", "teste-2")
+        llm.generate(model, "sistema", "usuário")
+
+        assert model.generate_content.call_count == 3
+
+    def test_bypass_refreshes_and_invalid_json_is_not_stored(self, db):
+        from apps.ai_engine import llm
+        from apps.ai_engine.models import LLMResponseCache
+
+        model = self._model("não é JSON", '{"score": 10}', '{"score": 20}')
+        llm.generate(model, "sistema", "usuário")
+        assert not LLMResponseCache.objects.exists()
+
+        llm.generate(model, "sistema", "usuário")
+        fresh = llm.generate(model, "sistema", "usuário", bypass_cache=True)
+
+        assert not fresh.cached
+        assert LLMResponseCache.objects.get().response == '{"score": 20}'
+
+    def test_prune_drops_expired_then_least_recently_used(self, db, settings):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from apps.ai_engine import llm
+        from apps.ai_engine.models import LLMResponseCache
+
+        settings.LLM_CACHE_MAX_ENTRIES = 2
+        now = timezone.now()
+        for i, (age, idle) in enumerate([(40, 0), (2, 3), (1, 1), (1, 0)]):
+            LLMResponseCache.objects.create(
+                fingerprint=f"{i:064}", model_name="m", prompt_version="v", response="{}",
+                created_at=now - timedelta(days=age), used_at=now - timedelta(days=idle),
+            )
+
+        assert llm.prune() == 2
+        assert sorted(LLMResponseCache.objects.values_list("fingerprint", flat=True)) == [f"{2:064}", f"{3:064}"]
+
+    @patch("apps.ai_engine.rag._get_model")
+    def test_repeated_summary_is_marked_as_cache_hit(self, mock_model, sample_opportunity):
+        from apps.ai_engine.rag import run_summary
+
+        mock_model.return_value = self._model("## Objeto\nAquisição de software")
+        first = run_summary(sample_opportunity)
+        second = run_summary(sample_opportunity)
+
+        assert (first.cache_hit, second.cache_hit) == (False, True)
+        assert second.tokens_used == 0
+        assert second.content == first.content
+
+
 class TestAIRAG:
     @patch("apps.ai_engine.rag._call_llm")
-    @patch("apps.ai_engine.embeddings.search_similar_chunks")
+    @patch("apps.ai_engine.rag.hybrid_search")
     def test_run_extraction(self, mock_search, mock_call_llm, sample_opportunity):
         """Test extraction with mocked LLM."""
         mock_search.return_value = []
@@ -46,6 +788,7 @@ class TestAIRAG:
                 "campos_extraidos": {},
             },
             500,
+            False,
         )
 
         from apps.ai_engine.rag import run_extraction
@@ -53,4 +796,91 @@ class TestAIRAG:
 
         assert summary.analysis_type == "full"
         assert summary.tokens_used == 500
+        assert summary.cache_hit is False
         assert sample_opportunity.requirements.count() == 1
+
+    @patch("apps.ai_engine.rag._call_llm")
+    @patch("apps.ai_engine.rag.hybrid_search", return_value=[])
+    def test_unchanged_inputs_reuse_previous_extraction(self, _search, mock_call_llm, sample_opportunity):
+        from apps.ai_engine.rag import run_extraction
+        from apps.opportunities.models import OpportunityDocument
+
+        checklist = {"fiscal": [{"requisito": "CND Federal"}]}
+        mock_call_llm.return_value = ({"checklist_habilitacao": checklist}, 500, False)
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf", file_hash="a" * 64,
+        )
+
+        first = run_extraction(sample_opportunity)
+        requirement = sample_opportunity.requirements.get()
+        assert run_extraction(sample_opportunity) == first
+        assert sample_opportunity.requirements.get() == requirement
+        assert mock_call_llm.call_count == 1
+
+        doc.file_hash = "b" * 64
+        doc.save(update_fields=["file_hash"])
+        changed = run_extraction(sample_opportunity)
+        assert changed != first
+        assert changed.input_fingerprint != first.input_fingerprint
+
+        assert run_extraction(sample_opportunity, bypass_cache=True) != changed
+        assert mock_call_llm.call_count == 3
+
+    @patch("apps.ai_engine.rag._call_llm")
+    @patch("apps.ai_engine.rag.hybrid_search", return_value=[])
+    def test_invalid_answer_is_not_reused(self, _search, mock_call_llm, sample_opportunity):
+        from apps.ai_engine.rag import run_extraction
+
+        mock_call_llm.return_value = ({"raw_response": "not json"}, 500, False)
+        failed = run_extraction(sample_opportunity)
+        assert failed.input_fingerprint == ""
+
+        mock_call_llm.return_value = ({"checklist_habilitacao": {}}, 500, False)
+        assert run_extraction(sample_opportunity) != failed
+        assert mock_call_llm.call_count == 2
+
+    @patch("apps.ai_engine.rag._call_llm")
+    @patch("apps.ai_engine.rag.hybrid_search", return_value=[])
+    def test_extraction_redone_when_vectors_arrive(self, _search, mock_call_llm, sample_opportunity):
+        from apps.ai_engine.rag import run_extraction
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        mock_call_llm.return_value = ({"checklist_habilitacao": {}}, 500, False)
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf", file_hash="a" * 64,
+        )
+        doc.set_extracted_text("edital")
+        chunk = DocumentChunk.objects.create(document=doc, chunk_index=0, start_offset=0, end_offset=6)
+
+        lexical = run_extraction(sample_opportunity)
+        chunk.embedding = [1.0] * 3072
+        chunk.save(update_fields=["embedding"])
+
+        assert run_extraction(sample_opportunity) != lexical
+        assert mock_call_llm.call_count == 2
+
+    @patch("apps.ai_engine.rag._call_llm")
+    @patch("apps.ai_engine.rag.hybrid_search", return_value=[])
+    def test_extraction_redone_after_rechunk_or_new_queries(self, _search, mock_call_llm, sample_opportunity):
+        from apps.ai_engine import rag
+        from apps.opportunities.models import DocumentChunk, OpportunityDocument
+
+        mock_call_llm.return_value = ({"checklist_habilitacao": {}}, 500, False)
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf", file_hash="a" * 64,
+        )
+        doc.set_extracted_text("edital de pregão")
+        DocumentChunk.objects.create(document=doc, chunk_index=0, start_offset=0, end_offset=16)
+
+        first = rag.run_extraction(sample_opportunity)
+        doc.chunks.all().delete()
+        DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=doc, chunk_index=0, start_offset=0, end_offset=6),
+            DocumentChunk(document=doc, chunk_index=1, start_offset=7, end_offset=16),
+        ])
+        rechunked = rag.run_extraction(sample_opportunity)
+        assert rechunked != first
+
+        with patch.object(rag, "EXTRACTION_QUERIES", [*rag.EXTRACTION_QUERIES, "amostra"]):
+            assert rag.run_extraction(sample_opportunity) != rechunked
+        assert mock_call_llm.call_count == 3
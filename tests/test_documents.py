@@ -0,0 +1,661 @@
+"""Tests for the document pipeline — download, dedup and storage."""
+import asyncio
+import hashlib
+import io
+import json
+import zipfile
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+import httpx
+import pytest
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from apps.ai_engine.tasks import run_ai_analysis
+from apps.core import task_dedup
+from apps.core.storage import blob_path, store_blob
+from apps.opportunities import downloader, host_health, leases
+from apps.opportunities.downloader import BatchDownloader, DownloadJob
+from apps.opportunities.models import DocumentChunk, DocumentURLIndex, OpportunityDocument
+from apps.opportunities.tasks import (
+    download_documents_batch,
+    download_single_document,
+    extract_document_text,
+)
+
+PDF_BYTES = b"%PDF-1.4 fake edital content"
+
+
+@pytest.fixture(autouse=True)
+def _cache(locmem_cache):
+    return locmem_cache
+
+
+@pytest.fixture
+def memory_storage(settings):
+    """Swap S3 for an in-memory storage backend."""
+    settings.STORAGES = {
+        **settings.STORAGES,
+        "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+    }
+
+
+def _stream_response(content: bytes, headers: dict | None = None):
+    """Build a mock for ``httpx.stream(...)`` used as a context manager."""
+    resp = MagicMock()
+    resp.headers = {"content-type": "application/pdf", **(headers or {})}
+    resp.iter_bytes.return_value = [content]
+    stream = MagicMock()
+    stream.__enter__.return_value = resp
+    return stream
+
+
+def _head_response(headers: dict):
+    resp = MagicMock()
+    resp.headers = headers
+    return resp
+
+
+def _make_doc(opportunity, url="https://pncp.gov.br/arquivos/edital.pdf"):
+    return OpportunityDocument.objects.create(
+        opportunity=opportunity, original_url=url, file_name="edital.pdf",
+    )
+
+
+@pytest.mark.django_db
+class TestContentAddressedDownload:
+    @patch("apps.opportunities.tasks.extract_document_text.delay")
+    @patch("apps.opportunities.tasks.httpx.stream")
+    def test_download_stores_blob_and_indexes_url(self, mock_stream, mock_extract,
+                                                   sample_opportunity, memory_storage):
+        mock_stream.return_value = _stream_response(PDF_BYTES, {"etag": '"abc"'})
+        doc = _make_doc(sample_opportunity)
+
+        download_single_document(str(doc.pk))
+
+        doc.refresh_from_db()
+        file_hash = hashlib.sha256(PDF_BYTES).hexdigest()
+        assert doc.processing_status == OpportunityDocument.ProcessingStatus.DOWNLOADED
+        assert doc.file_hash == file_hash
+        assert doc.file.name == blob_path(file_hash)
+        entry = DocumentURLIndex.objects.get(url=doc.original_url)
+        assert entry.file_hash == file_hash
+        assert entry.etag == '"abc"'
+        mock_extract.assert_called_once_with(str(doc.pk))
+
+    @patch("apps.opportunities.tasks.extract_document_text.delay")
+    @patch("apps.opportunities.tasks.httpx.head")
+    @patch("apps.opportunities.tasks.httpx.stream")
+    def test_known_url_is_linked_without_download(self, mock_stream, mock_head, mock_extract,
+                                                  sample_opportunity, memory_storage):
+        mock_stream.return_value = _stream_response(PDF_BYTES, {"etag": '"abc"'})
+        first = _make_doc(sample_opportunity)
+        download_single_document(str(first.pk))
+
+        mock_stream.reset_mock()
+        mock_head.return_value = _head_response({"etag": '"abc"'})
+        second = _make_doc(sample_opportunity)
+        download_single_document(str(second.pk))
+
+        mock_stream.assert_not_called()
+        second.refresh_from_db()
+        first.refresh_from_db()
+        assert second.file.name == first.file.name
+        assert second.file_hash == first.file_hash
+        assert second.file_size == len(PDF_BYTES)  # not the (absent) Content-Length
+        assert second.processing_status == OpportunityDocument.ProcessingStatus.DOWNLOADED
+
+    @patch("apps.opportunities.tasks.extract_document_text.delay")
+    @patch("apps.opportunities.tasks.httpx.head")
+    @patch("apps.opportunities.tasks.httpx.stream")
+    def test_changed_etag_downloads_again(self, mock_stream, mock_head, mock_extract,
+                                          sample_opportunity, memory_storage):
+        mock_stream.return_value = _stream_response(PDF_BYTES, {"etag": '"v1"'})
+        download_single_document(str(_make_doc(sample_opportunity).pk))
+
+        new_content = PDF_BYTES + b" retificado"
+        mock_stream.return_value = _stream_response(new_content, {"etag": '"v2"'})
+        mock_head.return_value = _head_response({"etag": '"v2"'})
+        doc = _make_doc(sample_opportunity)
+        download_single_document(str(doc.pk))
+
+        doc.refresh_from_db()
+        assert doc.file_hash == hashlib.sha256(new_content).hexdigest()
+        assert DocumentURLIndex.objects.get().etag == '"v2"'
+
+    @patch("apps.opportunities.tasks.extract_document_text.delay")
+    @patch("apps.opportunities.tasks.httpx.stream")
+    def test_same_content_other_url_stored_once(self, mock_stream, mock_extract,
+                                                sample_opportunity, memory_storage):
+        mock_stream.return_value = _stream_response(PDF_BYTES)
+        a = _make_doc(sample_opportunity, "https://a.gov.br/edital.pdf")
+        download_single_document(str(a.pk))
+        mock_stream.return_value = _stream_response(PDF_BYTES)
+        b = _make_doc(sample_opportunity, "https://b.gov.br/edital.pdf")
+        download_single_document(str(b.pk))
+
+        a.refresh_from_db()
+        b.refresh_from_db()
+        assert a.file.name == b.file.name
+        assert DocumentURLIndex.objects.count() == 2
+
+    def test_blob_name_ignores_file_extension(self, memory_storage):
+        file_hash = hashlib.sha256(PDF_BYTES).hexdigest()
+        storage = default_storage
+        first = store_blob(storage, file_hash, PDF_BYTES)
+        assert store_blob(storage, file_hash, PDF_BYTES) == first
+        assert not first.lower().endswith(".pdf")
+
+    def test_concurrent_store_keeps_a_single_blob(self, memory_storage):
+        file_hash = hashlib.sha256(PDF_BYTES).hexdigest()
+        storage = default_storage
+        name = store_blob(storage, file_hash, PDF_BYTES)
+        # Another worker checked exists() before the first save landed
+        with patch.object(storage, "exists", return_value=False):
+            assert store_blob(storage, file_hash, PDF_BYTES) == name
+        _, files = storage.listdir(name.rsplit("/", 1)[0])
+        assert files == [name.rsplit("/", 1)[1]]
+
+
+@pytest.mark.django_db
+class TestIndexedContentReuse:
+    def _indexed_source(self, opportunity):
+        source = _make_doc(opportunity, "https://pncp.gov.br/original.pdf")
+        OpportunityDocument.objects.filter(pk=source.pk).update(
+            file="documents/blobs/ab/cd/abcd.pdf", file_hash="abcd", mime_type="application/pdf",
+            processing_status=OpportunityDocument.ProcessingStatus.INDEXED,
+            page_count=12, ocr_used=True, page_map=[{"engine": "ocr", "offset": 0}],
+        )
+        source.set_extracted_text("Texto do edital")
+        DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=source, chunk_index=i, start_offset=i, end_offset=i + 5,
+                          page_number=i + 1, token_count=3, embedding=[0.1] * 3072,
+                          embedding_int8=bytes(3072), embedding_bits="1" * 3072)
+            for i in range(3)
+        ])
+        return source
+
+    @patch("apps.ai_engine.embeddings.embed_chunks")
+    @patch("apps.ai_engine.pipeline.extract_pdf")
+    def test_duplicate_content_copies_artifacts(self, mock_extract, mock_embed, sample_opportunity):
+        self._indexed_source(sample_opportunity)
+        doc = _make_doc(sample_opportunity, "https://compras.gov.br/republicado.pdf")
+        OpportunityDocument.objects.filter(pk=doc.pk).update(
+            file="documents/blobs/ab/cd/abcd.pdf", file_hash="abcd",
+            processing_status=OpportunityDocument.ProcessingStatus.DOWNLOADED,
+        )
+
+        extract_document_text(str(doc.pk))
+
+        mock_extract.assert_not_called()
+        mock_embed.assert_not_called()
+        doc.refresh_from_db()
+        assert doc.processing_status == OpportunityDocument.ProcessingStatus.INDEXED
+        assert (doc.get_extracted_text(), doc.page_count, doc.ocr_used) == ("Texto do edital", 12, True)
+        chunks = list(doc.chunks.with_content())
+        assert [c.page_number for c in chunks] == [1, 2, 3]
+        assert chunks[1].content == "exto "
+        assert all(c.embedding is not None for c in chunks)
+        assert all(c.embedding_bits == "1" * 3072 for c in chunks)
+
+
+@pytest.mark.django_db
+class TestZipDocumentExtraction:
+    @patch("apps.ai_engine.embeddings.embed_chunks")
+    @patch("apps.ai_engine.pipeline.chunk_text", return_value=[])
+    def test_zip_members_recorded_in_page_map(self, _chunk, _embed, sample_opportunity,
+                                              memory_storage, make_pdf):
+        from django.core.files.base import ContentFile
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            zf.writestr("edital.pdf", make_pdf(["Edital de pregão eletrônico " * 8] * 2))
+        doc = _make_doc(sample_opportunity, "https://pncp.gov.br/arquivos/edital.zip")
+        doc.file_name = "edital.zip"
+        doc.processing_status = OpportunityDocument.ProcessingStatus.DOWNLOADED
+        doc.file.save("edital.zip", ContentFile(buf.getvalue()))
+
+        extract_document_text(str(doc.pk))
+
+        doc.refresh_from_db()
+        assert doc.processing_status == OpportunityDocument.ProcessingStatus.INDEXED
+        assert doc.page_count == 2
+        assert [(p["member"], p["member_page"]) for p in doc.page_map] == [
+            ("edital.pdf", 1), ("edital.pdf", 2),
+        ]
+        assert doc.get_extracted_text().startswith("=== edital.pdf (2 páginas) ===")
+
+
+@pytest.mark.django_db
+class TestDocumentLeases:
+    Status = OpportunityDocument.ProcessingStatus
+
+    def test_live_lease_blocks_second_worker(self, sample_opportunity):
+        doc = _make_doc(sample_opportunity)
+
+        assert leases.acquire([doc.pk], self.Status.DOWNLOADING, [self.Status.PENDING]) == [doc.pk]
+        assert leases.acquire([doc.pk], self.Status.DOWNLOADING, [self.Status.PENDING]) == []
+
+        OpportunityDocument.objects.filter(pk=doc.pk).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        assert leases.acquire([doc.pk], self.Status.DOWNLOADING, [self.Status.PENDING]) == [doc.pk]
+        doc.refresh_from_db()
+        assert doc.attempts == 2
+
+    def test_sweeper_reclaims_with_backoff_then_fails(self, sample_opportunity, settings):
+        settings.DOCUMENT_MAX_ATTEMPTS = 3
+        past = timezone.now() - timedelta(seconds=1)
+        retry = _make_doc(sample_opportunity)
+        exhausted = _make_doc(sample_opportunity, "https://pncp.gov.br/outro.pdf")
+        OpportunityDocument.objects.filter(pk=retry.pk).update(
+            processing_status=self.Status.EXTRACTING, lease_expires_at=past, attempts=2,
+        )
+        OpportunityDocument.objects.filter(pk=exhausted.pk).update(
+            processing_status=self.Status.DOWNLOADING, lease_expires_at=past, attempts=3,
+        )
+
+        assert leases.reclaim_expired() == {"reclaimed": 1, "failed": 1}
+
+        retry.refresh_from_db()
+        exhausted.refresh_from_db()
+        assert retry.processing_status == self.Status.DOWNLOADED
+        assert retry.next_attempt_at > timezone.now() + timedelta(seconds=100)  # 60s * 2
+        assert exhausted.processing_status == self.Status.FAILED
+
+    def test_failed_documents_retried_with_backoff(self, sample_opportunity, settings):
+        settings.DOCUMENT_MAX_ATTEMPTS = 3
+        old = timezone.now() - timedelta(hours=1)
+        due = _make_doc(sample_opportunity)
+        recent = _make_doc(sample_opportunity, "https://pncp.gov.br/recente.pdf")
+        exhausted = _make_doc(sample_opportunity, "https://pncp.gov.br/outro.pdf")
+        failed = OpportunityDocument.objects.filter(pk__in=[due.pk, recent.pk, exhausted.pk])
+        failed.update(processing_status=self.Status.FAILED, attempts=1, updated_at=old)
+        OpportunityDocument.objects.filter(pk=recent.pk).update(updated_at=timezone.now())
+        OpportunityDocument.objects.filter(pk=exhausted.pk).update(attempts=3)
+
+        assert leases.retry_failed() == {"retried": 1}
+
+        statuses = dict(failed.values_list("pk", "processing_status"))
+        assert statuses == {
+            due.pk: self.Status.PENDING, recent.pk: self.Status.FAILED, exhausted.pk: self.Status.FAILED,
+        }
+
+    @patch("apps.opportunities.tasks.extract_document_text.delay")
+    @patch("apps.opportunities.tasks.httpx.stream")
+    def test_single_download_keeps_lease_alive(self, mock_stream, _extract, sample_opportunity,
+                                               memory_storage):
+        mock_stream.return_value = _stream_response(PDF_BYTES)
+        doc = _make_doc(sample_opportunity)
+
+        with patch("apps.opportunities.tasks.leases.keep_alive", wraps=leases.keep_alive) as mock_keep_alive:
+            download_single_document(str(doc.pk))
+
+        mock_keep_alive.assert_called_once_with([doc.pk], self.Status.DOWNLOADING)
+
+    @patch("apps.opportunities.tasks.download_documents_batch.delay")
+    def test_dispatch_does_not_requeue_queued_work(self, mock_batch, sample_opportunity):
+        doc = _make_doc(sample_opportunity)
+
+        assert leases.dispatch_due()["download"] == 1
+        assert leases.dispatch_due()["download"] == 0
+        mock_batch.assert_called_once_with([str(doc.pk)])
+
+    @patch("apps.ai_engine.pipeline.extract_pdf")
+    def test_extraction_skips_document_leased_elsewhere(self, mock_extract, sample_opportunity):
+        doc = _make_doc(sample_opportunity)
+        OpportunityDocument.objects.filter(pk=doc.pk).update(file="documents/x.pdf")
+        leases.acquire([doc.pk], self.Status.EXTRACTING, [self.Status.PENDING])
+
+        extract_document_text(str(doc.pk))
+
+        mock_extract.assert_not_called()
+
+
+@pytest.mark.django_db
+class TestTaskDedup:
+    @patch("apps.opportunities.tasks.extract_document_text.delay")
+    def test_duplicate_enqueues_collapse(self, mock_delay):
+        name = extract_document_text.name
+
+        assert task_dedup.delay_once(extract_document_text, "doc-1")
+        assert task_dedup.delay_once(extract_document_text, "doc-1") is None
+        assert task_dedup.delay_once(extract_document_text, "doc-2")
+
+        assert mock_delay.call_count == 2
+        assert task_dedup.skipped_count(name) == 1
+
+    @patch("apps.ai_engine.pipeline.extract_pdf")
+    def test_running_task_skips_duplicate_and_clears_on_finish(self, mock_extract, sample_opportunity):
+        doc = _make_doc(sample_opportunity)
+        running = task_dedup._key(extract_document_text.name, str(doc.pk), "running")
+        queued = task_dedup._key(extract_document_text.name, str(doc.pk), "queued")
+        task_dedup.cache.set(running, "other-worker")
+        task_dedup.cache.set(queued, 1)
+
+        assert extract_document_text(str(doc.pk)) == {"skipped": "duplicate"}
+
+        task_dedup.cache.delete(running)
+        extract_document_text(str(doc.pk))  # no file: returns right away
+        assert task_dedup.cache.get(queued) is None
+        assert task_dedup.skipped_count(extract_document_text.name) == 1
+
+    @patch("apps.ai_engine.tasks.run_ai_analysis.delay")
+    def test_analysis_dedup_keyed_by_type_and_bypass(self, mock_delay, sample_opportunity):
+        opp_id = str(sample_opportunity.pk)
+
+        assert task_dedup.delay_once(run_ai_analysis, opp_id, "full", False)
+        assert task_dedup.delay_once(run_ai_analysis, opp_id, "full", False) is None
+        assert task_dedup.delay_once(run_ai_analysis, opp_id, "summary", False)
+        assert task_dedup.delay_once(run_ai_analysis, opp_id, "full", True)
+        assert mock_delay.call_count == 3
+
+        running = task_dedup._key(run_ai_analysis.name, f"{opp_id}:full:False", "running")
+        task_dedup.cache.set(running, "other-worker")
+        assert run_ai_analysis(opp_id, "full", False) == {"skipped": "duplicate"}
+        with patch("apps.ai_engine.tasks._run_analysis", return_value={"status": "success"}):
+            assert run_ai_analysis(opp_id, "summary", False) == {"status": "success"}
+
+    @patch("apps.opportunities.tasks.download_single_document.apply_async")
+    def test_parked_task_stays_queued(self, mock_requeue, sample_opportunity):
+        doc = _make_doc(sample_opportunity, "https://lento.gov.br/edital.pdf")
+        host_health._trip("lento.gov.br")
+
+        download_single_document(str(doc.pk))
+
+        mock_requeue.assert_called_once()
+        assert task_dedup.delay_once(download_single_document, str(doc.pk)) is None
+
+
+class TestBatchDownloader:
+    def test_per_host_concurrency_cap(self):
+        in_flight: dict[str, int] = {}
+        peak: dict[str, int] = {}
+
+        async def handler(request):
+            host = request.url.host
+            in_flight[host] = in_flight.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), in_flight[host])
+            await asyncio.sleep(0.01)
+            in_flight[host] -= 1
+            if request.url.path.endswith("missing.pdf"):
+                return httpx.Response(404)
+            return httpx.Response(200, content=request.url.path.encode())
+
+        jobs = [DownloadJob(str(i), f"https://pncp.gov.br/{i}.pdf") for i in range(10)]
+        jobs += [DownloadJob("x", "https://outro.gov.br/missing.pdf")]
+        downloader = BatchDownloader(
+            per_host_limit=2, total_limit=8, transport=httpx.MockTransport(handler),
+        )
+        results = asyncio.run(downloader.run(jobs))
+
+        assert peak["pncp.gov.br"] <= 2
+        assert results[3].read() == b"/3.pdf"
+        assert results[-1].error
+
+    def test_slow_host_does_not_delay_other_hosts(self):
+        started: dict[str, float] = {}
+
+        async def handler(request):
+            started.setdefault(request.url.host, asyncio.get_running_loop().time() - t0)
+            if request.url.host == "lento.gov.br":
+                await asyncio.sleep(0.5)
+            return httpx.Response(200, content=b"%PDF")
+
+        async def run(jobs):
+            nonlocal t0
+            t0 = asyncio.get_running_loop().time()
+            return await BatchDownloader(
+                per_host_limit=2, total_limit=4, transport=httpx.MockTransport(handler),
+            ).run(jobs)
+
+        t0 = 0.0
+        jobs = [DownloadJob(str(i), f"https://lento.gov.br/{i}.pdf") for i in range(6)]
+        jobs += [DownloadJob("fast", "https://pncp.gov.br/edital.pdf")]
+        results = asyncio.run(run(jobs))
+
+        assert started["pncp.gov.br"] < 0.25
+        assert all(r.body is not None for r in results)
+
+    def test_body_closed_when_stream_breaks(self):
+        class BrokenStream(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                yield b"%PDF-1.4 "
+                raise httpx.ReadError("connection reset")
+
+        bodies = []
+        spooled = downloader.tempfile.SpooledTemporaryFile
+
+        def spool(*args, **kwargs):
+            bodies.append(spooled(*args, **kwargs))
+            return bodies[-1]
+
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, stream=BrokenStream()))
+        with patch.object(downloader.tempfile, "SpooledTemporaryFile", side_effect=spool):
+            [result] = asyncio.run(
+                BatchDownloader(transport=transport).run([DownloadJob("1", "https://pncp.gov.br/1.pdf")])
+            )
+
+        assert result.error and result.body is None
+        assert bodies[0].closed
+
+
+@pytest.mark.django_db
+class TestBatchDownloadTask:
+    @patch("apps.opportunities.tasks.download_single_document.apply_async")
+    @patch("apps.opportunities.tasks.extract_document_text.delay")
+    def test_batch_bulk_updates_status(self, mock_extract, mock_single, sample_opportunity,
+                                       memory_storage):
+        def handler(request):
+            if "quebrado" in request.url.path:
+                return httpx.Response(500)
+            return httpx.Response(200, content=request.url.path.encode(),
+                                  headers={"content-type": "application/pdf"})
+
+        def fake_download_batch(jobs, **kwargs):
+            return downloader.download_batch(jobs, transport=httpx.MockTransport(handler), **kwargs)
+
+        ok = [_make_doc(sample_opportunity, f"https://pncp.gov.br/{i}.pdf") for i in range(3)]
+        broken = _make_doc(sample_opportunity, "https://pncp.gov.br/quebrado.pdf")
+
+        with patch("apps.opportunities.tasks.download_batch", fake_download_batch):
+            result = download_documents_batch([str(d.pk) for d in ok + [broken]])
+
+        assert result == {"downloaded": 3, "linked": 0, "failed": 1, "parked": 0}
+        statuses = dict(
+            OpportunityDocument.objects.values_list("original_url", "processing_status")
+        )
+        assert statuses[broken.original_url] == OpportunityDocument.ProcessingStatus.FAILED
+        assert statuses[ok[0].original_url] == OpportunityDocument.ProcessingStatus.DOWNLOADED
+        assert mock_extract.call_count == 3
+        mock_single.assert_called_once()
+
+
+class TestHostCircuitBreaker:
+    HOST = "portal.prefeitura.gov.br"
+
+    def test_opens_after_failure_rate_threshold(self, settings):
+        settings.HOST_CIRCUIT_MIN_FAILURES = 3
+        host_health.record_success(self.HOST)
+        for _ in range(3):
+            host_health.record_failure(self.HOST)
+        assert host_health.retry_after(self.HOST) > 0
+
+    def test_healthy_host_stays_closed(self, settings):
+        settings.HOST_CIRCUIT_MIN_FAILURES = 3
+        for _ in range(10):
+            host_health.record_success(self.HOST)
+        for _ in range(3):
+            host_health.record_failure(self.HOST)
+        assert host_health.retry_after(self.HOST) == 0
+
+    def test_half_open_allows_single_probe(self):
+        host_health._trip(self.HOST)
+        host_health.cache.delete(host_health._key(self.HOST, "open"))  # cooldown over
+
+        assert host_health.retry_after(self.HOST) == 0  # probe
+        assert host_health.retry_after(self.HOST) > 0  # others wait
+        host_health.record_success(self.HOST)
+        assert host_health.retry_after(self.HOST) == 0
+
+    def test_failed_probe_reopens_with_longer_cooldown(self, settings):
+        host_health._trip(self.HOST)
+        host_health.cache.delete(host_health._key(self.HOST, "open"))
+        host_health.retry_after(self.HOST)
+        host_health.record_failure(self.HOST)
+        assert host_health.retry_after(self.HOST) > settings.HOST_CIRCUIT_COOLDOWN
+
+    @pytest.mark.django_db
+    @patch("apps.opportunities.tasks.download_documents_batch.apply_async")
+    @patch("apps.opportunities.tasks.extract_document_text.delay")
+    def test_half_open_batch_sends_a_single_probe(self, _extract, mock_requeue, sample_opportunity,
+                                                 memory_storage):
+        requests = []
+
+        def handler(request):
+            requests.append(request.url.path)
+            return httpx.Response(200, content=PDF_BYTES, headers={"content-type": "application/pdf"})
+
+        def fake_download_batch(jobs, **kwargs):
+            return downloader.download_batch(jobs, transport=httpx.MockTransport(handler), **kwargs)
+
+        docs = [_make_doc(sample_opportunity, f"https://{self.HOST}/{i}.pdf") for i in range(3)]
+        host_health._trip(self.HOST)
+        host_health.cache.delete(host_health._key(self.HOST, "open"))  # cooldown over
+
+        with patch("apps.opportunities.tasks.download_batch", fake_download_batch):
+            result = download_documents_batch([str(d.pk) for d in docs])
+
+        assert len(requests) == 1
+        assert result["downloaded"] == 1 and result["parked"] == 2
+        assert len(mock_requeue.call_args.kwargs["args"][0]) == 2
+        assert host_health.retry_after(self.HOST) == 0  # the probe succeeded: circuit closed
+
+    @pytest.mark.django_db
+    @patch("apps.opportunities.tasks.download_single_document.apply_async")
+    @patch("apps.opportunities.tasks.httpx.stream")
+    def test_open_circuit_parks_download(self, mock_stream, mock_requeue, sample_opportunity):
+        doc = _make_doc(sample_opportunity, f"https://{self.HOST}/edital.pdf")
+        host_health._trip(self.HOST)
+
+        result = download_single_document(str(doc.pk))
+
+        assert result["parked"] > 0
+        mock_stream.assert_not_called()
+        mock_requeue.assert_called_once()
+        doc.refresh_from_db()
+        assert doc.processing_status == OpportunityDocument.ProcessingStatus.PENDING
+
+
+@pytest.mark.django_db
+class TestReindexDocuments:
+    TEXT = "garantia contratual. visita técnica. atestado de capacidade."
+
+    @pytest.fixture(autouse=True)
+    def _local_backend(self, settings):
+        from apps.ai_engine import backends
+
+        settings.EMBEDDING_BACKEND = "local"
+        backends.reset()
+        yield
+        backends.reset()
+
+    def _indexed_doc(self, opportunity):
+        doc = _make_doc(opportunity)
+        doc.processing_status = OpportunityDocument.ProcessingStatus.INDEXED
+        doc.save()
+        doc.set_extracted_text(self.TEXT)
+        DocumentChunk.objects.create(document=doc, chunk_index=0, start_offset=0, end_offset=len(self.TEXT))
+        return doc
+
+    @staticmethod
+    def _sentences(text, chunk_size, overlap, page_offsets=None):
+        chunks, start = [], 0
+        for i, sentence in enumerate(text.split(". ")):
+            chunks.append({"chunk_index": i, "start_offset": start, "end_offset": start + len(sentence),
+                           "content": sentence, "token_count": 3, "page_number": 1})
+            start += len(sentence) + 2
+        return chunks
+
+    def test_rechunk_embeds_and_checkpoints(self, sample_opportunity, tmp_path):
+        from django.core.management import call_command
+
+        doc = self._indexed_doc(sample_opportunity)
+        checkpoint = tmp_path / "reindex.json"
+
+        with patch("apps.ai_engine.pipeline.chunk_text", side_effect=self._sentences):
+            call_command("reindex_documents", "--rechunk", "--workers", "1", "--checkpoint", str(checkpoint))
+
+        chunks = list(doc.chunks.with_content())
+        assert [c.content for c in chunks] == ["garantia contratual", "visita técnica", "atestado de capacidade."]
+        assert all(c.embedding is not None and c.search_vector for c in chunks)
+        assert json.loads(checkpoint.read_text())["cursor"] == str(doc.pk)
+
+        out = io.StringIO()
+        call_command("reindex_documents", "--rechunk", "--workers", "1", "--checkpoint", str(checkpoint),
+                     "--resume", stdout=out)
+        assert "0 documents to process" in out.getvalue()
+
+    def test_rechunk_calls_the_api_outside_the_transaction(self, sample_opportunity, tmp_path):
+        from django.core.management import call_command
+        from django.db import connection
+
+        from apps.ai_engine import embeddings
+
+        self._indexed_doc(sample_opportunity)
+        calls = []
+
+        def spy(chunks, backend=None, column="embedding"):
+            with patch.object(embeddings, "_embed_batch", wraps=embeddings._embed_batch) as api:
+                result = embeddings.embed_chunks(chunks, backend, column)
+            calls.append((len(connection.atomic_blocks), api.call_count))
+            return result
+
+        depth = len(connection.atomic_blocks)
+        with (
+            patch("apps.ai_engine.pipeline.chunk_text", side_effect=self._sentences),
+            patch("apps.opportunities.management.commands.reindex_documents.embed_chunks", side_effect=spy),
+        ):
+            call_command("reindex_documents", "--rechunk", "--workers", "1",
+                         "--checkpoint", str(tmp_path / "c.json"))
+
+        assert calls == [(depth, 1), (depth + 1, 0)]
+
+    def test_other_dimensions_refused_up_front(self, sample_opportunity, settings, tmp_path):
+        from django.core.management import CommandError, call_command
+
+        doc = self._indexed_doc(sample_opportunity)
+        settings.EMBEDDING_BACKENDS = {
+            **settings.EMBEDDING_BACKENDS,
+            "local-1024": {"BACKEND": "apps.ai_engine.backends.HashingBackend", "OPTIONS": {"dimensions": 1024}},
+        }
+
+        with pytest.raises(CommandError, match="1024 dimensions"):
+            call_command("reindex_documents", "--dual-write", "--backend", "local-1024",
+                         "--checkpoint", str(tmp_path / "c.json"))
+        assert not doc.chunks.filter(embedding_next__isnull=False).exists()
+
+    def test_dual_write_then_promote(self, sample_opportunity, settings, tmp_path):
+        from django.core.management import call_command
+
+        from apps.ai_engine import embeddings
+
+        doc = self._indexed_doc(sample_opportunity)
+        embeddings.embed_chunks(list(doc.chunks.with_content()))
+        before = doc.chunks.get().embedding.tolist()
+        settings.EMBEDDING_BACKENDS = {
+            **settings.EMBEDDING_BACKENDS,
+            "local-2gram": {"BACKEND": "apps.ai_engine.backends.HashingBackend", "OPTIONS": {"ngram": 2}},
+        }
+
+        call_command("reindex_documents", "--dual-write", "--backend", "local-2gram",
+                     "--checkpoint", str(tmp_path / "c.json"))
+        chunk = doc.chunks.get()
+        assert chunk.embedding.tolist() == before  # still serving the old model
+        assert chunk.embedding_next is not None
+
+        call_command("reindex_documents", "--promote")
+        chunk = doc.chunks.get()
+        assert chunk.embedding.tolist() != before
+        assert chunk.embedding_next is None and chunk.embedding_index is not None
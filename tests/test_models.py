@@ -3,7 +3,12 @@ import pytest
 
 from apps.clients.models import Client, ClientDocument
 from apps.core.utils import dedup_key, normalize_text, object_hash
-from apps.opportunities.models import Opportunity, OpportunityItem
+from apps.opportunities.models import (
+    DocumentChunk,
+    Opportunity,
+    OpportunityDocument,
+    OpportunityItem,
+)
 
 
 class TestCoreUtils:
@@ -72,3 +77,28 @@ class TestOpportunityModel:
         )
         assert item.opportunity == sample_opportunity
         assert sample_opportunity.items.count() == 1
+
+
+class TestOpportunityDocumentModel:
+    def test_extracted_text_lives_out_of_row(self, sample_opportunity):
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        assert doc.get_extracted_text() == ""
+        doc.set_extracted_text("Texto completo do edital")
+
+        listed = sample_opportunity.documents.get()
+        assert listed.get_deferred_fields() == {"page_map"}
+        assert listed.get_extracted_text() == "Texto completo do edital"
+
+    def test_chunk_content_is_sliced_from_document_text(self, sample_opportunity):
+        doc = OpportunityDocument.objects.create(
+            opportunity=sample_opportunity, original_url="https://pncp.gov.br/edital.pdf",
+        )
+        doc.set_extracted_text("Cláusula 1. Objeto.\n\nCláusula 2. Prazo de entrega.")
+        DocumentChunk.objects.create(document=doc, chunk_index=0, start_offset=0, end_offset=19)
+        DocumentChunk.objects.create(document=doc, chunk_index=1, start_offset=21, end_offset=50)
+
+        contents = [c.content for c in doc.chunks.with_content()]
+
+        assert contents == ["Cláusula 1. Objeto.", "Cláusula 2. Prazo de entrega."]